@@ -1,8 +1,53 @@
+import asyncio
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
 import os
+import posixpath
+import queue
+import re
+import secrets
 import sqlite3
-from datetime import datetime, date
-from flask import Flask, render_template, request, redirect, url_for, session
-from werkzeug.utils import secure_filename
+import sys
+import threading
+import time
+import unicodedata
+import zipfile
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from functools import wraps
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape as xml_escape
+try:
+    import numpy as np  # optional: vectorized analytics rebuild
+except ImportError:
+    np = None
+try:
+    from PIL import Image, ImageOps  # optional: thumbnails / WebP variants of uploads
+except ImportError:
+    Image = ImageOps = None
+try:
+    import brotli  # optional: .br variants in build-static
+except ImportError:
+    brotli = None
+try:
+    import weasyprint  # optional: server-side PDF of the contracts
+except (ImportError, OSError):  # OSError: installed but Pango is missing
+    weasyprint = None
+import click
+from flask import (
+    Flask, render_template, request, redirect, url_for, session, g, jsonify, Response,
+    send_from_directory, send_file, make_response, before_render_template, template_rendered,
+)
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.local import Local
+from werkzeug.utils import safe_join, secure_filename
 
 
 # =========================
@@ -10,35 +55,644 @@ from werkzeug.utils import secure_filename
 # =========================
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "change_me")
+# أكبر body مقبول (413 من فوق)، فـ WSGI و ASGI بجوج
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_CONTENT_MB", "16")) * 1024 * 1024
 
 BASE_DIR = os.path.dirname(__file__)
-DB_PATH = os.path.join(BASE_DIR, "data.db")
+DB_PATH = os.environ.get("DB_PATH", os.path.join(BASE_DIR, "data.db"))
 
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "static", "uploads")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# variantes مصغّرين (JPEG + WebP) ديال الصور، كيتخلقو فـ worker pool
+THUMB_FOLDER = os.path.join(UPLOAD_FOLDER, "thumbs")
+IMAGE_WIDTHS = tuple(int(w) for w in os.environ.get("IMAGE_WIDTHS", "320,640,960").split(","))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", "2"))
+# PDF ديال les contrats: كيتخزنو بـ sha256 ديال المحتوى، وكيتولدو فـ worker pool
+FACTURE_FOLDER = os.environ.get("FACTURE_FOLDER", os.path.join(BASE_DIR, "instance", "factures"))
+FACTURE_WORKERS = int(os.environ.get("FACTURE_WORKERS", "2"))
+# الروابط ديال PDF كتبنى بلا request: /static/... كتقرا من الديسك، والـ host غير للشكل
+FACTURE_BASE_URL = os.environ.get("FACTURE_BASE_URL", "http://localhost/")
+
+# connection pool: idle connections kept per process + extra pragmas
+# (DB_PRAGMAS="cache_size=-8000;temp_store=MEMORY")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_PRAGMAS = dict(
+    item.strip().split("=", 1)
+    for item in os.environ.get("DB_PRAGMAS", "").split(";")
+    if "=" in item
+)
+
+# storage tuning applied by init_db / every new connection
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL")
+STORAGE_PRAGMAS = {
+    "synchronous": os.environ.get("DB_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "cache_size": os.environ.get("DB_CACHE_SIZE", "-16000"),  # negative = KiB
+}
+
+# 1 = all writes go through the single writer thread, 0 = write on the request connection
+DB_WRITE_QUEUE = os.environ.get("DB_WRITE_QUEUE", "1") != "0"
 
 ADMIN_USER = "admin"
 ADMIN_PASS = "1234"
 
+# 0 = refresh voitures.statut inside the catalog requests,
+# N > 0 = refresh every N seconds from a background thread instead
+STATUS_REFRESH_INTERVAL = int(os.environ.get("STATUS_REFRESH_INTERVAL", "0"))
+
+# rows per page in the admin listings
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "50"))
+
+# seconds between two dashboard_stats reconciliations, scheduled in the jobs table (0 = only via CLI)
+STATS_RECONCILE_INTERVAL = int(os.environ.get("STATS_RECONCILE_INTERVAL", "3600"))
+
+# public catalog snapshot lifetime in seconds (also rebuilt when the day changes)
+CATALOG_CACHE_TTL = int(os.environ.get("CATALOG_CACHE_TTL", "300"))
+
+# in-memory availability index (set AVAILABILITY_INDEX=0 to use the SQL path only)
+AVAILABILITY_INDEX = os.environ.get("AVAILABILITY_INDEX", "1") != "0"
+
+# أطول نافذة كيقبلها calendrier الأسطول (بالأيام)
+CALENDAR_MAX_DAYS = int(os.environ.get("CALENDAR_MAX_DAYS", "186"))
+
+# cache ديال HTML الصفحات العامة (0 = معطل)
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# fleet alerts: شحال من يوم قبل visite / fin d'assurance كتبان فالdashboard، وشحال من سطر فكل panel
+ALERT_VISITE_DAYS = int(os.environ.get("ALERT_VISITE_DAYS", "30"))
+ALERT_ASSURANCE_DAYS = int(os.environ.get("ALERT_ASSURANCE_DAYS", "30"))
+ALERT_PANEL_LIMIT = int(os.environ.get("ALERT_PANEL_LIMIT", "20"))
+
+# job queue (جدول jobs): workers فكل process (0 = كيزيد jobs وما كينفذهمش)، retries بـ backoff،
+# و job "En cours" بلا خبار JOB_LEASE ثانية كيرجع للـ queue (at-least-once)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "2"))
+JOB_LEASE = int(os.environ.get("JOB_LEASE", "300"))
+JOB_RETRY_BASE = float(os.environ.get("JOB_RETRY_BASE", "5"))
+JOB_KEEP_DAYS = int(os.environ.get("JOB_KEEP_DAYS", "7"))
+
+# ASGI mode (asgi.py): threads ديال الخدمة sync (routes Flask العاديين) و threads ديال
+# lectures SQLite ديال الroutes async. الكتابة كتمشي للwriter وكتتسنى بلا ما تشد thread.
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", "16"))
+DB_THREADS = int(os.environ.get("DB_THREADS", "8"))
+
+# فورمات /demande و /contact: token ديال idempotency (double-click / retry ما كيعاودش يدخل)،
+# token bucket لكل IP ولكل رقم تيليفون (BURST = 0 كيطفيه، PER_MIN = شحال كيرجع فالدقيقة)،
+# و demande قريبة بزاف (نفس tel + voiture + dates) فـ DEMANDE_DEDUPE_MINUTES ما كتدخلش
+SUBMIT_TOKEN_TTL = int(os.environ.get("SUBMIT_TOKEN_TTL", "3600"))
+DEMANDE_DEDUPE_MINUTES = int(os.environ.get("DEMANDE_DEDUPE_MINUTES", "30"))
+SUBMIT_LRU_KEYS = int(os.environ.get("SUBMIT_LRU_KEYS", "50000"))
+RATE_IP_BURST = int(os.environ.get("RATE_IP_BURST", "10"))
+RATE_IP_PER_MIN = float(os.environ.get("RATE_IP_PER_MIN", "5"))
+RATE_TEL_BURST = int(os.environ.get("RATE_TEL_BURST", "3"))
+RATE_TEL_PER_MIN = float(os.environ.get("RATE_TEL_PER_MIN", "0.2"))
+# الbuckets فـ memory ديال كل worker: مع N workers، الlimit الحقيقي كيوصل لـ N مرات هاد الأرقام
+# (إلا بغيتي limit ديال الsite كامل، قسم على WEB_CONCURRENCY).
+# reverse proxies قدام التطبيق (nginx = 1): IP ديال الclient كتاخد من X-Forwarded-For.
+# خاصها تتضبط فـ production: بلاها كاع الزوار عندهم IP ديال الproxy وكيتقاسمو bucket واحد.
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "0"))
+
+# import app كيدير غير init_db إلا ما كانش APP_AUTOINIT=0 (wsgi.py / asgi.py كيعيطو لـ create_app بنفسهم).
+# الthreads ديال الخلفية (jobs, refresher...) ما كيبداو حتى يطلبهم server: post_fork, asgi.py, __main__.
+# CLI (flask ...) و scripts (seed_*, bench_*) ما كيبداوهمش.
+APP_AUTOINIT = os.environ.get("APP_AUTOINIT", "1") != "0"
+
+# بزاف ديال workers: كل request كيقارن cache_epoch باش يعرف واش worker آخر بدّل شي حاجة
+CACHE_EPOCH_CHECK = os.environ.get("CACHE_EPOCH_CHECK", "0") == "1"
+
+# instrumentation: latency / SQL / templates → /metrics (METRICS=0 كيطفيها)
+METRICS_ENABLED = os.environ.get("METRICS", "1") != "0"
+# requests اللي فاتو هاد المدة كيتسجلو فـ log
+SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", "500"))
+# إلا تعطى، /metrics كيطلب Authorization: Bearer <token>
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+
+# =========================
+# Instrumentation
+# =========================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """
+    Minimal Prometheus registry: counters and fixed-bucket histograms keyed
+    by (name, labels). Values are per process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if value <= le:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items:
+            return ""
+        esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, esc)) + "}"
+
+    def render(self, gauges=()):
+        """Prometheus text exposition format; `gauges` is an iterable of (name, labels, value)."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines, typed = [], set()
+
+        def header(name, default_kind):
+            if name not in typed:
+                typed.add(name)
+                kind, text = self._help.get(name, (default_kind, ""))
+                if text:
+                    lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in histograms:
+            header(name, "histogram")
+            for le, n in zip(LATENCY_BUCKETS, h):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', le)])} {n}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {h[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {h[-1]}")
+        for name, labels, value in gauges:
+            header(name, "gauge")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("http_request_duration_seconds", "histogram", "Request latency by route.")
+metrics.describe("http_sql_statements_total", "counter", "SQL statements executed while serving a route.")
+metrics.describe("http_sql_seconds_total", "counter", "Time spent in SQL (execute + fetch) while serving a route.")
+metrics.describe("http_write_wait_seconds_total", "counter", "Time requests spent waiting for their write jobs.")
+metrics.describe("http_slow_requests_total", "counter", "Requests slower than SLOW_REQUEST_MS.")
+metrics.describe("template_render_seconds", "histogram", "Jinja render time by template.")
+metrics.describe("background_sql_statements_total", "counter", "SQL statements outside requests, by thread.")
+metrics.describe("background_sql_seconds_total", "counter", "SQL time outside requests, by thread.")
+metrics.describe("section_duration_seconds", "histogram", "Duration of instrumented functions.")
+metrics.describe("job_duration_seconds", "histogram", "Background job run time by kind.")
+metrics.describe("jobs_total", "counter", "Background job runs by kind and result (done / retry / failed).")
+metrics.describe("job_queue_depth", "gauge", "Jobs in the queue by statut (shared by all processes).")
+metrics.describe("job_queue_lag_seconds", "gauge", "Age of the oldest job waiting to run.")
+metrics.describe("submissions_total", "counter", "Public form submissions by outcome (new, replay, duplicate, limited).")
+metrics.describe("asgi_pool_inflight", "gauge", "ASGI mode: calls running or queued on each thread pool.")
+
+
+class RequestStats:
+    """What one request spent its time on (kept in a thread-local while it runs)."""
+
+    __slots__ = ("t0", "sql_n", "sql_s", "template_s", "write_s", "slowest")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.sql_n = 0
+        self.sql_s = 0.0
+        self.template_s = 0.0
+        self.write_s = 0.0
+        self.slowest = []  # the 5 slowest (seconds, sql)
+
+    def sql(self, statement, seconds):
+        self.sql_n += 1
+        self.sql_s += seconds
+        if len(self.slowest) < 5 or seconds > self.slowest[-1][0]:
+            self.slowest.append((seconds, statement))
+            self.slowest.sort(key=lambda x: -x[0])
+            del self.slowest[5:]
+
+
+# Local = ContextVar: per thread comme threading.local، وper task فـ ASGI mode
+_local = Local()
+
+
+def _record_sql(statement, seconds):
+    stats = getattr(_local, "request", None)
+    if stats is not None:
+        stats.sql(statement, seconds)
+        return
+    source = (("thread", threading.current_thread().name),)
+    metrics.inc("background_sql_statements_total", source)
+    metrics.inc("background_sql_seconds_total", source, seconds)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that reports execute / fetch time to the instrumentation layer."""
+
+    def execute(self, sql, params=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            _record_sql(sql, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            _record_sql(sql, time.perf_counter() - t0)
+
+    def _timed_fetch(self, fetch, *args):
+        t0 = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            stats = getattr(_local, "request", None)
+            if stats is not None:
+                stats.sql_s += time.perf_counter() - t0
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors (and execute shortcuts) are TimedCursor."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+
+def timed_section(name):
+    """Decorator: histogram of the duration of fn under section_duration_seconds{section=name}."""
+    def deco(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe("section_duration_seconds", time.perf_counter() - t0, (("section", name),))
+        return wrapper
+    return deco
+
+
+@app.before_request
+def start_request_stats():
+    if METRICS_ENABLED:
+        _local.request = RequestStats()
+
+
+@app.after_request
+def record_request_stats(response):
+    stats = getattr(_local, "request", None)
+    if stats is None:
+        return response
+    _local.request = None
+
+    elapsed = time.perf_counter() - stats.t0
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    labels = (("route", route), ("method", request.method))
+    metrics.observe("http_request_duration_seconds", elapsed, labels + (("status", str(response.status_code)),))
+    metrics.inc("http_sql_statements_total", labels, stats.sql_n)
+    metrics.inc("http_sql_seconds_total", labels, stats.sql_s)
+    if stats.write_s:
+        metrics.inc("http_write_wait_seconds_total", labels, stats.write_s)
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        metrics.inc("http_slow_requests_total", labels)
+        app.logger.warning(
+            "slow request %s %s -> %s in %.0f ms (sql: %d statements %.0f ms, templates %.0f ms, write wait %.0f ms)%s",
+            request.method, request.full_path.rstrip("?"), response.status_code, elapsed * 1000,
+            stats.sql_n, stats.sql_s * 1000, stats.template_s * 1000, stats.write_s * 1000,
+            "".join(f"\n    {sec * 1000:7.1f} ms  {' '.join(sql.split())[:200]}" for sec, sql in stats.slowest),
+        )
+    return response
+
+
+def _template_started(sender, template, context, **extra):
+    stack = getattr(_local, "templates", None)
+    if stack is None:
+        stack = _local.templates = []
+    stack.append(time.perf_counter())
+
+
+def _template_done(sender, template, context, **extra):
+    stack = getattr(_local, "templates", None)
+    if not stack:
+        return
+    seconds = time.perf_counter() - stack.pop()
+    metrics.observe("template_render_seconds", seconds, (("template", template.name or "<string>"),))
+    stats = getattr(_local, "request", None)
+    if stats is not None and not stack:
+        stats.template_s += seconds
+
+
+if METRICS_ENABLED:
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_done, app)
+
 
 # =========================
 # DB helpers
 # =========================
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, timeout=10)
+    """Open a new connection (used by the pool and by scripts)."""
+    conn = sqlite3.connect(
+        DB_PATH, timeout=10, check_same_thread=False,
+        factory=TimedConnection if METRICS_ENABLED else sqlite3.Connection,
+    )
     conn.row_factory = sqlite3.Row
+    for name, value in {**STORAGE_PRAGMAS, **DB_PRAGMAS}.items():
+        conn.execute(f"PRAGMA {name}={value}")
     return conn
 
 
+class ConnectionPool:
+    """
+    Small pool of idle sqlite connections.
+    acquire() reuses an idle connection (hit) or opens a new one (miss);
+    release() rolls back anything left uncommitted and keeps the connection
+    if the pool is not full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            self.misses += 1
+        return get_conn()
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.discarded += 1
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def reset_after_fork(self):
+        # connections inherited from the parent must not be used (nor closed) here
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "hits": self.hits,
+                "misses": self.misses,
+                "discarded": self.discarded,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+
 
 def get_db():
-    return get_conn()
+    """Return the connection of the current app context (one per request)."""
+    if "db" not in g:
+        g.db = db_pool.acquire()
+    return g.db
 
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
+@app.teardown_appcontext
+def close_db(exc=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        db_pool.release(conn)
+
+
+class ForkAwarePool:
+    """
+    Lazily created ThreadPoolExecutor, rebuilt in a forked child (the
+    parent's pool threads do not exist there). Shared by every worker pool.
+    """
+
+    def __init__(self, workers, name):
+        self.workers = workers
+        self.name = name
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+
+    def executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+                self._pid = os.getpid()
+            return self._pool
+
+    def submit(self, fn, *args):
+        return self.executor().submit(fn, *args)
+
+
+class WriteQueue:
+    """
+    Single writer: one dedicated thread owns a connection and drains a queue
+    of write jobs, committing each one. Requests never write concurrently,
+    so with WAL readers never wait behind a writer and writers never fight
+    over the lock inside this process.
+
+    A job is a callable job(conn, *args); its return value (or exception)
+    is handed back to the caller through a Future.
+    """
 
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.done = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        # after a fork the writer thread does not exist in the child
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _loop(self):
+        conn = get_conn()
+        q = self._queue
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            fut, job, args = item
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                result = job(conn, *args)
+                conn.commit()
+            except BaseException as e:
+                conn.rollback()
+                self.failed += 1
+                fut.set_exception(e)
+            else:
+                self.done += 1
+                fut.set_result(result)
+        conn.close()
+
+    def submit(self, job, *args):
+        self._ensure_started()
+        fut = Future()
+        self._queue.put((fut, job, args))
+        return fut
+
+    def run(self, job, *args):
+        return self.submit(job, *args).result()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+
+db_writer = WriteQueue()
+
+
+def run_write(job, *args):
+    """Run job(conn, *args) as one committed write transaction."""
+    if CACHE_EPOCH_CHECK:
+        result, before, after = _run_write(_epoch_tracked, job, *args)
+        shared_epoch.own_write(before, after)
+        return result
+    return _run_write(job, *args)
+
+
+def _run_write(job, *args):
+    stats = getattr(_local, "request", None)
+    if DB_WRITE_QUEUE:
+        if stats is None:
+            return db_writer.run(job, *args)
+        t0 = time.perf_counter()
+        try:
+            return db_writer.run(job, *args)
+        finally:
+            stats.write_s += time.perf_counter() - t0
+
+    conn = get_db()
+    try:
+        result = job(conn, *args)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return result
+
+
+def _epoch_tracked(conn, job, *args):
+    # BEGIN IMMEDIATE: ما كاين حتى process آخر يكتب بين القراءتين، الفرق ديالنا بوحدنا
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    before = shared_epoch.read(conn)
+    result = job(conn, *args)
+    return result, before, shared_epoch.read(conn)
+
+
+def execute_write(sql, params=()):
+    """Run one INSERT/UPDATE through run_write and return its lastrowid."""
+    return run_write(lambda conn: conn.execute(sql, params).lastrowid)
+
+
+def configure_storage(conn):
+    """journal_mode is stored in the DB file, the other pragmas are per connection (see get_conn)."""
+    mode = conn.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}").fetchone()[0]
+    if mode.lower() != DB_JOURNAL_MODE.lower():
+        app.logger.warning("journal_mode=%s requested, SQLite kept %s", DB_JOURNAL_MODE, mode)
+
+
+def _parse_day(value):
+    """Return the ordinal of a 'YYYY-MM-DD' string, or None if it does not parse."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date().toordinal()
+    except Exception:
+        return None
+
+
+# =========================
+# Schema migrations
+# =========================
+# كل migration كتطبق مرة وحدة، والنسخة كتتسجل فـ PRAGMA user_version
+MIGRATIONS = []
+
+
+def migration(version):
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+@migration(1)
+def _m001_initial_schema(cur):
+    """Base tables (IF NOT EXISTS so databases created before migrations upgrade cleanly)."""
     # جدول العقود
     cur.execute("""
     CREATE TABLE IF NOT EXISTS contrats (
@@ -123,227 +777,2686 @@ def init_db():
         )
     """)
 
-    conn.commit()
-    conn.close()
 
+@migration(2)
+def _m002_lookup_indexes(cur):
+    """Indexes for the hot availability / status / invoice lookups."""
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_contrats_voiture_statut_dates
+        ON contrats(voiture_nom, statut, date_debut, date_fin)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_demandes_voiture_statut_dates
+        ON demandes(voiture, statut, date_debut, date_fin)
+    """)
+    # refresh_car_statuses: "who is rented today" without a car name
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_contrats_statut_dates
+        ON contrats(statut, date_debut, date_fin, voiture_nom)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_demandes_statut_dates
+        ON demandes(statut, date_debut, date_fin, voiture)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_contrats_demande_id ON contrats(demande_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_voitures_nom ON voitures(nom)")
+
+
+@migration(3)
+def _m003_voiture_id(cur):
+    """Integer car reference on demandes/contrats; the name columns stay as display values."""
+    for table, name_col in (("demandes", "voiture"), ("contrats", "voiture_nom")):
+        cols = [r[1] for r in cur.execute(f"PRAGMA table_info({table})")]
+        if "voiture_id" not in cols:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN voiture_id INTEGER REFERENCES voitures(id)")
+        # backfill: أول سيارة عندها نفس الاسم
+        cur.execute(f"""
+            UPDATE {table}
+            SET voiture_id = (SELECT MIN(v.id) FROM voitures v WHERE v.nom = {table}.{name_col})
+            WHERE voiture_id IS NULL
+        """)
+
+    cur.execute("DROP INDEX IF EXISTS idx_contrats_voiture_statut_dates")
+    cur.execute("DROP INDEX IF EXISTS idx_demandes_voiture_statut_dates")
+    cur.execute("DROP INDEX IF EXISTS idx_contrats_statut_dates")
+    cur.execute("DROP INDEX IF EXISTS idx_demandes_statut_dates")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_contrats_vid_statut_dates
+        ON contrats(voiture_id, statut, date_debut, date_fin)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_demandes_vid_statut_dates
+        ON demandes(voiture_id, statut, date_debut, date_fin)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_contrats_statut_dates_vid
+        ON contrats(statut, date_debut, date_fin, voiture_id)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_demandes_statut_dates_vid
+        ON demandes(statut, date_debut, date_fin, voiture_id)
+    """)
 
-# create tables once
-init_db()
 
+@migration(4)
+def _m004_voitures_fts(cur):
+    """Full-text index over voitures (accent-insensitive), kept in sync by triggers."""
+    try:
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS voitures_fts USING fts5(
+                nom, categorie, immatriculation,
+                content='voitures', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite بلا FTS5: البحث كيرجع لـ LIKE
+        app.logger.warning("FTS5 not available, car search falls back to LIKE")
+        return
 
-# =========================
-# Auth helper
-# =========================
-def require_admin():
-    return bool(session.get("admin_ok"))
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS voitures_fts_ai AFTER INSERT ON voitures BEGIN
+            INSERT INTO voitures_fts(rowid, nom, categorie, immatriculation)
+            VALUES (new.id, new.nom, new.categorie, new.immatriculation);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS voitures_fts_ad AFTER DELETE ON voitures BEGIN
+            INSERT INTO voitures_fts(voitures_fts, rowid, nom, categorie, immatriculation)
+            VALUES ('delete', old.id, old.nom, old.categorie, old.immatriculation);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS voitures_fts_au
+        AFTER UPDATE OF nom, categorie, immatriculation ON voitures BEGIN
+            INSERT INTO voitures_fts(voitures_fts, rowid, nom, categorie, immatriculation)
+            VALUES ('delete', old.id, old.nom, old.categorie, old.immatriculation);
+            INSERT INTO voitures_fts(rowid, nom, categorie, immatriculation)
+            VALUES (new.id, new.nom, new.categorie, new.immatriculation);
+        END
+    """)
+    cur.execute("INSERT INTO voitures_fts(voitures_fts) VALUES ('rebuild')")
+
+
+DASHBOARD_COUNTS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM demandes) AS total_reservations,
+        (SELECT COUNT(*) FROM voitures) AS total_voitures,
+        (SELECT COUNT(*) FROM voitures WHERE statut='Disponible') AS total_disponibles,
+        (SELECT COUNT(*) FROM voitures WHERE statut='Louée') AS total_loues,
+        (SELECT COUNT(*) FROM clients) AS total_clients
+"""
+DASHBOARD_COLUMNS = ("total_reservations", "total_voitures", "total_disponibles", "total_loues", "total_clients")
+
+
+def _reconcile_stats(cur):
+    """Recount and overwrite dashboard_stats; returns {column: (stored, actual)} for what drifted."""
+    actual = cur.execute(DASHBOARD_COUNTS_SQL).fetchone()
+    stored = cur.execute("SELECT * FROM dashboard_stats WHERE id = 1").fetchone()
+    drift = {
+        col: (stored[col] if stored else None, actual[col])
+        for col in DASHBOARD_COLUMNS
+        if stored is None or stored[col] != actual[col]
+    }
+    cur.execute(f"""
+        INSERT OR REPLACE INTO dashboard_stats(id, {", ".join(DASHBOARD_COLUMNS)}, reconciled_at)
+        VALUES (1, {", ".join("?" * len(DASHBOARD_COLUMNS))}, ?)
+    """, tuple(actual[col] for col in DASHBOARD_COLUMNS) + (datetime.now().strftime("%Y-%m-%d %H:%M"),))
+    return drift
+
+
+@migration(5)
+def _m005_dashboard_stats(cur):
+    """Materialized dashboard counters, maintained by triggers."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS dashboard_stats(
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_reservations INTEGER NOT NULL DEFAULT 0,
+            total_voitures INTEGER NOT NULL DEFAULT 0,
+            total_disponibles INTEGER NOT NULL DEFAULT 0,
+            total_loues INTEGER NOT NULL DEFAULT 0,
+            total_clients INTEGER NOT NULL DEFAULT 0,
+            reconciled_at TEXT
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO dashboard_stats(id) VALUES (1)")
+
+    for table, column in (("demandes", "total_reservations"), ("clients", "total_clients")):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_stats_ai AFTER INSERT ON {table} BEGIN
+                UPDATE dashboard_stats SET {column} = {column} + 1 WHERE id = 1;
+            END
+        """)
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_stats_ad AFTER DELETE ON {table} BEGIN
+                UPDATE dashboard_stats SET {column} = {column} - 1 WHERE id = 1;
+            END
+        """)
 
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS voitures_stats_ai AFTER INSERT ON voitures BEGIN
+            UPDATE dashboard_stats SET
+                total_voitures = total_voitures + 1,
+                total_disponibles = total_disponibles + (new.statut IS 'Disponible'),
+                total_loues = total_loues + (new.statut IS 'Louée')
+            WHERE id = 1;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS voitures_stats_ad AFTER DELETE ON voitures BEGIN
+            UPDATE dashboard_stats SET
+                total_voitures = total_voitures - 1,
+                total_disponibles = total_disponibles - (old.statut IS 'Disponible'),
+                total_loues = total_loues - (old.statut IS 'Louée')
+            WHERE id = 1;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS voitures_stats_au AFTER UPDATE OF statut ON voitures
+        WHEN old.statut IS NOT new.statut BEGIN
+            UPDATE dashboard_stats SET
+                total_disponibles = total_disponibles
+                    + (new.statut IS 'Disponible') - (old.statut IS 'Disponible'),
+                total_loues = total_loues
+                    + (new.statut IS 'Louée') - (old.statut IS 'Louée')
+            WHERE id = 1;
+        END
+    """)
+    _reconcile_stats(cur)
 
-# =========================
-# Business helpers
-# =========================
-def is_car_rented_today(car_id=None, car_name=None):
-    """Return True if car is rented today (contrat Actif or demande Confirmée covers today)."""
-    conn = get_db()
-    cur = conn.cursor()
-    today = date.today()
 
-    if car_name:
-        # عقود نشطة
-        cur.execute("""
-            SELECT date_debut, date_fin
-            FROM contrats
-            WHERE voiture_nom=?
-              AND statut='Actif'
-        """, (car_name,))
-        contrats = cur.fetchall()
+@migration(6)
+def _m006_analytics_rollups(cur):
+    """Pre-aggregated revenue / utilization rollups over contrats."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_daily(
+            day TEXT PRIMARY KEY,
+            revenue REAL NOT NULL DEFAULT 0,
+            jours_loues INTEGER NOT NULL DEFAULT 0,
+            contrats INTEGER NOT NULL DEFAULT 0,
+            jours_contrats INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_car_month(
+            mois TEXT NOT NULL,
+            voiture_id INTEGER NOT NULL,
+            revenue REAL NOT NULL DEFAULT 0,
+            jours_loues INTEGER NOT NULL DEFAULT 0,
+            contrats INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (mois, voiture_id)
+        ) WITHOUT ROWID
+    """)
+    _rebuild_analytics(cur.connection)
 
-        for c in contrats:
-            try:
-                d1 = datetime.strptime(c["date_debut"], "%Y-%m-%d").date()
-                d2 = datetime.strptime(c["date_fin"], "%Y-%m-%d").date()
-                if d1 <= today <= d2:
-                    conn.close()
-                    return True
-            except Exception:
-                continue
 
-        # طلبات Confirmée
-        cur.execute("""
-            SELECT date_debut, date_fin
-            FROM demandes
-            WHERE voiture=?
-              AND statut='Confirmée'
-        """, (car_name,))
-        rows = cur.fetchall()
+@migration(7)
+def _m007_image_variants(cur):
+    """Resized JPEG / WebP variants of the uploaded images and their dimensions."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS image_variants(
+            image TEXT NOT NULL,
+            fmt TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            file TEXT NOT NULL,
+            PRIMARY KEY (image, fmt, width)
+        ) WITHOUT ROWID
+    """)
 
-        for r in rows:
-            try:
-                d1 = datetime.strptime(r["date_debut"], "%Y-%m-%d").date()
-                d2 = datetime.strptime(r["date_fin"], "%Y-%m-%d").date()
-                if d1 <= today <= d2:
-                    conn.close()
-                    return True
-            except Exception:
-                continue
 
-    conn.close()
-    return False
+@migration(8)
+def _m008_cache_epoch(cur):
+    """Counter bumped by every write the in-process caches depend on (multi-worker invalidation)."""
+    cur.execute("CREATE TABLE IF NOT EXISTS cache_epoch(id INTEGER PRIMARY KEY CHECK (id = 1), n INTEGER NOT NULL)")
+    cur.execute("INSERT OR IGNORE INTO cache_epoch(id, n) VALUES (1, 0)")
+    bump = "BEGIN UPDATE cache_epoch SET n = n + 1 WHERE id = 1; END"
+    for name, event in {
+        "voitures_ins": "AFTER INSERT ON voitures",
+        "voitures_upd": "AFTER UPDATE ON voitures",
+        "voitures_del": "AFTER DELETE ON voitures",
+        "contrats_ins": "AFTER INSERT ON contrats",
+        "contrats_upd": "AFTER UPDATE OF statut, voiture_id, date_debut, date_fin ON contrats",
+        "contrats_del": "AFTER DELETE ON contrats",
+        "demandes_ins": "AFTER INSERT ON demandes WHEN NEW.statut = 'Confirmée'",
+        "demandes_upd": "AFTER UPDATE OF statut, voiture_id, date_debut, date_fin ON demandes",
+        "demandes_del": "AFTER DELETE ON demandes WHEN OLD.statut = 'Confirmée'",
+        "images_ins": "AFTER INSERT ON image_variants",
+    }.items():
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_epoch_{name} {event} {bump}")
+
+
+@migration(9)
+def _m009_fleet_compliance(cur):
+    """Damage, technical inspection and insurance records per car + the due-soon alert queue."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS voiture_incidents(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            voiture_id INTEGER NOT NULL,
+            date_incident TEXT NOT NULL,
+            degat TEXT,
+            statut TEXT NOT NULL DEFAULT 'Ouvert',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_incidents_vid_statut ON voiture_incidents(voiture_id, statut)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS voiture_visites(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            voiture_id INTEGER NOT NULL,
+            date_visite TEXT NOT NULL,
+            prochaine_visite TEXT NOT NULL,
+            notes TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_visites_vid_date ON voiture_visites(voiture_id, date_visite)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS voiture_assurances(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            voiture_id INTEGER NOT NULL,
+            assureur TEXT,
+            police TEXT,
+            debut TEXT,
+            fin TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_assurances_vid_fin ON voiture_assurances(voiture_id, fin)")
+    # queue: سطر واحد لكل (kind, voiture) مع date d'échéance
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS fleet_alerts(
+            kind TEXT NOT NULL,
+            voiture_id INTEGER NOT NULL,
+            due TEXT NOT NULL,
+            info TEXT,
+            PRIMARY KEY (kind, voiture_id)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fleet_alerts_kind_due ON fleet_alerts(kind, due)")
 
 
-def is_car_available_between(car_name, date_debut, date_fin, ignore_demande_id=None):
-    """
-    Return True if car is available between date_debut and date_fin.
-    Checks:
-      - contrats Actif overlapping
-      - demandes Confirmée overlapping
-    """
-    try:
-        dd = datetime.strptime(date_debut, "%Y-%m-%d").date()
-        df = datetime.strptime(date_fin, "%Y-%m-%d").date()
-        if df < dd:
-            dd, df = df, dd
-    except Exception:
-        return False
+@migration(10)
+def _m010_facture_pdfs(cur):
+    """Which cached PDF (content hash) belongs to each confirmed demande."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS facture_pdfs(
+            demande_id INTEGER PRIMARY KEY,
+            sha TEXT NOT NULL,
+            size INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
 
-    conn = get_conn()
-    cur = conn.cursor()
 
-    # 1) Overlap with contrats Actif
+@migration(11)
+def _m011_jobs(cur):
+    """Durable background jobs: queued in the same transaction as the work that needs them."""
     cur.execute("""
-        SELECT date_debut, date_fin
-        FROM contrats
-        WHERE voiture_nom=?
-          AND statut='Actif'
-    """, (car_name,))
-    contrats = cur.fetchall()
+        CREATE TABLE IF NOT EXISTS jobs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            dedupe TEXT,
+            statut TEXT NOT NULL DEFAULT 'En attente',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            run_after REAL NOT NULL,
+            locked_by TEXT,
+            locked_at REAL,
+            last_error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_statut_run_after ON jobs(statut, run_after)")
+    # job واحد "En attente" لكل (kind, dedupe)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_pending_dedupe ON jobs(kind, dedupe)
+        WHERE statut='En attente' AND dedupe IS NOT NULL
+    """)
 
-    for c in contrats:
-        try:
-            c_dd = datetime.strptime(c["date_debut"], "%Y-%m-%d").date()
-            c_df = datetime.strptime(c["date_fin"], "%Y-%m-%d").date()
-            # overlap if ranges intersect
-            if not (df < c_dd or dd > c_df):
-                conn.close()
-                return False
-        except Exception:
-            continue
 
-    # 2) Overlap with demandes Confirmée
-    if ignore_demande_id is not None:
-        cur.execute("""
-            SELECT date_debut, date_fin
-            FROM demandes
-            WHERE voiture=?
-              AND statut='Confirmée'
-              AND id != ?
-        """, (car_name, ignore_demande_id))
-    else:
-        cur.execute("""
-            SELECT date_debut, date_fin
-            FROM demandes
-            WHERE voiture=?
-              AND statut='Confirmée'
-        """, (car_name,))
+@migration(12)
+def _m012_submit_tokens(cur):
+    """Idempotency token of the public forms: a replayed POST cannot insert twice, even on another worker."""
+    for table in ("demandes", "contacts"):
+        cols = [r[1] for r in cur.execute(f"PRAGMA table_info({table})")]
+        if "submit_token" not in cols:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN submit_token TEXT")
+        cur.execute(f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_submit_token ON {table}(submit_token)
+            WHERE submit_token IS NOT NULL
+        """)
+
+
+@migration(13)
+def _m013_jobs_by_kind(cur):
+    """Last run / waiting run of a scheduled job kind (see _schedule_jobs)."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind_run_after ON jobs(kind, run_after)")
+
+
+# trigger -> (cache whose epoch it bumps, event); see SharedEpoch
+CACHE_EPOCH_TRIGGERS = {
+    "voitures_ins": ("voitures", "AFTER INSERT ON voitures"),
+    "voitures_upd": ("voitures", "AFTER UPDATE ON voitures"),
+    "voitures_del": ("voitures", "AFTER DELETE ON voitures"),
+    "contrats_ins": ("bookings", "AFTER INSERT ON contrats"),
+    "contrats_upd": ("bookings", "AFTER UPDATE OF statut, voiture_id, date_debut, date_fin ON contrats"),
+    "contrats_del": ("bookings", "AFTER DELETE ON contrats"),
+    "demandes_ins": ("bookings", "AFTER INSERT ON demandes WHEN NEW.statut = 'Confirmée'"),
+    "demandes_upd": ("bookings", "AFTER UPDATE OF statut, voiture_id, date_debut, date_fin ON demandes"),
+    "demandes_del": ("bookings", "AFTER DELETE ON demandes WHEN OLD.statut = 'Confirmée'"),
+    "images_ins": ("images", "AFTER INSERT ON image_variants"),
+}
+
+
+@migration(14)
+def _m014_cache_epochs(cur):
+    """One epoch per cache: a booking no longer drops the catalog and the image variants of every worker."""
+    cur.execute("CREATE TABLE IF NOT EXISTS cache_epochs(name TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID")
+    for name, (cache, event) in CACHE_EPOCH_TRIGGERS.items():
+        cur.execute("INSERT OR IGNORE INTO cache_epochs(name, n) VALUES (?, 0)", (cache,))
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_epoch_{name}")
+        cur.execute(
+            f"CREATE TRIGGER trg_epoch_{name} {event} "
+            f"BEGIN UPDATE cache_epochs SET n = n + 1 WHERE name = '{cache}'; END"
+        )
+    cur.execute("DROP TABLE IF EXISTS cache_epoch")
+
 
-    demandes = cur.fetchall()
-    for d in demandes:
+def migrate(conn):
+    """Apply pending migrations in order; each one runs in its own transaction."""
+    applied = []
+    for version, fn in MIGRATIONS:
+        # BEGIN IMMEDIATE + re-read: safe when several processes start together
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            d_dd = datetime.strptime(d["date_debut"], "%Y-%m-%d").date()
-            d_df = datetime.strptime(d["date_fin"], "%Y-%m-%d").date()
-            if not (df < d_dd or dd > d_df):
-                conn.close()
-                return False
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                conn.rollback()
+                continue
+            fn(conn.cursor())
+            conn.execute(f"PRAGMA user_version={int(version)}")
+            conn.commit()
         except Exception:
-            continue
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
 
+
+def init_db():
+    global HAS_FTS
+    conn = get_conn()
+    configure_storage(conn)
+    applied = migrate(conn)
+    if applied:
+        app.logger.info("applied migrations %s", applied)
+    HAS_FTS = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name='voitures_fts'"
+    ).fetchone() is not None
     conn.close()
-    return True
 
 
-def refresh_car_statuses():
-    """Update voitures.statut based on today's rentals WITHOUT nested connections."""
+HAS_FTS = False
+
+
+# queries that must stay on an index (checked by `flask check-query-plans`)
+HOT_QUERIES = {
+    "contrats actifs par voiture": (
+        "SELECT 1 FROM contrats WHERE voiture_id=:vid AND statut='Actif' "
+        "AND ((date_debut <= :fin AND date_fin >= :debut) OR (date_fin <= :fin AND date_debut >= :debut))",
+        {"vid": 1, "debut": "2000-01-01", "fin": "2000-01-01"},
+    ),
+    "demandes confirmées par voiture": (
+        "SELECT 1 FROM demandes WHERE voiture_id=:vid AND statut='Confirmée' "
+        "AND ((date_debut <= :fin AND date_fin >= :debut) OR (date_fin <= :fin AND date_debut >= :debut))",
+        {"vid": 1, "debut": "2000-01-01", "fin": "2000-01-01"},
+    ),
+    "chevauchement réservation": (
+        "SELECT 1 FROM contrats WHERE voiture_id=:vid AND statut='Actif' "
+        "AND ((date_debut <= :fin AND date_fin >= :debut) OR (date_fin <= :fin AND date_debut >= :debut)) "
+        "AND (demande_id IS NULL OR demande_id != :rid) "
+        "UNION ALL "
+        "SELECT 1 FROM demandes WHERE voiture_id=:vid AND statut='Confirmée' "
+        "AND ((date_debut <= :fin AND date_fin >= :debut) OR (date_fin <= :fin AND date_debut >= :debut)) AND id != :rid",
+        {"vid": 1, "debut": "2000-01-01", "fin": "2000-01-01", "rid": 1},
+    ),
+    "contrats actifs aujourd'hui": (
+        "SELECT voiture_id FROM contrats WHERE statut='Actif' "
+        "AND ((date_debut <= :today AND date_fin >= :today) OR (date_fin <= :today AND date_debut >= :today))",
+        {"today": "2000-01-01"},
+    ),
+    "demandes confirmées aujourd'hui": (
+        "SELECT voiture_id FROM demandes WHERE statut='Confirmée' "
+        "AND ((date_debut <= :today AND date_fin >= :today) OR (date_fin <= :today AND date_debut >= :today))",
+        {"today": "2000-01-01"},
+    ),
+    "calendrier flotte": (
+        "SELECT voiture_id, date_debut, date_fin FROM contrats WHERE statut='Actif' "
+        "AND ((date_debut <= :au AND date_fin >= :du) OR (date_fin <= :au AND date_debut >= :du)) "
+        "UNION ALL "
+        "SELECT voiture_id, date_debut, date_fin FROM demandes WHERE statut='Confirmée' "
+        "AND ((date_debut <= :au AND date_fin >= :du) OR (date_fin <= :au AND date_debut >= :du))",
+        {"du": "2000-01-01", "au": "2000-01-01"},
+    ),
+    "voiture par nom": (
+        "SELECT categorie, prix_jour, immatriculation FROM voitures WHERE nom=? LIMIT 1",
+        ("x",),
+    ),
+    "contrat par demande": (
+        "SELECT id FROM contrats WHERE demande_id=? LIMIT 1",
+        (1,),
+    ),
+    "alertes flotte": (
+        "SELECT voiture_id, due, info FROM fleet_alerts WHERE kind=? AND due <= ? ORDER BY due LIMIT ?",
+        ("visite", "2000-01-01", 20),
+    ),
+    "prochain job": (
+        "SELECT id FROM jobs WHERE statut=? AND run_after <= ? ORDER BY run_after LIMIT 1",
+        ("En attente", 0),
+    ),
+}
+
+
+def full_scans(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN steps of `sql` that scan a table without an index."""
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [
+        r[3] for r in plan
+        if r[3].startswith("SCAN ") and " INDEX " not in r[3] and "SUBQUERY" not in r[3]
+    ]
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans():
+    """Fail if a hot query regressed to a full table scan."""
     conn = get_conn()
-    cur = conn.cursor()
-    today = date.today().strftime("%Y-%m-%d")
+    bad = {name: full_scans(conn, sql, params) for name, (sql, params) in HOT_QUERIES.items()}
+    conn.close()
+    bad = {k: v for k, v in bad.items() if v}
+    for name, steps in bad.items():
+        print(f"FULL SCAN  {name}: {'; '.join(steps)}")
+    if bad:
+        raise SystemExit(1)
+    print(f"OK  {len(HOT_QUERIES)} hot queries use an index")
 
-    cur.execute("SELECT id, nom FROM voitures")
-    voitures = cur.fetchall()
 
-    for v in voitures:
-        name = v["nom"]
+# =========================
+# Job queue
+# =========================
+# الخدمة التقيلة اللي كانت فالـ routes ولات jobs فجدول jobs:
+#   route → enqueue_job فنفس transaction ديال الكتابة → JobQueue workers كينفذو
+# الجدول كيبقى بعد restart، و job اللي مات الworker ديالو كيرجع بعد JOB_LEASE.
+# handlers خاصهم يكونو idempotent (ممكن يتعاودو).
+# jobs دورية (every=N): maintenance كتزيد run واحد "En attente" N ثانية من بعد اللي فات،
+# فالجدول، يعني run واحد لكل N ثانية فكاع الprocesses (ماشي واحد فكل worker ملي كيبدا).
+JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED = "En attente", "En cours", "Terminé", "Échoué"
+JOB_HANDLERS = {}
+JOB_SCHEDULE = {}
+
+
+def job_handler(kind, max_attempts=5, every=0):
+    """Register fn(**payload) as the handler of `kind` jobs; every=N also runs it every N seconds."""
+    def deco(fn):
+        JOB_HANDLERS[kind] = (fn, max_attempts)
+        if every > 0:
+            JOB_SCHEDULE[kind] = every
+        return fn
+    return deco
+
+
+def enqueue_job(conn, kind, payload=None, dedupe=None, delay=0):
+    """
+    Insert a job on `conn`, inside the caller's transaction: it commits (or
+    rolls back) with the write that needs it. Returns its id, or None when a
+    (kind, dedupe) job is already waiting.
+    """
+    _, max_attempts = JOB_HANDLERS[kind]
+    cur = conn.execute("""
+        INSERT OR IGNORE INTO jobs(kind, payload, dedupe, statut, max_attempts, run_after)
+        VALUES(?,?,?,?,?,?)
+    """, (kind, json.dumps(payload or {}), dedupe, JOB_PENDING, max_attempts, time.time() + delay))
+    return cur.lastrowid if cur.rowcount else None
+
+
+def enqueue(kind, payload=None, dedupe=None, delay=0):
+    """Queue a job on its own write (durable when this returns) and wake the workers."""
+    job_id = run_write(enqueue_job, kind, payload, dedupe, delay)
+    job_queue.wake()
+    return job_id
+
+
+def _claim_job(conn, worker, now):
+    # dedupe=NULL: من بعد ما بدا، job جديد بنفس المفتاح يقدر يتزاد
+    return conn.execute("""
+        UPDATE jobs
+        SET statut=?, attempts=attempts + 1, locked_by=?, locked_at=?, dedupe=NULL
+        WHERE id = (SELECT id FROM jobs WHERE statut=? AND run_after <= ? ORDER BY run_after LIMIT 1)
+        RETURNING id, kind, payload, attempts, max_attempts
+    """, (JOB_RUNNING, worker, now, JOB_PENDING, now)).fetchone()
+
+
+def _finish_job(conn, job_id, worker, error=None, retry_at=None):
+    """done (no error), back to the queue (retry_at) or failed for good."""
+    if error is None:
+        statut, run_after = JOB_DONE, time.time()
+    elif retry_at is not None:
+        statut, run_after = JOB_PENDING, retry_at
+    else:
+        statut, run_after = JOB_FAILED, time.time()
+    # locked_by: إلا الـ lease فات وخداه worker آخر، ما نكتبوش فوقو
+    conn.execute("""
+        UPDATE jobs
+        SET statut=?, run_after=?, last_error=COALESCE(?, last_error), locked_by=NULL,
+            finished_at=CASE WHEN ? THEN CURRENT_TIMESTAMP END
+        WHERE id=? AND locked_by=?
+    """, (statut, run_after, error, statut != JOB_PENDING, job_id, worker))
+
+
+def _maintain_jobs(conn, now):
+    """Expired leases back to the queue (or failed when out of attempts), purge old done jobs."""
+    reaped = conn.execute("""
+        UPDATE jobs
+        SET statut=CASE WHEN attempts >= max_attempts THEN ? ELSE ? END,
+            last_error='lease expired (worker stopped?)', locked_by=NULL, run_after=?
+        WHERE statut=? AND locked_at < ?
+    """, (JOB_FAILED, JOB_PENDING, now, JOB_RUNNING, now - JOB_LEASE)).rowcount
+    conn.execute("DELETE FROM jobs WHERE statut=? AND run_after < ?", (JOB_DONE, now - JOB_KEEP_DAYS * 86400))
+    return reaped
+
+
+def _schedule_jobs(conn, now):
+    """
+    Queue the next run of every scheduled kind that has none waiting or
+    running: due `every` seconds after the last run (now if it never ran).
+    """
+    queued = 0
+    for kind, every in JOB_SCHEDULE.items():
+        busy = conn.execute(
+            "SELECT 1 FROM jobs WHERE kind=? AND statut IN (?,?) LIMIT 1", (kind, JOB_PENDING, JOB_RUNNING)
+        ).fetchone()
+        if busy:
+            continue
+        # run_after ديال job سالي = وقت الساليان ديالو
+        last = conn.execute("SELECT MAX(run_after) FROM jobs WHERE kind=?", (kind,)).fetchone()[0]
+        delay = max(0.0, last + every - now) if last is not None else 0
+        if enqueue_job(conn, kind, dedupe="schedule", delay=delay) is not None:
+            queued += 1
+    return queued
 
-        # check contrats Actif that cover today
-        cur.execute("""
-            SELECT 1
-            FROM contrats
-            WHERE voiture_nom=?
-              AND statut='Actif'
-              AND date_debut <= ?
-              AND date_fin >= ?
-            LIMIT 1
-        """, (name, today, today))
-        rented = cur.fetchone() is not None
-
-        # if not rented by contrat, check demandes Confirmée
-        if not rented:
-            cur.execute("""
-                SELECT 1
-                FROM demandes
-                WHERE voiture=?
-                  AND statut='Confirmée'
-                  AND date_debut <= ?
-                  AND date_fin >= ?
-                LIMIT 1
-            """, (name, today, today))
-            rented = cur.fetchone() is not None
-
-        new_status = "Louée" if rented else "Disponible"
-        cur.execute("UPDATE voitures SET statut=? WHERE id=?", (new_status, v["id"]))
-
-    conn.commit()
-    conn.close()
 
-    """Update voitures.statut based on today's rentals."""
-    conn = get_conn()
-    cur = conn.cursor()
+def maintain_jobs():
+    def job(conn, now):
+        return _maintain_jobs(conn, now), _schedule_jobs(conn, now)
 
-    cur.execute("SELECT id, nom FROM voitures")
-    voitures = cur.fetchall()
+    reaped, queued = run_write(job, time.time())
+    if reaped:
+        app.logger.warning("%s background jobs re-queued after their lease expired", reaped)
+    if reaped or queued:
+        job_queue.wake()
+    return reaped
 
-    for v in voitures:
-        rented = is_car_rented_today(car_name=v["nom"])
-        new_status = "Louée" if rented else "Disponible"
-        cur.execute("UPDATE voitures SET statut=? WHERE id=?", (new_status, v["id"]))
 
-    conn.commit()
-    conn.close()
+class JobQueue:
+    """
+    Worker threads that run the jobs table. A claim is one UPDATE ... RETURNING
+    through the writer, so a job goes to exactly one worker, in any process.
+    Failures are retried with exponential backoff up to max_attempts.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        # after a fork the worker threads do not exist in the child
+        with self._lock:
+            if self.workers <= 0 or (self._threads and self._pid == os.getpid()):
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            self._threads = [
+                threading.Thread(target=self._loop, name=f"jobs-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def stop(self):
+        if self._threads and self._pid == os.getpid():
+            self._stop.set()
+            self._wake.set()
+            for t in self._threads:
+                t.join()
+        self._threads = []
+
+    def wake(self):
+        self._wake.set()
+
+    def running(self):
+        """True when this process has live worker threads."""
+        return bool(self._threads) and self._pid == os.getpid()
+
+    def _loop(self):
+        worker = f"{os.getpid()}:{threading.current_thread().name}"
+        while not self._stop.is_set():
+            try:
+                ran = self.run_one(worker)
+            except Exception:
+                app.logger.exception("job queue")
+                ran = False
+            if not ran:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+
+    def run_one(self, worker=None):
+        """Claim and run one due job; False when there is nothing to do."""
+        worker = worker or f"{os.getpid()}:{threading.current_thread().name}"
+        now = time.time()
+        with app.app_context():
+            # قراءة أولا: ما نفتحوش write transaction على والو
+            ready = get_db().execute(
+                "SELECT 1 FROM jobs WHERE statut=? AND run_after <= ? LIMIT 1", (JOB_PENDING, now)
+            ).fetchone()
+            if ready is None:
+                return False
+            job = run_write(_claim_job, worker, now)
+            if job is None:
+                return False  # سبقنا ليه worker آخر
+
+            kind = job["kind"]
+            fn, _ = JOB_HANDLERS.get(kind, (None, 0))
+            t0 = time.perf_counter()
+            try:
+                if fn is None:
+                    raise LookupError(f"no handler for job kind {kind!r}")
+                fn(**json.loads(job["payload"]))
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if fn is not None and job["attempts"] < job["max_attempts"]:
+                    delay = min(JOB_RETRY_BASE * 2 ** (job["attempts"] - 1), 3600)
+                    run_write(_finish_job, job["id"], worker, error, time.time() + delay)
+                    self.retried += 1
+                    result = "retry"
+                    app.logger.warning("job %s (%s) failed, retry in %.0fs: %s", job["id"], kind, delay, error)
+                else:
+                    run_write(_finish_job, job["id"], worker, error)
+                    self.failed += 1
+                    result = "failed"
+                    app.logger.exception("job %s (%s) failed for good", job["id"], kind)
+            else:
+                run_write(_finish_job, job["id"], worker)
+                self.done += 1
+                result = "done"
+            metrics.observe("job_duration_seconds", time.perf_counter() - t0, (("kind", kind),))
+            metrics.inc("jobs_total", (("kind", kind), ("result", result)))
+        return True
+
+    def run_pending(self):
+        """Run every due job in this thread (CLI / tests); returns how many ran."""
+        n = 0
+        while self.run_one():
+            n += 1
+        return n
+
+    def depth(self, conn):
+        """{statut: count} of the jobs not done yet + age in seconds of the oldest due one."""
+        counts = dict(conn.execute(
+            "SELECT statut, COUNT(*) FROM jobs WHERE statut IN (?,?,?) GROUP BY statut",
+            (JOB_PENDING, JOB_RUNNING, JOB_FAILED),
+        ).fetchall())
+        oldest = conn.execute(
+            "SELECT MIN(run_after) FROM jobs WHERE statut=? AND run_after <= ?", (JOB_PENDING, time.time())
+        ).fetchone()[0]
+        lag = max(0.0, time.time() - oldest) if oldest else 0.0
+        return {s: counts.get(s, 0) for s in (JOB_PENDING, JOB_RUNNING, JOB_FAILED)}, lag
+
+    def stats(self):
+        return {"workers": self.workers, "done": self.done, "retried": self.retried, "failed": self.failed}
+
+
+job_queue = JobQueue(JOB_WORKERS)
+
+
+@app.cli.command("run-jobs")
+def run_jobs_command():
+    """Run every due background job now (e.g. with JOB_WORKERS=0)."""
+    maintain_jobs()
+    n = job_queue.run_pending()
+    with app.app_context():
+        counts, lag = job_queue.depth(get_db())
+    print(f"{n} jobs run; queue: {counts}")
 
 
 # =========================
-# Client routes
+# Analytics rollups
 # =========================
-@app.route("/")
-def index():
-    q = request.args.get("q", "").strip().lower()
+# كل عقد كيتفرق على الأيام ديالو: jours يوم من date_debut، وكل يوم كياخد total / jours.
+#   analytics_daily      : day -> revenue, jours loués, contrats commencés (+ leurs jours)
+#   analytics_car_month  : (mois, voiture_id) -> revenue, jours loués, contrats commencés
+# غير contrats Actif كيتحسبو: contrat ملغي كيخرج بـ analytics_remove_contrat
+def _contrat_span(r):
+    """(start ordinal, jours, revenue per day) of a contrat row, or None if its dates are unusable."""
+    start = _parse_day(r["date_debut"])
+    if start is None:
+        return None
+    jours = r["jours"] if r["jours"] and r["jours"] > 0 else 1
+    return start, jours, (r["total"] or 0) / jours
+
+
+def _month_of(ordinal):
+    return date.fromordinal(ordinal).strftime("%Y-%m")
+
+
+def analytics_add_contrat(conn, contrat_id):
+    """Incremental update: fold one contrat Actif into the rollups (same transaction as the insert)."""
+    _analytics_fold(conn, contrat_id, 1)
+
+
+def analytics_remove_contrat(conn, contrat_id):
+    """Take a contrat back out of the rollups; call it before its statut leaves 'Actif'."""
+    _analytics_fold(conn, contrat_id, -1)
+
+
+def _analytics_fold(conn, contrat_id, sign):
+    r = conn.execute(
+        "SELECT voiture_id, date_debut, jours, total FROM contrats WHERE id=? AND statut='Actif'", (contrat_id,)
+    ).fetchone()
+    span = _contrat_span(r) if r else None
+    if span is None:
+        return
+    start, jours, rate = span
+
+    days = [date.fromordinal(start + i).isoformat() for i in range(jours)]
+    conn.executemany("""
+        INSERT INTO analytics_daily(day, revenue, jours_loues) VALUES (?, ?, ?)
+        ON CONFLICT(day) DO UPDATE SET
+            revenue = revenue + excluded.revenue,
+            jours_loues = jours_loues + excluded.jours_loues
+    """, [(d, sign * rate, sign) for d in days])
+    conn.execute("""
+        UPDATE analytics_daily SET contrats = contrats + ?, jours_contrats = jours_contrats + ?
+        WHERE day = ?
+    """, (sign, sign * jours, days[0]))
+    if sign < 0:
+        # بحال rebuild: نهار بلا حتى contrat ما كيبقاش فالجدول
+        conn.executemany(
+            "DELETE FROM analytics_daily WHERE day = ? AND jours_loues <= 0 AND contrats <= 0",
+            [(d,) for d in days],
+        )
 
-    conn = get_db()
-    cur = conn.cursor()
+    if r["voiture_id"] is None:
+        return
+    per_month = {}
+    for i in range(jours):
+        m = _month_of(start + i)
+        per_month[m] = per_month.get(m, 0) + 1
+    conn.executemany("""
+        INSERT INTO analytics_car_month(mois, voiture_id, revenue, jours_loues, contrats)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(mois, voiture_id) DO UPDATE SET
+            revenue = revenue + excluded.revenue,
+            jours_loues = jours_loues + excluded.jours_loues,
+            contrats = contrats + excluded.contrats
+    """, [
+        (m, r["voiture_id"], sign * rate * n, sign * n, sign * (m == _month_of(start)))
+        for m, n in per_month.items()
+    ])
+    if sign < 0:
+        conn.executemany(
+            "DELETE FROM analytics_car_month WHERE mois = ? AND voiture_id = ? AND jours_loues <= 0",
+            [(m, r["voiture_id"]) for m in per_month],
+        )
 
-    cur.execute("SELECT * FROM voitures ORDER BY id DESC LIMIT 4")
-    popular_voitures = cur.fetchall()
 
-    search_results = []
-    if q:
-        sql = """
-            SELECT * FROM voitures
-            WHERE LOWER(nom) LIKE ? OR LOWER(categorie) LIKE ?
-        """
-        like = f"%{q}%"
-        cur.execute(sql, (like, like))
-        search_results = cur.fetchall()
+def _aggregate_python(rows):
+    daily, car_month = {}, {}
+    for r in rows:
+        span = _contrat_span(r)
+        if span is None:
+            continue
+        start, jours, rate = span
+        for i in range(jours):
+            d = daily.setdefault(start + i, [0.0, 0, 0, 0])
+            d[0] += rate
+            d[1] += 1
+            if r["voiture_id"] is not None:
+                cm = car_month.setdefault((_month_of(start + i), r["voiture_id"]), [0.0, 0, 0])
+                cm[0] += rate
+                cm[1] += 1
+        daily[start][2] += 1
+        daily[start][3] += jours
+        if r["voiture_id"] is not None:
+            car_month[(_month_of(start), r["voiture_id"])][2] += 1
+
+    daily_rows = [(date.fromordinal(k).isoformat(), *v) for k, v in daily.items()]
+    car_rows = [(m, vid, *v) for (m, vid), v in car_month.items()]
+    return daily_rows, car_rows
+
+
+def _aggregate_numpy(rows):
+    """Same result as _aggregate_python, but every contrat day is expanded and summed with bincount."""
+    spans = [(_contrat_span(r), r["voiture_id"]) for r in rows]
+    spans = [(sp, vid) for sp, vid in spans if sp is not None]
+    if not spans:
+        return [], []
+
+    starts = np.array([sp[0] for sp, _ in spans], dtype=np.int64)
+    lens = np.array([sp[1] for sp, _ in spans], dtype=np.int64)
+    rates = np.array([sp[2] for sp, _ in spans], dtype=np.float64)
+    cars = np.array([vid if vid is not None else -1 for _, vid in spans], dtype=np.int64)
+
+    # contrat i -> jours[i] lignes, offset 0..jours-1
+    owner = np.repeat(np.arange(len(spans)), lens)
+    offsets = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    days = starts[owner] + offsets
+
+    d0 = int(days.min())
+    span = int(days.max()) - d0 + 1
+    revenue = np.bincount(days - d0, weights=rates[owner], minlength=span)
+    occupied = np.bincount(days - d0, minlength=span)
+    started = np.bincount(starts - d0, minlength=span)
+    started_days = np.bincount(starts - d0, weights=lens, minlength=span)
+
+    nz = np.nonzero(occupied | started)[0]
+    daily_rows = [
+        (date.fromordinal(d0 + int(i)).isoformat(), float(revenue[i]), int(occupied[i]),
+         int(started[i]), int(started_days[i]))
+        for i in nz
+    ]
+
+    # month index of every day of the range (the range is only a few thousand days)
+    months = [_month_of(d0 + i) for i in range(span)]
+    month_labels, month_idx = np.unique(np.array(months), return_inverse=True)
+    nm = len(month_labels)
+
+    has_car = cars[owner] >= 0
+    car_ids, car_idx = np.unique(cars[owner][has_car], return_inverse=True)
+    key = car_idx * nm + month_idx[(days - d0)[has_car]]
+    size = len(car_ids) * nm
+    cm_revenue = np.bincount(key, weights=rates[owner][has_car], minlength=size)
+    cm_days = np.bincount(key, minlength=size)
+
+    starts_with_car = cars >= 0
+    start_key = (
+        np.searchsorted(car_ids, cars[starts_with_car]) * nm
+        + month_idx[starts[starts_with_car] - d0]
+    )
+    cm_started = np.bincount(start_key, minlength=size)
+
+    car_rows = [
+        (str(month_labels[k % nm]), int(car_ids[k // nm]), float(cm_revenue[k]), int(cm_days[k]), int(cm_started[k]))
+        for k in np.nonzero(cm_days)[0]
+    ]
+    return daily_rows, car_rows
+
+
+def _rebuild_analytics(conn):
+    rows = conn.execute("SELECT voiture_id, date_debut, jours, total FROM contrats WHERE statut='Actif'").fetchall()
+    daily_rows, car_rows = (_aggregate_numpy if np is not None else _aggregate_python)(rows)
+
+    conn.execute("DELETE FROM analytics_daily")
+    conn.execute("DELETE FROM analytics_car_month")
+    conn.executemany(
+        "INSERT INTO analytics_daily(day, revenue, jours_loues, contrats, jours_contrats) VALUES (?,?,?,?,?)",
+        daily_rows,
+    )
+    conn.executemany(
+        "INSERT INTO analytics_car_month(mois, voiture_id, revenue, jours_loues, contrats) VALUES (?,?,?,?,?)",
+        car_rows,
+    )
+    return len(rows)
+
+
+ANALYTICS_PERIODS = {
+    "day": "day",
+    "week": "strftime('%Y-W%W', day)",
+    "month": "substr(day, 1, 7)",
+}
+
+
+def analytics_report(conn, date_from, date_to, period="month"):
+    """
+    Revenue series, fleet / per-car / per-category utilization and average
+    rental length between date_from and date_to ('YYYY-MM-DD'), read from the
+    rollup tables only. Utilization is computed on whole months (rollup grain).
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {ANALYTICS_PERIODS[period]} AS periode,
+               SUM(revenue) AS revenue, SUM(jours_loues) AS jours_loues, SUM(contrats) AS contrats
+        FROM analytics_daily
+        WHERE day BETWEEN ? AND ?
+        GROUP BY periode
+        ORDER BY periode
+    """, (date_from, date_to))
+    series = [
+        {"periode": r["periode"], "revenue": round(r["revenue"], 2),
+         "jours_loues": r["jours_loues"], "contrats": r["contrats"]}
+        for r in cur.fetchall()
+    ]
+
+    cur.execute("""
+        SELECT COALESCE(SUM(revenue), 0) AS revenue, COALESCE(SUM(contrats), 0) AS contrats,
+               COALESCE(SUM(jours_contrats), 0) AS jours_contrats
+        FROM analytics_daily
+        WHERE day BETWEEN ? AND ?
+    """, (date_from, date_to))
+    t = cur.fetchone()
+
+    m_from, m_to = date_from[:7], date_to[:7]
+    first = datetime.strptime(m_from, "%Y-%m").date()
+    last = datetime.strptime(m_to, "%Y-%m").date()
+    end = date(last.year + (last.month == 12), last.month % 12 + 1, 1)
+    n_days = (end - first).days
+
+    cur.execute("""
+        SELECT v.id, v.nom, v.categorie,
+               COALESCE(SUM(a.jours_loues), 0) AS jours_loues,
+               COALESCE(SUM(a.revenue), 0) AS revenue
+        FROM voitures v
+        LEFT JOIN analytics_car_month a
+               ON a.voiture_id = v.id AND a.mois BETWEEN ? AND ?
+        GROUP BY v.id
+        ORDER BY jours_loues DESC, v.id
+    """, (m_from, m_to))
+    cars = [
+        {"id": r["id"], "nom": r["nom"], "categorie": r["categorie"],
+         "jours_loues": r["jours_loues"], "revenue": round(r["revenue"], 2),
+         "utilisation": round(r["jours_loues"] / n_days, 4) if n_days else 0}
+        for r in cur.fetchall()
+    ]
+
+    categories = {}
+    for c in cars:
+        cat = categories.setdefault(c["categorie"] or "-", {"voitures": 0, "jours_loues": 0, "revenue": 0.0})
+        cat["voitures"] += 1
+        cat["jours_loues"] += c["jours_loues"]
+        cat["revenue"] += c["revenue"]
+    for cat in categories.values():
+        cat["revenue"] = round(cat["revenue"], 2)
+        cat["utilisation"] = round(cat["jours_loues"] / (cat["voitures"] * n_days), 4) if n_days else 0
+
+    fleet_days = sum(c["jours_loues"] for c in cars)
+    return {
+        "from": date_from,
+        "to": date_to,
+        "period": period,
+        "revenue_total": round(t["revenue"], 2),
+        "contrats": t["contrats"],
+        "duree_moyenne": round(t["jours_contrats"] / t["contrats"], 2) if t["contrats"] else None,
+        "utilisation_flotte": round(fleet_days / (len(cars) * n_days), 4) if cars and n_days else 0,
+        "series": series,
+        "categories": categories,
+        "voitures": cars,
+    }
+
+
+def rebuild_analytics():
+    """Full recompute of the rollups (vectorized with NumPy when it is installed)."""
+    return run_write(_rebuild_analytics)
+
+
+@app.cli.command("rebuild-analytics")
+def rebuild_analytics_command():
+    """Recompute the analytics rollups from contrats."""
+    with app.app_context():
+        n = rebuild_analytics()
+    print(f"rollups rebuilt from {n} contrats ({'numpy' if np is not None else 'python'})")
+
+
+# =========================
+# Auth helper
+# =========================
+def require_admin():
+    return bool(session.get("admin_ok"))
+
+
+# =========================
+# Business helpers
+# =========================
+def find_voiture(conn, nom, voiture_id=None):
+    """
+    Resolve the car a form refers to. voiture_id (hidden field from the
+    catalog links) wins when it still matches the name, otherwise the first
+    car with that name.
+    """
+    cur = conn.cursor()
+    if voiture_id:
+        cur.execute("SELECT * FROM voitures WHERE id=?", (voiture_id,))
+        v = cur.fetchone()
+        if v and (not nom or v["nom"] == nom):
+            return v
+    if not nom:
+        return None
+    cur.execute("SELECT * FROM voitures WHERE nom=? ORDER BY id LIMIT 1", (nom,))
+    return cur.fetchone()
+
+
+class AvailabilityIndex:
+    """
+    In-memory per-car interval index of the bookings that block a car:
+      - contrats Actif
+      - demandes Confirmée
+
+    For every car we keep two sorted arrays (starts, ends) of day ordinals.
+    The number of bookings overlapping [dd, df] is
+        #(start <= df) - #(end < dd)
+    so an overlap query is two bisects, O(log n).
+
+    The index is built lazily from the DB and kept up to date by the write
+    paths (add / remove) after they commit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cars = None   # voiture_id -> (starts, ends)
+        self._items = None  # key -> (voiture_id, start, end)
+
+    def invalidate(self):
+        with self._lock:
+            self._cars = None
+            self._items = None
+
+    def _build(self):
+        cars, items = {}, {}
+        # own connection: the index must only see committed rows
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT 'contrat' AS src, id, voiture_id AS car, date_debut, date_fin
+            FROM contrats
+            WHERE statut='Actif'
+            UNION ALL
+            SELECT 'demande' AS src, id, voiture_id AS car, date_debut, date_fin
+            FROM demandes
+            WHERE statut='Confirmée'
+        """)
+        for r in cur.fetchall():
+            start, end = _parse_day(r["date_debut"]), _parse_day(r["date_fin"])
+            if start is None or end is None:
+                continue
+            # سطر مقلوب (date_fin < date_debut) كيخسر الحساب ديال count_overlaps
+            start, end = min(start, end), max(start, end)
+            starts, ends = cars.setdefault(r["car"], ([], []))
+            starts.append(start)
+            ends.append(end)
+            items[(r["src"], r["id"])] = (r["car"], start, end)
+        conn.close()
+
+        for starts, ends in cars.values():
+            starts.sort()
+            ends.sort()
+        self._cars, self._items = cars, items
+
+    def _ensure_built(self):
+        if self._cars is None:
+            self._build()
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        voiture_id, start, end = item
+        starts, ends = self._cars[voiture_id]
+        del starts[bisect_left(starts, start)]
+        del ends[bisect_left(ends, end)]
+
+    def add(self, key, voiture_id, date_debut, date_fin):
+        """Register (or replace) a blocking booking, e.g. key=("demande", 12)."""
+        start, end = _parse_day(date_debut), _parse_day(date_fin)
+        with self._lock:
+            if self._cars is None:
+                return  # not built yet, the next query loads it from the DB
+            self._discard(key)
+            if start is None or end is None:
+                return
+            start, end = min(start, end), max(start, end)
+            starts, ends = self._cars.setdefault(voiture_id, ([], []))
+            insort(starts, start)
+            insort(ends, end)
+            self._items[key] = (voiture_id, start, end)
+
+    def remove(self, key):
+        with self._lock:
+            if self._cars is not None:
+                self._discard(key)
+
+    def count_overlaps(self, voiture_id, dd, df, ignore_key=None):
+        """Number of blocking bookings of voiture_id intersecting [dd, df] (day ordinals)."""
+        with self._lock:
+            self._ensure_built()
+            starts, ends = self._cars.get(voiture_id, ((), ()))
+            n = bisect_right(starts, df) - bisect_left(ends, dd)
+
+            if ignore_key is not None:
+                item = self._items.get(ignore_key)
+                if item and item[0] == voiture_id and not (df < item[1] or dd > item[2]):
+                    n -= 1
+            return n
+
+
+availability_index = AvailabilityIndex()
+
+
+def _sql_car_available_between(voiture_id, dd, df, ignore_demande_id=None):
+    """Fallback path: push the overlap predicate into SQLite."""
+    d1, d2 = dd.strftime("%Y-%m-%d"), df.strftime("%Y-%m-%d")
+
+    conn = get_db()
+    cur = conn.cursor()
+    # الفرع التاني = سطور مقلوبة (date_fin < date_debut)، بحال ما كيديرها availability_index
+    cur.execute("""
+        SELECT 1
+        FROM contrats
+        WHERE voiture_id=?
+          AND statut='Actif'
+          AND ((date_debut <= ? AND date_fin >= ?) OR (date_fin <= ? AND date_debut >= ?))
+        UNION ALL
+        SELECT 1
+        FROM demandes
+        WHERE voiture_id=?
+          AND statut='Confirmée'
+          AND ((date_debut <= ? AND date_fin >= ?) OR (date_fin <= ? AND date_debut >= ?))
+          AND id != ?
+        LIMIT 1
+    """, (voiture_id, d2, d1, d2, d1, voiture_id, d2, d1, d2, d1,
+          ignore_demande_id if ignore_demande_id is not None else -1))
+    busy = cur.fetchone() is not None
+    return not busy
+
+
+def is_car_available_between(voiture_id, date_debut, date_fin, ignore_demande_id=None):
+    """
+    Return True if car voiture_id is available between date_debut and date_fin.
+    Checks:
+      - contrats Actif overlapping
+      - demandes Confirmée overlapping
+    """
+    try:
+        dd = datetime.strptime(date_debut, "%Y-%m-%d").date()
+        df = datetime.strptime(date_fin, "%Y-%m-%d").date()
+        if df < dd:
+            dd, df = df, dd
+    except Exception:
+        return False
+
+    if not AVAILABILITY_INDEX:
+        return _sql_car_available_between(voiture_id, dd, df, ignore_demande_id)
+
+    ignore_key = ("demande", ignore_demande_id) if ignore_demande_id is not None else None
+    return availability_index.count_overlaps(
+        voiture_id, dd.toordinal(), df.toordinal(), ignore_key=ignore_key
+    ) == 0
+
+
+# =========================
+# Fleet calendar
+# =========================
+# سطور مقلوبة (date_fin < date_debut): الفرع التاني فـ WHERE، وmin/max كيرجعوها مرتبة
+FLEET_BUSY_SQL = """
+    SELECT voiture_id, min(date_debut, date_fin) AS date_debut, max(date_debut, date_fin) AS date_fin
+    FROM contrats
+    WHERE statut='Actif'
+      AND ((date_debut <= :au AND date_fin >= :du) OR (date_fin <= :au AND date_debut >= :du))
+    UNION ALL
+    SELECT voiture_id, min(date_debut, date_fin), max(date_debut, date_fin)
+    FROM demandes
+    WHERE statut='Confirmée'
+      AND ((date_debut <= :au AND date_fin >= :du) OR (date_fin <= :au AND date_debut >= :du))
+"""
+
+
+def calendar_window(du, au):
+    """
+    Validate a [du, au] window ('YYYY-MM-DD').
+    Return (du, au, error): error is None when the window is usable.
+    """
+    first, last = _parse_day(du), _parse_day(au)
+    if first is None or last is None:
+        return du, au, "Dates invalides (format AAAA-MM-JJ)."
+    if last < first:
+        du, au, first, last = au, du, last, first
+    if last - first + 1 > CALENDAR_MAX_DAYS:
+        return du, au, f"Période trop longue (maximum {CALENDAR_MAX_DAYS} jours)."
+    return du, au, None
+
+
+def fleet_busy_masks(conn, du, au):
+    """
+    One scan of the bookings overlapping [du, au] folded into a bitset per car:
+    bit i of masks[voiture_id] is set when the car is taken on du + i days.
+    Cars missing from the dict are free on the whole window.
+    """
+    first, last = _parse_day(du), _parse_day(au)
+    masks = {}
+    for r in conn.execute(FLEET_BUSY_SQL, {"du": du, "au": au}):
+        start, end = _parse_day(r["date_debut"]), _parse_day(r["date_fin"])
+        if start is None or end is None:
+            continue
+        start, end = max(min(start, end), first), min(max(start, end), last)
+        if start > end:
+            continue
+        bits = ((1 << (end - start + 1)) - 1) << (start - first)
+        masks[r["voiture_id"]] = masks.get(r["voiture_id"], 0) | bits
+    return masks
+
+
+def free_voitures(conn, voitures, du, au):
+    """The cars of `voitures` with no blocking booking between du and au."""
+    masks = fleet_busy_masks(conn, du, au)
+    return [v for v in voitures if not masks.get(v["id"])]
+
+
+def mask_days(mask, n):
+    """Bitset -> '0110...' (one char per day of the window, '1' = taken)."""
+    return format(mask, f"0{n}b")[::-1] if n else ""
+
+
+# =========================
+# Booking transactions
+# =========================
+class BookingConflict(Exception):
+    """The car is already taken on (part of) the requested dates."""
+
+
+# نفس القاعدة ديال _sql_car_available_between: الفرع التاني = سطور مقلوبة
+BOOKING_OVERLAP_SQL = """
+    SELECT EXISTS (
+        SELECT 1
+        FROM contrats
+        WHERE voiture_id=:vid
+          AND statut='Actif'
+          AND ((date_debut <= :fin AND date_fin >= :debut) OR (date_fin <= :fin AND date_debut >= :debut))
+          AND (demande_id IS NULL OR demande_id != :rid)
+        UNION ALL
+        SELECT 1
+        FROM demandes
+        WHERE voiture_id=:vid
+          AND statut='Confirmée'
+          AND ((date_debut <= :fin AND date_fin >= :debut) OR (date_fin <= :fin AND date_debut >= :debut))
+          AND id != :rid
+    )
+"""
+
+
+def run_booking(job, *args):
+    """
+    run_write with the transaction opened by BEGIN IMMEDIATE: the reads of job
+    (overlap check) and its writes happen under the same write lock, also
+    against other processes writing to the DB file.
+    """
+    def tx(conn, *args):
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        return job(conn, *args)
+    return run_write(tx, *args)
+
+
+def set_demande_statut(conn, rid, st):
+    """
+    Booking job: set demande rid to statut st. Confirming it checks overlaps
+    (one statement), marks the car Louée, creates the contrat and queues its
+    PDF, all in the caller's transaction. Moving a confirmed demande back
+    cancels its contrat (statut 'Annulé', out of the rollups). Returns
+    (demande, contrat id or None): the contrat created or reactivated by a
+    confirmation, or the one cancelled; raises BookingConflict when the car
+    is taken.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM demandes WHERE id=?", (rid,))
+    d = cur.fetchone()
+    if not d:
+        return None, None
+
+    if st != "Confirmée":
+        cur.execute("UPDATE demandes SET statut=? WHERE id=?", (st, rid))
+        cur.execute("SELECT id FROM contrats WHERE demande_id=? AND statut='Actif' LIMIT 1", (rid,))
+        c = cur.fetchone()
+        if c is None:
+            return d, None
+        analytics_remove_contrat(conn, c["id"])
+        cur.execute("UPDATE contrats SET statut='Annulé' WHERE id=?", (c["id"],))
+        enqueue_job(conn, "car_statuses", dedupe="car_statuses")
+        return d, c["id"]
+
+    # منع التداخل: كنقراو فنفس transaction اللي غادي تكتب
+    first, last = _parse_day(d["date_debut"]), _parse_day(d["date_fin"])
+    if first is None or last is None:
+        raise BookingConflict(rid)
+    debut, fin = sorted((d["date_debut"], d["date_fin"]))
+    cur.execute(BOOKING_OVERLAP_SQL, {"vid": d["voiture_id"], "debut": debut, "fin": fin, "rid": rid})
+    if cur.fetchone()[0]:
+        raise BookingConflict(rid)
+
+    cur.execute("UPDATE demandes SET statut=? WHERE id=?", (st, rid))
+
+    # السيارة تولّي Louée
+    cur.execute("UPDATE voitures SET statut=? WHERE id=?", ("Louée", d["voiture_id"]))
+
+    # Louée ديريكت، و job كيصححها إلا الكراء ماشي اليوم؛ + PDF ديال الcontrat
+    enqueue_job(conn, "car_statuses", dedupe="car_statuses")
+    if facture_pdfs.enabled:
+        enqueue_job(conn, "facture_pdf", {"rid": rid}, dedupe=f"facture:{rid}")
+
+    # نتأكدو واش كاين contrat لهاد demande (ملغي = كيرجع Actif)
+    cur.execute("SELECT id, statut FROM contrats WHERE demande_id=? LIMIT 1", (rid,))
+    c = cur.fetchone()
+    if c:
+        if c["statut"] == "Actif":
+            return d, None
+        cur.execute("UPDATE contrats SET statut='Actif' WHERE id=?", (c["id"],))
+        analytics_add_contrat(conn, c["id"])
+        return d, c["id"]
+
+    cur.execute(
+        "SELECT categorie, prix_jour, immatriculation FROM voitures WHERE id=?",
+        (d["voiture_id"],)
+    )
+    v = cur.fetchone()
+
+    jours = max(last - first, 1)
+    prix_jour = v["prix_jour"] if v and v["prix_jour"] else None
+    total = prix_jour * jours if prix_jour else None
+
+    # كنخلق contrat جديد
+    cur.execute("""
+        INSERT INTO contrats
+        (demande_id, client_nom, voiture_id, voiture_nom, categorie, immatriculation,
+         date_debut, date_fin, jours, prix_jour, total)
+        VALUES (?,?,?,?,?,?,?,?,?,?,?)
+    """, (
+        rid,
+        d["nom"],
+        d["voiture_id"],
+        d["voiture"],
+        v["categorie"] if v else None,
+        v["immatriculation"] if v else None,
+        d["date_debut"],
+        d["date_fin"],
+        jours,
+        prix_jour,
+        total
+    ))
+    contrat_id = cur.lastrowid
+    analytics_add_contrat(conn, contrat_id)
+    return d, contrat_id
+
+
+# =========================
+# Fleet alerts
+# =========================
+# fleet_alerts = queue ديال الأشياء اللي قربات: كل voiture عندها سطر واحد لكل kind
+#   accident  : incidents Ouvert   (due = أقدم incident، info = les dégâts)
+#   visite    : آخر visite         (due = prochaine_visite، info = date_visite)
+#   assurance : آخر assurance      (due = fin، info = assureur)
+# الـ dashboard كيقرا غير range صغير من index (kind, due) بلا حساب dates لكل voiture.
+FLEET_ALERTS_SQL = [
+    """
+    INSERT INTO fleet_alerts(kind, voiture_id, due, info)
+    SELECT 'accident', voiture_id, MIN(date_incident), group_concat(degat, ' / ')
+    FROM voiture_incidents
+    WHERE statut='Ouvert' {and_car}
+    GROUP BY voiture_id
+    """,
+    # bare columns + MAX(): SQLite takes them from the row holding the max
+    """
+    INSERT INTO fleet_alerts(kind, voiture_id, due, info)
+    SELECT 'visite', voiture_id, prochaine_visite, MAX(date_visite)
+    FROM voiture_visites
+    WHERE 1 {and_car}
+    GROUP BY voiture_id
+    """,
+    """
+    INSERT INTO fleet_alerts(kind, voiture_id, due, info)
+    SELECT 'assurance', voiture_id, MAX(fin), assureur
+    FROM voiture_assurances
+    WHERE 1 {and_car}
+    GROUP BY voiture_id
+    """,
+]
+
+
+def refresh_fleet_alerts(conn, voiture_id=None):
+    """Recompute the alert rows of one car (after an item is added) or of the whole fleet."""
+    if voiture_id is None:
+        conn.execute("DELETE FROM fleet_alerts")
+        for sql in FLEET_ALERTS_SQL:
+            conn.execute(sql.format(and_car=""))
+    else:
+        conn.execute("DELETE FROM fleet_alerts WHERE voiture_id=?", (voiture_id,))
+        for sql in FLEET_ALERTS_SQL:
+            conn.execute(sql.format(and_car="AND voiture_id=?"), (voiture_id,))
+
+
+@job_handler("fleet_alerts", every=24 * 3600)
+@timed_section("fleet_alerts_rebuild")
+def rebuild_fleet_alerts():
+    """Daily job: full recompute of the queue (also fixes any drift)."""
+    return run_write(refresh_fleet_alerts)
+
+
+@app.cli.command("rebuild-alerts")
+def rebuild_alerts_command():
+    """Recompute the fleet alert queue (accidents, visites, assurances)."""
+    with app.app_context():
+        rebuild_fleet_alerts()
+        n = get_db().execute("SELECT COUNT(*) FROM fleet_alerts").fetchone()[0]
+    print(f"{n} alert rows")
+
+
+def fleet_alert_panels(conn, today=None):
+    """The three dashboard panels, each one a bounded range scan of fleet_alerts."""
+    today = today or date.today()
+    visite_until = (today + timedelta(days=ALERT_VISITE_DAYS)).isoformat()
+    assurance_until = (today + timedelta(days=ALERT_ASSURANCE_DAYS)).isoformat()
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT v.id, v.nom, v.statut, a.info AS degat, a.due AS date_incident
+        FROM fleet_alerts a
+        JOIN voitures v ON v.id = a.voiture_id
+        WHERE a.kind='accident'
+        ORDER BY a.due
+        LIMIT ?
+    """, (ALERT_PANEL_LIMIT,))
+    accident_cars = cur.fetchall()
+
+    cur.execute("""
+        SELECT v.id, v.nom, a.info AS derniere_visite, a.due AS prochaine_visite
+        FROM fleet_alerts a
+        JOIN voitures v ON v.id = a.voiture_id
+        WHERE a.kind='visite' AND a.due <= ?
+        ORDER BY a.due
+        LIMIT ?
+    """, (visite_until, ALERT_PANEL_LIMIT))
+    visite_cars = cur.fetchall()
+
+    cur.execute("""
+        SELECT v.id, v.nom, a.due AS assurance_fin, a.info AS assureur,
+               CAST(julianday(a.due) - julianday(?) AS INTEGER) AS jours_restants
+        FROM fleet_alerts a
+        JOIN voitures v ON v.id = a.voiture_id
+        WHERE a.kind='assurance' AND a.due <= ?
+        ORDER BY a.due
+        LIMIT ?
+    """, (today.isoformat(), assurance_until, ALERT_PANEL_LIMIT))
+    assurance_cars = cur.fetchall()
+
+    return accident_cars, visite_cars, assurance_cars
+
+
+CAR_STATUS_DIFF_SQL = """
+    WITH louees AS (
+        SELECT voiture_id
+        FROM contrats
+        WHERE statut='Actif'
+          AND ((date_debut <= :today AND date_fin >= :today) OR (date_fin <= :today AND date_debut >= :today))
+        UNION
+        SELECT voiture_id
+        FROM demandes
+        WHERE statut='Confirmée'
+          AND ((date_debut <= :today AND date_fin >= :today) OR (date_fin <= :today AND date_debut >= :today))
+    )
+    SELECT id, new_statut
+    FROM (
+        SELECT id, statut,
+               CASE WHEN id IN louees THEN 'Louée' ELSE 'Disponible' END AS new_statut
+        FROM voitures
+    )
+    WHERE statut IS NOT new_statut
+"""
+
+
+@timed_section("refresh_car_statuses")
+def refresh_car_statuses():
+    """
+    Update voitures.statut based on today's rentals.
+
+    The new status of every car is computed in one set-based query and only
+    the rows whose status actually changed are written, so a refresh with
+    nothing to do never opens a write transaction.
+    Returns the number of cars updated.
+    """
+    conn = get_db()
+    cur = conn.cursor()
+    today = date.today().strftime("%Y-%m-%d")
+
+    cur.execute(CAR_STATUS_DIFF_SQL, {"today": today})
+    changes = [(r["new_statut"], r["id"]) for r in cur.fetchall()]
+
+    if changes:
+        run_write(lambda w: w.executemany("UPDATE voitures SET statut=? WHERE id=?", changes))
+        catalog_cache.invalidate()
+
+    return len(changes)
+
+
+@job_handler("car_statuses")
+def _job_car_statuses():
+    refresh_car_statuses()
+
+
+_status_refresh = {"key": None}
+
+
+def refresh_car_statuses_inline():
+    """
+    Called by the catalog / admin routes once per catalog change (or new day)
+    in this process: queues a car_statuses job, or runs the refresh right
+    here when no job worker runs in this process (flask run, a WSGI server
+    importing app:app). A no-op when the background refresher owns the job.
+    """
+    if STATUS_REFRESH_INTERVAL > 0:
+        return
+    key = (date.today(), catalog_cache.generation)
+    if _status_refresh["key"] == key:
+        return
+    if job_queue.running():
+        _status_refresh["key"] = key
+        enqueue("car_statuses", dedupe="car_statuses")
+        return
+    # ما كاين حتى worker هنا: job غادي تبقى واقفة، نديروها دابا
+    refresh_car_statuses()
+    _status_refresh["key"] = (date.today(), catalog_cache.generation)
+
+
+_periodic_jobs = {}
+
+
+def start_periodic(name, interval, fn):
+    """Run fn() every `interval` seconds (inside an app context) in a daemon thread."""
+    job = _periodic_jobs.get(name)
+    # threads do not survive a fork: a job registered by the parent is started again
+    if interval <= 0 or (job is not None and job.pid == os.getpid()):
+        return job
+
+    stop = threading.Event()
+
+    def loop():
+        while not stop.is_set():
+            try:
+                with app.app_context():
+                    fn()
+            except Exception:
+                app.logger.exception("%s failed", name)
+            stop.wait(interval)
+
+    t = threading.Thread(target=loop, name=name, daemon=True)
+    t.stop = stop
+    t.pid = os.getpid()
+    t.start()
+    _periodic_jobs[name] = t
+    return t
+
+
+def start_status_refresher(interval=None):
+    """Run refresh_car_statuses every `interval` seconds in a daemon thread."""
+    return start_periodic("car-status-refresher", interval or STATUS_REFRESH_INTERVAL, refresh_car_statuses)
+
+
+@job_handler("reconcile_stats", every=STATS_RECONCILE_INTERVAL)
+def reconcile_dashboard_stats():
+    """Reconciliation job: fix any drift between dashboard_stats and the real counts."""
+    drift = run_write(lambda conn: _reconcile_stats(conn.cursor()))
+    if drift:
+        app.logger.warning("dashboard_stats drift fixed: %s", drift)
+    return drift
+
+
+@app.cli.command("reconcile-stats")
+def reconcile_stats_command():
+    """Recount the dashboard counters."""
+    with app.app_context():
+        drift = reconcile_dashboard_stats()
+    print(f"drift fixed: {drift}" if drift else "dashboard_stats OK")
+
+
+def start_background_jobs():
+    """
+    Per-process daemon threads; call again in every worker after a fork.
+    The daily / hourly rebuilds are scheduled jobs (job_handler every=...),
+    run once across all the processes by the job workers.
+    """
+    start_status_refresher()
+    if JOB_WORKERS > 0:
+        job_queue.start()
+        start_periodic("jobs-maintenance", 60, maintain_jobs)
+
+
+CatalogSnapshot = namedtuple("CatalogSnapshot", "voitures dispo louees popular generation built_at day")
+
+
+class CatalogCache:
+    """
+    Immutable snapshot of the public catalog (all cars, split into
+    dispo / louees, plus the "popular" list of the home page).
+
+    Write paths call invalidate(); the snapshot also expires after `ttl`
+    seconds and when the date changes, since statuses depend on today.
+    A rebuild that raced with an invalidate() is not served (generation check).
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+
+    def _fresh(self, snap):
+        return (
+            snap is not None
+            and snap.generation == self._generation
+            and time.monotonic() - snap.built_at < self.ttl
+            and snap.day == date.today()
+        )
+
+    def get(self):
+        snap = self._snapshot
+        if self._fresh(snap):
+            self.hits += 1
+            return snap
+        return self._rebuild()
+
+    def peek(self):
+        """The current snapshot if it is still fresh, else None (never rebuilds)."""
+        snap = self._snapshot
+        if self._fresh(snap):
+            self.hits += 1
+            return snap
+        return None
+
+    @timed_section("catalog_rebuild")
+    def _rebuild(self):
+        self.misses += 1
+        refresh_car_statuses_inline()
+        with self._lock:
+            generation = self._generation
+
+        cur = get_db().cursor()
+        cur.execute("SELECT * FROM voitures ORDER BY id DESC")
+        voitures = tuple(cur.fetchall())
+
+        snap = CatalogSnapshot(
+            voitures=voitures,
+            dispo=tuple(v for v in voitures if v["statut"] != "Louée"),
+            louees=tuple(v for v in voitures if v["statut"] == "Louée"),
+            popular=voitures[:4],
+            generation=generation,
+            built_at=time.monotonic(),
+            day=date.today(),
+        )
+        with self._lock:
+            if generation == self._generation:
+                self._snapshot = snap
+        return snap
+
+    def stats(self):
+        total = self.hits + self.misses
+        snap = self._snapshot
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "cars": len(snap.voitures) if snap else 0,
+        }
+
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL)
+
+
+# =========================
+# Car search
+# =========================
+def fts_query(q):
+    """'Citroën c3' -> '"citroen"* "c3"*' (every word as an accent-free prefix, all required)."""
+    q = unicodedata.normalize("NFKD", q)
+    q = "".join(ch for ch in q if not unicodedata.combining(ch)).lower()
+    words = "".join(ch if ch.isalnum() else " " for ch in q).split()
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_voitures(conn, q, limit=None):
+    """Cars matching q, best match first (nom weighs more than categorie / immatriculation)."""
+    cur = conn.cursor()
+    limit_sql = " LIMIT ?" if limit else ""
+
+    if not HAS_FTS:
+        like = f"%{q.lower()}%"
+        cur.execute(
+            "SELECT * FROM voitures WHERE LOWER(nom) LIKE ? OR LOWER(categorie) LIKE ?" + limit_sql,
+            (like, like) + ((limit,) if limit else ()),
+        )
+        return cur.fetchall()
+
+    match = fts_query(q)
+    if not match:
+        return []
+    cur.execute("""
+        SELECT v.*
+        FROM voitures_fts f
+        JOIN voitures v ON v.id = f.rowid
+        WHERE voitures_fts MATCH ?
+        ORDER BY bm25(voitures_fts, 10.0, 4.0, 1.0), v.id DESC
+    """ + limit_sql, (match,) + ((limit,) if limit else ()))
+    return cur.fetchall()
+
+
+# =========================
+# Page cache
+# =========================
+PageEntry = namedtuple("PageEntry", "snapshot etag gz size")
+
+
+class PageCache:
+    """
+    LRU of rendered public pages, keyed by path + sorted query string.
+
+    Bodies are stored gzipped with a strong ETag of the HTML. An entry is
+    only served while the catalog snapshot it was rendered against is still
+    the current one, so every write path that calls catalog_cache.invalidate()
+    (and the TTL / day change of the catalog) also expires the pages.
+    Total stored size is bounded by max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def get(self, key, snapshot):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.snapshot is snapshot:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self._drop(key)
+            self.misses += 1
+            return None
+
+    def peek(self, key, snapshot):
+        """Like get() but a miss is not counted (the sync view will count it)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.snapshot is snapshot:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            return None
+
+    def put(self, key, snapshot, body):
+        gz = gzip.compress(body, 6, mtime=0)
+        entry = PageEntry(snapshot, hashlib.sha1(body).hexdigest(), gz, len(gz) + len(key))
+        with self._lock:
+            self._drop(key)
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= old.size
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "pages": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+page_cache = PageCache(PAGE_CACHE_MAX_BYTES)
+
+
+def _page_response(entry, status):
+    """304 / gzip / identity response of a cached page for the current request."""
+    gzipped = bool(request.accept_encodings["gzip"])
+    # ETag قوي لكل representation
+    etag = entry.etag + ("-gz" if gzipped else "")
+    if request.if_none_match.contains(etag):
+        page_cache.not_modified += 1
+        resp = Response(status=304)
+    elif gzipped:
+        resp = Response(entry.gz, mimetype="text/html")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(gzip.decompress(entry.gz), mimetype="text/html")
+    resp.set_etag(etag)
+    resp.vary.add("Accept-Encoding")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Page-Cache"] = status
+    return resp
+
+
+def _page_key():
+    return request.path + "?" + "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+
+
+def cached_page(view):
+    """Serve a public GET route from page_cache (ETag / If-None-Match aware)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PAGE_CACHE_MAX_BYTES or request.method != "GET":
+            return view(*args, **kwargs)
+
+        key = _page_key()
+        snapshot = catalog_cache.get()
+        entry = page_cache.get(key, snapshot)
+        if entry is not None:
+            return _page_response(entry, "HIT")
+
+        resp = make_response(view(*args, **kwargs))
+        if resp.status_code != 200 or resp.mimetype != "text/html":
+            return resp
+        return _page_response(page_cache.put(key, snapshot, resp.get_data()), "MISS")
+    return wrapper
+
+
+# =========================
+# Image variants
+# =========================
+def build_image_variants(filename):
+    """
+    Resize static/uploads/<filename> to IMAGE_WIDTHS (never upscaled) as
+    progressive JPEG + WebP into static/uploads/thumbs.
+    Return the image_variants rows (the 'orig' row holds the source size).
+    """
+    with Image.open(os.path.join(UPLOAD_FOLDER, filename)) as src:
+        im = ImageOps.exif_transpose(src)
+        im.load()
+    w, h = im.size
+    if im.mode not in ("RGB", "RGBA"):
+        im = im.convert("RGBA" if "A" in im.getbands() or "transparency" in im.info else "RGB")
+    if im.mode == "RGBA" and im.getchannel("A").getextrema()[0] == 255:
+        im = im.convert("RGB")  # alpha ما مستعملاش
+
+    base = os.path.splitext(filename)[0]
+    os.makedirs(THUMB_FOLDER, exist_ok=True)
+    rows = [(filename, "orig", w, h, filename)]
+    for tw in sorted({min(x, w) for x in IMAGE_WIDTHS}):
+        th = max(1, round(h * tw / w))
+        small = im.resize((tw, th), Image.LANCZOS) if tw != w else im
+
+        webp = f"{base}_{tw}.webp"
+        small.save(os.path.join(THUMB_FOLDER, webp), "WEBP", quality=80, method=4)
+
+        # JPEG ماعندوش transparence: كنحطو خلفية بيضاء
+        if small.mode == "RGBA":
+            flat = Image.new("RGB", small.size, (255, 255, 255))
+            flat.paste(small, mask=small.getchannel("A"))
+            small = flat
+        jpg = f"{base}_{tw}.jpg"
+        small.save(os.path.join(THUMB_FOLDER, jpg), "JPEG", quality=82, optimize=True, progressive=True)
+
+        rows.append((filename, "jpeg", tw, th, f"thumbs/{jpg}"))
+        rows.append((filename, "webp", tw, th, f"thumbs/{webp}"))
+    return rows
+
+
+def _store_image_variants(conn, filename, rows):
+    conn.execute("DELETE FROM image_variants WHERE image=?", (filename,))
+    conn.executemany(
+        "INSERT INTO image_variants(image, fmt, width, height, file) VALUES(?,?,?,?,?)", rows
+    )
+
+
+class ImageVariants:
+    """
+    Read side: image -> {src, srcset, webp_srcset, width, height} for the
+    templates, loaded once from image_variants and dropped when the pipeline
+    stores new rows.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._map = None
+
+    def invalidate(self):
+        with self._lock:
+            self._map = None
+
+    def _load(self):
+        images = {}
+        # own connection: only committed variants
+        conn = get_conn()
+        for r in conn.execute("SELECT * FROM image_variants ORDER BY image, fmt, width"):
+            img = images.setdefault(r["image"], {"width": None, "height": None, "jpeg": [], "webp": []})
+            if r["fmt"] == "orig":
+                img["width"], img["height"] = r["width"], r["height"]
+            else:
+                img[r["fmt"]].append((r["width"], r["file"]))
+        conn.close()
+        return {k: v for k, v in images.items() if v["jpeg"]}
+
+    def get(self, image):
+        """Variants of `image` for srcset, or None (not processed yet / no Pillow)."""
+        images = self._map
+        if images is None:
+            with self._lock:
+                if self._map is None:
+                    self._map = self._load()
+                images = self._map
+        img = images.get(image)
+        if img is None:
+            return None
+
+        def srcset(items):
+            return ", ".join(f"{url_for('static', filename='uploads/' + f)} {w}w" for w, f in items)
+
+        return {
+            "src": url_for("static", filename="uploads/" + img["jpeg"][0][1]),
+            "srcset": srcset(img["jpeg"]),
+            "webp_srcset": srcset(img["webp"]),
+            "width": img["width"],
+            "height": img["height"],
+        }
+
+
+image_variants = ImageVariants()
+app.add_template_global(image_variants, "image_variants")
+
+
+class ImagePipeline:
+    """
+    Worker pool that builds the variants of an upload off the request thread.
+    Without Pillow submit() is a no-op and the templates keep the originals.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = ForkAwarePool(workers, "images")
+        self.done = 0
+        self.failed = 0
+
+    def build(self, filename):
+        """Build + store the variants of one upload; raises on failure."""
+        rows = build_image_variants(filename)
+        with app.app_context():
+            run_write(_store_image_variants, filename, rows)
+        self.done += 1
+        image_variants.invalidate()
+        catalog_cache.invalidate()
+
+    def process(self, filename):
+        """Pool entry point: logs instead of raising."""
+        try:
+            self.build(filename)
+        except Exception:
+            self.failed += 1
+            app.logger.exception("image variants failed for %s", filename)
+            return False
+        return True
+
+    def submit(self, filename):
+        if Image is None or not filename:
+            return None
+        return self.pool.submit(self.process, filename)
+
+    def stats(self):
+        return {"enabled": Image is not None, "workers": self.workers, "done": self.done, "failed": self.failed}
+
+
+image_pipeline = ImagePipeline(IMAGE_WORKERS)
+
+
+@job_handler("image_variants")
+def _job_image_variants(filename):
+    image_pipeline.build(filename)
+
+
+@app.cli.command("process-images")
+@click.option("--force", is_flag=True, help="Rebuild the variants that already exist.")
+def process_images_command(force):
+    """Backfill thumbnails / WebP variants of the existing uploads."""
+    if Image is None:
+        raise SystemExit("Pillow is not installed (pip install Pillow)")
+    conn = get_conn()
+    images = [r[0] for r in conn.execute("SELECT DISTINCT image FROM voitures WHERE image IS NOT NULL AND image != ''")]
+    done = {r[0] for r in conn.execute("SELECT DISTINCT image FROM image_variants")}
+    conn.close()
+
+    todo = [f for f in images if (force or f not in done) and os.path.exists(os.path.join(UPLOAD_FOLDER, f))]
+    futures = [image_pipeline.submit(f) for f in todo]
+    ok = sum(1 for fut in futures if fut.result())
+    print(f"{ok}/{len(todo)} images processed ({len(images) - len(todo)} skipped)")
+
+
+# =========================
+# Contract PDFs
+# =========================
+# admin_facture.html كيتحول لـ PDF مرة وحدة (ملي الطلب كيتأكد) فـ worker pool،
+# كيتخزن فـ FACTURE_FOLDER/<sha[:2]>/<sha>.pdf، و facture_pdfs كتربط demande → sha.
+# المرات الجاية كنرسلو الملف ديريكت بلا ما نعاودو نبنيو الcontrat.
+def facture_context(conn, rid):
+    """Everything facture_contrat.html needs for one demande (None if it does not exist)."""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM demandes WHERE id=?", (rid,))
+    d = cur.fetchone()
+    if not d:
+        return None
+
+    jours = 1
+    prix_jour = None
+    total = None
+    try:
+        if d["date_debut"] and d["date_fin"]:
+            dd = datetime.strptime(d["date_debut"], "%Y-%m-%d")
+            df = datetime.strptime(d["date_fin"], "%Y-%m-%d")
+            jours = (df - dd).days
+            if jours <= 0:
+                jours = 1
+    except Exception:
+        jours = 1
+
+    # نجيب معلومات السيارة كاملة (1)
+    cur.execute(
+        "SELECT prix_jour, immatriculation, categorie FROM voitures WHERE id=?",
+        (d["voiture_id"],)
+    )
+    v = cur.fetchone()
+
+    if v and v["prix_jour"]:
+        prix_jour = v["prix_jour"]
+        total = prix_jour * jours
 
+    # date ديال الcontrat (ماشي اليوم) باش نفس الcontrat يعطي نفس المحتوى
+    cur.execute("SELECT created_at FROM contrats WHERE demande_id=? LIMIT 1", (rid,))
+    c = cur.fetchone()
+    made = _parse_day((c["created_at"] or "")[:10]) if c else None
+    today = (date.fromordinal(made) if made else date.today()).strftime("%d/%m/%Y")
+
+    return {"d": d, "v": v, "jours": jours, "prix_jour": prix_jour, "total": total, "today": today}
+
+
+def _pdf_url_fetcher(url):
+    """Serve /static/... from disk to WeasyPrint; nothing else is fetched."""
+    prefix = app.static_url_path + "/"
+    path = urlsplit(url).path
+    if path.startswith(prefix):
+        file = safe_join(app.static_folder, path[len(prefix):])
+        if file and os.path.isfile(file):
+            return {"file_obj": open(file, "rb"), "mime_type": mimetypes.guess_type(file)[0]}
+    raise ValueError(f"not fetched: {url}")
+
+
+class FacturePdfs:
+    """
+    Content-addressed PDF cache of the contracts + the worker pool that fills it.
+    Without WeasyPrint it is disabled and the HTML page (window.print) stays.
+    """
+
+    def __init__(self, folder, workers):
+        self.folder = folder
+        self.workers = workers
+        self.pool = ForkAwarePool(workers, "factures")
+        self.built = 0
+        self.reused = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return weasyprint is not None
+
+    def path(self, sha):
+        return os.path.join(self.folder, sha[:2], sha + ".pdf")
+
+    def lookup(self, conn, rid):
+        """Path of the cached PDF of demande `rid`, or None."""
+        row = conn.execute("SELECT sha FROM facture_pdfs WHERE demande_id=?", (rid,)).fetchone()
+        if row:
+            path = self.path(row["sha"])
+            if os.path.exists(path):
+                return path
+        return None
+
+    @timed_section("facture_pdf")
+    def build(self, rid):
+        """Render + store the PDF of one demande; returns its path (None if the demande is gone)."""
+        with app.app_context() as app_ctx:
+            base = urlsplit(FACTURE_BASE_URL)
+            app_ctx.url_adapter = app.url_map.bind(
+                base.netloc, script_name=base.path or "/", url_scheme=base.scheme or "http",
+            )
+            ctx = facture_context(get_db(), rid)
+            if ctx is None:
+                return None
+            html = render_template("facture_pdf.html", pdf=True, **ctx)
+            # نفس HTML = نفس الملف: الـ hash كيتحسب على المصدر، ماشي على PDF (فيه timestamps)
+            sha = hashlib.sha256(html.encode("utf-8")).hexdigest()
+            path = self.path(sha)
+            if os.path.exists(path):
+                self.reused += 1
+            else:
+                data = weasyprint.HTML(
+                    string=html, base_url=FACTURE_BASE_URL, url_fetcher=_pdf_url_fetcher,
+                ).write_pdf()
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, path)
+                self.built += 1
+            run_write(_store_facture_pdf, rid, sha, os.path.getsize(path))
+        return path
+
+    def process(self, rid):
+        """Worker entry point: never raises, the HTML page stays available."""
+        try:
+            return self.build(rid)
+        except Exception:
+            self.failed += 1
+            app.logger.exception("contract PDF failed for demande %s", rid)
+            return None
+
+    def submit(self, rid):
+        if not self.enabled:
+            return None
+        return self.pool.submit(self.process, rid)
+
+    def get(self, conn, rid):
+        """Cached PDF of `rid`, built right now if it is not there yet."""
+        return self.lookup(conn, rid) or self.build(rid)
+
+    def stats(self):
+        return {"enabled": self.enabled, "workers": self.workers,
+                "built": self.built, "reused": self.reused, "failed": self.failed}
+
+
+def _store_facture_pdf(conn, rid, sha, size):
+    conn.execute("""
+        INSERT INTO facture_pdfs(demande_id, sha, size) VALUES(?,?,?)
+        ON CONFLICT(demande_id) DO UPDATE SET sha=excluded.sha, size=excluded.size,
+                                              created_at=CURRENT_TIMESTAMP
+    """, (rid, sha, size))
+
+
+facture_pdfs = FacturePdfs(FACTURE_FOLDER, FACTURE_WORKERS)
+
+
+@job_handler("facture_pdf")
+def _job_facture_pdf(rid):
+    facture_pdfs.build(rid)
+
+
+def iter_factures_zip(ids):
+    """
+    Stream a ZIP of the contracts of `ids`: missing PDFs are queued on the pool
+    up front, then each file is copied into the archive as soon as it is ready.
+    """
+    conn = get_conn()
+    try:
+        pending = {rid: facture_pdfs.submit(rid) for rid in ids if not facture_pdfs.lookup(conn, rid)}
+        paths = ((rid, pending[rid].result() if rid in pending else facture_pdfs.lookup(conn, rid))
+                 for rid in ids)
+
+        sink = _ZipSink()
+        # PDF déjà compressé: ZIP_STORED
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+            for rid, path in paths:
+                if not path:
+                    continue
+                with open(path, "rb") as src, zf.open(f"contrat_{rid}.pdf", "w", force_zip64=True) as dst:
+                    while True:
+                        chunk = src.read(64 * 1024)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        if sink.size >= 64 * 1024:
+                            yield sink.take()
+                yield sink.take()
+        yield sink.take()
+    finally:
+        conn.close()
+
+
+@app.cli.command("build-factures")
+@click.option("--mois", help="Only the contracts starting in this month (YYYY-MM).")
+def build_factures_command(mois):
+    """Backfill the PDF cache of the confirmed demandes."""
+    if not facture_pdfs.enabled:
+        raise SystemExit("WeasyPrint is not installed (pip install weasyprint)")
+    where_clauses, params = ["statut='Confirmée'"], []
+    month_filter({"mois": mois or ""}, where_clauses, params)
+    conn = get_conn()
+    ids = [r[0] for r in conn.execute(
+        "SELECT id FROM demandes WHERE " + " AND ".join(where_clauses) + " ORDER BY id", params)]
+    todo = [rid for rid in ids if not facture_pdfs.lookup(conn, rid)]
     conn.close()
 
+    futures = [facture_pdfs.submit(rid) for rid in todo]
+    ok = sum(1 for fut in futures if fut.result())
+    print(f"{ok}/{len(todo)} contracts rendered ({len(ids) - len(todo)} already cached)")
+
+
+# =========================
+# Static assets
+# =========================
+# flask build-static كيكتب static/dist/<nom>.<hash>.<ext> (+ .gz / .br) و manifest.json،
+# و url_for('static', ...) كيرجع السمية المهاشية إلا كانت فـ manifest
+STATIC_DIST = "dist"
+STATIC_MANIFEST_PATH = os.path.join(app.static_folder, STATIC_DIST, "manifest.json")
+STATIC_SKIP = ("uploads", STATIC_DIST)
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt", ".html", ".xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+UPLOADS_MAX_AGE = 7 * 24 * 3600  # uploads كيتسماو بـ timestamp، مكيتبدلوش
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+?)\1\s*\)""")
+
+
+def load_static_manifest():
+    try:
+        with open(STATIC_MANIFEST_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+static_manifest = load_static_manifest()
+
+
+def rewrite_css_urls(css, rel, manifest):
+    """
+    Point the url(...) of the stylesheet `rel` at the fingerprinted files:
+    relative refs become relative to the CSS's own place in static/dist,
+    /static/... refs stay absolute. External, data: and unknown refs are kept.
+    """
+    css_dir = posixpath.dirname(rel)
+
+    def repl(m):
+        quote, ref = m.group(1), m.group(2).strip()
+        if ref.startswith(("data:", "http:", "https:", "//", "#")):
+            return m.group(0)
+        cut = min((i for i in (ref.find("?"), ref.find("#")) if i >= 0), default=len(ref))
+        path, suffix = ref[:cut], ref[cut:]
+        if path.startswith("/static/"):
+            hashed = manifest.get(path[len("/static/"):])
+            new = f"/static/{hashed}" if hashed else None
+        else:
+            hashed = manifest.get(posixpath.normpath(posixpath.join(css_dir, path)))
+            new = posixpath.relpath(hashed, posixpath.join(STATIC_DIST, css_dir)) if hashed else None
+        if new is None:
+            app.logger.warning("build-static: %s: url(%s) is not a static file, left as is", rel, ref)
+            return m.group(0)
+        return f"url({quote}{new}{suffix}{quote})"
+
+    return CSS_URL.sub(repl, css)
+
+
+def build_static():
+    """
+    Fingerprint every file of static/ (except uploads/) by content hash into
+    static/dist, with gzip / brotli variants of the text assets when they are
+    smaller. Stylesheets go last, once their url(...) targets have a hashed
+    name to point at. Return the new manifest {original name: hashed name}.
+    """
+    root = app.static_folder
+    dist = os.path.join(root, STATIC_DIST)
+    os.makedirs(dist, exist_ok=True)
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        if rel_dir == ".":
+            dirnames[:] = [d for d in dirnames if d not in STATIC_SKIP]
+        for name in filenames:
+            files.append(os.path.normpath(os.path.join(rel_dir, name)).replace(os.sep, "/"))
+    files.sort(key=lambda rel: (rel.lower().endswith(".css"), rel))
+
+    manifest = {}
+    for rel in files:
+        with open(os.path.join(root, rel), "rb") as f:
+            data = f.read()
+        base, ext = os.path.splitext(rel)
+        if ext.lower() == ".css":
+            data = rewrite_css_urls(data.decode("utf-8"), rel, manifest).encode("utf-8")
+        hashed = f"{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+        target = os.path.join(dist, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(target):
+            with open(target, "wb") as f:
+                f.write(data)
+        if ext.lower() in COMPRESSIBLE:
+            variants = {".gz": gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(data, quality=11)
+            for suffix, packed in variants.items():
+                if len(packed) < len(data):
+                    with open(target + suffix, "wb") as f:
+                        f.write(packed)
+        manifest[rel] = f"{STATIC_DIST}/{hashed}"
+
+    tmp = STATIC_MANIFEST_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp, STATIC_MANIFEST_PATH)
+    return manifest
+
+
+@app.cli.command("build-static")
+def build_static_command():
+    """Fingerprint + precompress static/ into static/dist (run on every deploy)."""
+    global static_manifest
+    static_manifest = build_static()
+    print(f"{len(static_manifest)} assets -> static/{STATIC_DIST} "
+          f"(gzip{', brotli' if brotli is not None else ''})")
+
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    if endpoint == "static":
+        hashed = static_manifest.get(values.get("filename"))
+        if hashed:
+            values["filename"] = hashed
+
+
+def static_files(filename):
+    """
+    static/dist: immutable + precompressed variant picked from Accept-Encoding.
+    uploads: long max-age (unique names). Anything else: Flask default.
+    """
+    folder = app.static_folder
+    if filename.startswith(STATIC_DIST + "/"):
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        served, encoding = filename, None
+        for enc, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if request.accept_encodings[enc] and os.path.isfile(os.path.join(folder, filename + suffix)):
+                served, encoding = filename + suffix, enc
+                break
+        resp = send_from_directory(folder, served, mimetype=mimetype, max_age=31536000)
+        if encoding:
+            resp.headers["Content-Encoding"] = encoding
+        if os.path.splitext(filename)[1].lower() in COMPRESSIBLE:
+            resp.vary.add("Accept-Encoding")
+        resp.headers["Cache-Control"] = IMMUTABLE
+        return resp
+    if filename.startswith("uploads/"):
+        return send_from_directory(folder, filename, max_age=UPLOADS_MAX_AGE)
+    return app.send_static_file(filename)
+
+
+app.view_functions["static"] = static_files
+
+
+# =========================
+# Public submissions
+# =========================
+# كل POST صالح ديال /demande و /contact كيدوز من submission_guard قبل ما يوصل لـ SQLite:
+#   token مستعمل من قبل (double-click, retry)  → replay: نفس الجواب، بلا insert
+#   demande قريبة بزاف ديال شي وحدة جديدة      → duplicate: نفس الشي
+#   bucket ديال IP ولا tel خاوي                  → 429 + Retry-After
+# كلشي فـ LRU محدود (SUBMIT_LRU_KEYS لكل map)، يعني memory ثابتة حتى مع bot.
+# Per process: الindex unique على submit_token هو اللي كيحمي بين workers.
+class TtlLru:
+    """Memory-bounded map: the least recently used key goes first, entries expire after ttl seconds."""
+
+    def __init__(self, max_items, ttl):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def add(self, key, value, now=None):
+        """Store value unless a live entry exists; return the existing value (None if added)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > now:
+                self._entries.move_to_end(key)
+                return item[1]
+            self._put(key, value, now)
+            return None
+
+    def put(self, key, value, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._put(key, value, now)
+
+    def _put(self, key, value, now):
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenBuckets:
+    """One token bucket per key (burst tokens, refilled per_min per minute), in a bounded LRU."""
+
+    def __init__(self, burst, per_min, max_keys):
+        self.burst = burst
+        self.rate = per_min / 60
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, now=None):
+        """Spend one token: 0 when allowed, else the seconds until the next one."""
+        if not self.burst:
+            return 0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate if self.rate else SUBMIT_TOKEN_TTL
+            # bucket منسي = bucket عامر: إلا تحيد من LRU ما كيضر حد
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key):
+        """Give back the token of a submission that was refused anyway."""
+        if not self.burst:
+            return
+        with self._lock:
+            item = self._buckets.get(key)
+            if item is not None:
+                self._buckets[key] = (min(self.burst, item[0] + 1), item[1])
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+_proxy_warned = False
+
+
+def client_ip():
+    """Address of the visitor (the PROXY_HOPS-th X-Forwarded-For entry from the right behind proxies)."""
+    global _proxy_warned
+    if not PROXY_HOPS:
+        if not _proxy_warned and "X-Forwarded-For" in request.headers:
+            _proxy_warned = True
+            app.logger.warning("X-Forwarded-For received but PROXY_HOPS=0: all visitors share the proxy's rate limit")
+        return request.remote_addr or ""
+    route = request.access_route
+    if len(route) >= PROXY_HOPS:
+        return route[-PROXY_HOPS]
+    return request.remote_addr or ""
+
+
+def tel_key(tel):
+    """Phone number reduced to its last 9 digits: 06 12 34 56 78 and +212612345678 are the same."""
+    return "".join(ch for ch in tel if ch.isdigit())[-9:]
+
+
+class SubmissionGuard:
+    """Idempotency, near-duplicate and rate-limit checks of the public forms."""
+
+    PENDING = object()
+
+    def __init__(self, max_keys):
+        self.tokens = TtlLru(max_keys, SUBMIT_TOKEN_TTL)
+        self.recent = TtlLru(max_keys, DEMANDE_DEDUPE_MINUTES * 60)
+        self.by_ip = TokenBuckets(RATE_IP_BURST, RATE_IP_PER_MIN, max_keys)
+        self.by_tel = TokenBuckets(RATE_TEL_BURST, RATE_TEL_PER_MIN, max_keys)
+        self.counts = dict.fromkeys(("new", "replay", "duplicate", "limited"), 0)
+
+    @staticmethod
+    def demande_key(form):
+        voiture = form["voiture_id"] or form["voiture"].lower()
+        return (tel_key(form["tel"]), voiture, form["date_debut"], form["date_fin"])
+
+    def _count(self, kind, outcome):
+        self.counts[outcome] += 1
+        metrics.inc("submissions_total", (("form", kind), ("outcome", outcome)))
+
+    def begin(self, kind, form, ip):
+        """
+        Check a valid submission before it touches SQLite. Returns
+        ("replay" | "duplicate", earlier form), ("limited", seconds to wait)
+        or ("new", None); a new submission keeps its token claimed until
+        done() or abort().
+        """
+        token = form.get("submit_token")
+        if token:
+            earlier = self.tokens.add((kind, token), self.PENDING)
+            if earlier is not None:
+                self._count(kind, "replay")
+                # نفس الفورم باقي كيتسجل (double-click): الجواب هو نفس الفورم
+                return "replay", form if earlier is self.PENDING else earlier
+
+        if kind == "demande" and DEMANDE_DEDUPE_MINUTES:
+            earlier = self.recent.get(self.demande_key(form))
+            if earlier is not None:
+                self._release(kind, form)
+                self._count(kind, "duplicate")
+                return "duplicate", earlier
+
+        wait = self.by_ip.take(ip)
+        if not wait and kind == "demande":
+            wait = self.by_tel.take(tel_key(form["tel"]))
+        if wait:
+            self._release(kind, form)
+            self._count(kind, "limited")
+            return "limited", wait
+
+        self._count(kind, "new")
+        return "new", None
+
+    def done(self, kind, form):
+        """The row is in: replays of the token or near-identical demandes get this form back."""
+        if form.get("submit_token"):
+            self.tokens.put((kind, form["submit_token"]), form)
+        if kind == "demande" and DEMANDE_DEDUPE_MINUTES:
+            self.recent.put(self.demande_key(form), form)
+
+    def abort(self, kind, form):
+        """
+        Nothing was stored (car taken, write failed): the same token may be
+        submitted again, and the phone bucket gets its token back, so trying
+        a few dates does not lock a customer out. The IP bucket stays spent.
+        """
+        self._release(kind, form)
+        if kind == "demande":
+            self.by_tel.refund(tel_key(form["tel"]))
+
+    def _release(self, kind, form):
+        if form.get("submit_token"):
+            self.tokens.pop((kind, form["submit_token"]))
+
+    def stats(self):
+        return {
+            **self.counts,
+            "tokens": len(self.tokens),
+            "recent_demandes": len(self.recent),
+            "ip_buckets": len(self.by_ip),
+            "tel_buckets": len(self.by_tel),
+        }
+
+
+submission_guard = SubmissionGuard(SUBMIT_LRU_KEYS)
+app.add_template_global(lambda: secrets.token_urlsafe(16), "submit_token")
+
+
+def rate_limited(template, wait, **context):
+    """429 page: the form again with a general error and Retry-After."""
+    errors = {"form": "Trop de demandes envoyées. Merci de réessayer dans quelques minutes."}
+    resp = make_response(render_template(template, errors=errors, **context), 429)
+    resp.headers["Retry-After"] = str(int(wait) + 1)
+    return resp
+
+
+# =========================
+# Client routes
+# =========================
+@app.route("/")
+@cached_page
+def index():
+    q = request.args.get("q", "").strip().lower()
+
+    popular_voitures = catalog_cache.get().popular
+
+    search_results = []
+    if q:
+        search_results = search_voitures(get_db(), q)
+
     return render_template(
         "index.html",
         popular_voitures=popular_voitures,
@@ -352,93 +3465,191 @@ def index():
     )
 
 
-@app.route("/nos-voitures")
-def nos_voitures():
-    # تحديث statuts تلقائياً
-    refresh_car_statuses()
+@app.route("/api/voitures/suggest")
+def api_voitures_suggest():
+    """Autocomplete for the home search box."""
+    q = request.args.get("q", "").strip()
+    rows = search_voitures(get_db(), q, limit=8) if q else []
+    return jsonify([
+        {"id": v["id"], "nom": v["nom"], "categorie": v["categorie"], "prix_jour": v["prix_jour"]}
+        for v in rows
+    ])
+
+
+@app.route("/api/voitures/calendrier")
+def api_voitures_calendrier():
+    """Free / taken days of every car (or of ?car_id=) between ?du= and ?au=."""
+    today = date.today()
+    du = request.args.get("du", "").strip() or today.isoformat()
+    au = request.args.get("au", "").strip() or (today + timedelta(days=30)).isoformat()
+    du, au, error = calendar_window(du, au)
+    if error:
+        return jsonify({"error": error}), 400
 
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM voitures ORDER BY id DESC")
-    voitures = cur.fetchall()
-    conn.close()
+    voitures = catalog_cache.get().voitures
+    car_id = request.args.get("car_id", type=int)
+    if car_id is not None:
+        voitures = [v for v in voitures if v["id"] == car_id]
+
+    n = _parse_day(au) - _parse_day(du) + 1
+    masks = fleet_busy_masks(conn, du, au)
+    return jsonify({
+        "du": du,
+        "au": au,
+        "jours": n,
+        "voitures": [
+            {
+                "id": v["id"],
+                "nom": v["nom"],
+                "categorie": v["categorie"],
+                "libre": not masks.get(v["id"]),
+                "occupation": mask_days(masks.get(v["id"], 0), n),
+            }
+            for v in voitures
+        ],
+    })
 
-    dispo, louees = [], []
-    for v in voitures:
-        if v["statut"] == "Louée":
-            louees.append(v)
-        else:
-            dispo.append(v)
 
-    return render_template("nos_voitures.html", dispo=dispo, louees=louees)
+@app.route("/nos-voitures")
+@cached_page
+def nos_voitures():
+    # statuts كيتحدثو ملي كيتعاود بناء الكاش
+    catalog = catalog_cache.get()
+
+    # ?du=&au= : شنو هي الطوموبيلات الخاويين فهاد المدة
+    du = request.args.get("du", "").strip()
+    au = request.args.get("au", "").strip()
+    libres, error = None, None
+    if du or au:
+        du, au, error = calendar_window(du, au)
+        if not error:
+            libres = free_voitures(get_db(), catalog.voitures, du, au)
+
+    return render_template(
+        "nos_voitures.html",
+        dispo=catalog.dispo,
+        louees=catalog.louees,
+        libres=libres,
+        du=du,
+        au=au,
+        error=error,
+    )
 
 
 @app.route("/demande")
 def demande():
     car = request.args.get("car", "")
-    return render_template("demande.html", car=car, errors={}, form={})
+    car_id = request.args.get("car_id", "")
+    form = {"date_debut": request.args.get("du", ""), "date_fin": request.args.get("au", "")}
+    return render_template("demande.html", car=car, car_id=car_id, errors={}, form=form)
+
+
+# الفورم ديال /demande و /contact مقسوم: validation / lectures / كتابة،
+# باش نفس الكود يخدم فالview sync وفالview async (ASGI mode)
+DEMANDE_FIELDS = ("nom", "tel", "email", "ville", "date_debut", "date_fin", "voiture", "voiture_id", "notes",
+                  "submit_token")
+DEMANDE_REQUIRED = {
+    "nom": "Nom obligatoire",
+    "tel": "Téléphone obligatoire",
+    "ville": "Ville obligatoire",
+    "date_debut": "Date début obligatoire",
+    "date_fin": "Date fin obligatoire",
+    "voiture": "Voiture obligatoire",
+}
+
+
+def demande_form(data):
+    """Stripped fields of the booking form + the missing required ones."""
+    form = {k: data.get(k, "").strip() for k in DEMANDE_FIELDS}
+    errors = {k: msg for k, msg in DEMANDE_REQUIRED.items() if not form[k]}
+    if not errors:
+        dd, df = _parse_day(form["date_debut"]), _parse_day(form["date_fin"])
+        if dd is None:
+            errors["date_debut"] = "Date invalide"
+        if df is None:
+            errors["date_fin"] = "Date invalide"
+        elif dd is not None and df < dd:
+            errors["date_fin"] = "La date de fin doit être après la date de début"
+    return form, errors
+
+
+def demande_check(conn, form):
+    """Reads of a booking: which car, and is it free on these dates. Returns (voiture, errors)."""
+    v = find_voiture(conn, form["voiture"], form["voiture_id"])
+    if not v:
+        return None, {"voiture": "Voiture introuvable."}
+
+    # منع تداخل الحجوزات
+    if not is_car_available_between(v["id"], form["date_debut"], form["date_fin"]):
+        return v, {"voiture": "Cette voiture n'est pas disponible pour ces dates."}
+    return v, {}
+
+
+def _insert_demande(conn, form, voiture_id):
+    # token déjà utilisé (retry arrivé sur un autre worker) → rien
+    return conn.execute("""
+        INSERT INTO demandes(nom,tel,email,ville,date_debut,date_fin,voiture,voiture_id,notes,statut,created_at,
+                             submit_token)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
+        ON CONFLICT(submit_token) WHERE submit_token IS NOT NULL DO NOTHING
+    """, (
+        form["nom"], form["tel"], form["email"], form["ville"], form["date_debut"], form["date_fin"],
+        form["voiture"], voiture_id, form["notes"], "En attente",
+        datetime.now().strftime("%Y-%m-%d %H:%M"), form["submit_token"] or None,
+    )).lastrowid
 
 
 @app.route("/demande", methods=["POST"])
 def demande_post():
-    nom = request.form.get("nom", "").strip()
-    tel = request.form.get("tel", "").strip()
-    email = request.form.get("email", "").strip()
-    ville = request.form.get("ville", "").strip()
-    date_debut = request.form.get("date_debut", "").strip()
-    date_fin = request.form.get("date_fin", "").strip()
-    voiture = request.form.get("voiture", "").strip()
-    notes = request.form.get("notes", "").strip()
-
-    errors = {}
-    if not nom:
-        errors["nom"] = "Nom obligatoire"
-    if not tel:
-        errors["tel"] = "Téléphone obligatoire"
-    if not ville:
-        errors["ville"] = "Ville obligatoire"
-    if not date_debut:
-        errors["date_debut"] = "Date début obligatoire"
-    if not date_fin:
-        errors["date_fin"] = "Date fin obligatoire"
-    if not voiture:
-        errors["voiture"] = "Voiture obligatoire"
-
-    form = dict(
-        nom=nom, tel=tel, email=email, ville=ville,
-        date_debut=date_debut, date_fin=date_fin,
-        voiture=voiture, notes=notes
-    )
-
+    form, errors = demande_form(request.form)
     if errors:
-        return render_template("demande.html", car=voiture, errors=errors, form=form)
+        return render_template("demande.html", car=form["voiture"], errors=errors, form=form)
 
-    # منع تداخل الحجوزات
-    if not is_car_available_between(voiture, date_debut, date_fin):
-        errors["voiture"] = "Cette voiture n'est pas disponible pour ces dates."
-        return render_template("demande.html", car=voiture, errors=errors, form=form)
+    outcome, info = submission_guard.begin("demande", form, client_ip())
+    if outcome == "limited":
+        return rate_limited("demande.html", info, car=form["voiture"], form=form)
+    if outcome != "new":
+        return render_template("demande_confirm.html", form=info)
 
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO demandes(nom,tel,email,ville,date_debut,date_fin,voiture,notes,statut,created_at)
-        VALUES(?,?,?,?,?,?,?,?,?,?)
-    """, (
-        nom, tel, email, ville, date_debut, date_fin,
-        voiture, notes, "En attente",
-        datetime.now().strftime("%Y-%m-%d %H:%M")
-    ))
-    conn.commit()
-    conn.close()
+    try:
+        v, errors = demande_check(get_db(), form)
+        if not errors:
+            run_write(_insert_demande, form, v["id"])
+    except Exception:
+        submission_guard.abort("demande", form)
+        raise
+    if errors:
+        submission_guard.abort("demande", form)
+        return render_template("demande.html", car=form["voiture"], errors=errors, form=form)
 
+    submission_guard.done("demande", form)
     return render_template("demande_confirm.html", form=form)
 
 
 @app.route("/qui-sommes-nous")
+@cached_page
 def qui_sommes_nous():
     return render_template("qui_sommes_nous.html")
 
 
+CONTACT_REQUIRED = {"nom": "Nom obligatoire", "email": "Email obligatoire", "message": "Message obligatoire"}
+
+
+def contact_form(data):
+    form = {k: data.get(k, "").strip() for k in (*CONTACT_REQUIRED, "submit_token")}
+    errors = {k: msg for k, msg in CONTACT_REQUIRED.items() if not form[k]}
+    return form, errors
+
+
+def _insert_contact(conn, form):
+    conn.execute("""
+        INSERT INTO contacts(nom,email,message,created_at,submit_token) VALUES(?,?,?,?,?)
+        ON CONFLICT(submit_token) WHERE submit_token IS NOT NULL DO NOTHING
+    """, (form["nom"], form["email"], form["message"], datetime.now().strftime("%Y-%m-%d %H:%M"),
+          form["submit_token"] or None))
+
+
 @app.route("/contact", methods=["GET", "POST"])
 def contact():
     errors = {}
@@ -446,36 +3657,278 @@ def contact():
     sent = False
 
     if request.method == "POST":
-        nom = request.form.get("nom", "").strip()
-        email = request.form.get("email", "").strip()
-        message = request.form.get("message", "").strip()
-
-        form["nom"] = nom
-        form["email"] = email
-        form["message"] = message
-
-        if not nom:
-            errors["nom"] = "Nom obligatoire"
-        if not email:
-            errors["email"] = "Email obligatoire"
-        if not message:
-            errors["message"] = "Message obligatoire"
-
+        form, errors = contact_form(request.form)
         if not errors:
-            conn = get_conn()
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO contacts(nom,email,message,created_at) VALUES(?,?,?,?)",
-                (nom, email, message, datetime.now().strftime("%Y-%m-%d %H:%M")),
-            )
-            conn.commit()
-            conn.close()
+            outcome, info = submission_guard.begin("contact", form, client_ip())
+            if outcome == "limited":
+                return rate_limited("contact.html", info, form=form, sent=False)
+            if outcome == "new":
+                try:
+                    run_write(_insert_contact, form)
+                except Exception:
+                    submission_guard.abort("contact", form)
+                    raise
+                submission_guard.done("contact", form)
             sent = True
             form = {"nom": "", "email": "", "message": ""}
 
     return render_template("contact.html", errors=errors, form=form, sent=sent)
 
 
+# =========================
+# Admin listing helpers
+# =========================
+def keyset_page(cur, table, columns, where_clauses=(), params=(), limit=None):
+    """
+    One page of `table` ordered by id DESC, using the id as cursor instead of OFFSET.
+      ?before=<id>  -> older rows  (WHERE id < ? ORDER BY id DESC)
+      ?after=<id>   -> newer rows  (WHERE id > ? ORDER BY id ASC, then reversed)
+    Returns (rows, next_cursor, prev_cursor); a cursor is None when there is no such page.
+    """
+    limit = limit or ADMIN_PAGE_SIZE
+    before = request.args.get("before", type=int)
+    after = request.args.get("after", type=int)
+
+    where = list(where_clauses)
+    args = list(params)
+    if after is not None:
+        where.append("id > ?")
+        args.append(after)
+        order = "ASC"
+    else:
+        if before is not None:
+            where.append("id < ?")
+            args.append(before)
+        order = "DESC"
+
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY id {order} LIMIT ?"
+    cur.execute(sql, args + [limit + 1])
+    rows = cur.fetchall()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if after is not None:
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = before is not None, more
+
+    next_cursor = rows[-1]["id"] if rows and has_older else None
+    prev_cursor = rows[0]["id"] if rows and has_newer else None
+    return rows, next_cursor, prev_cursor
+
+
+def page_urls(endpoint, next_cursor, prev_cursor):
+    """Next / previous page links keeping the current filters."""
+    args = {k: v for k, v in request.args.items() if k not in ("before", "after")}
+    next_url = url_for(endpoint, before=next_cursor, **args) if next_cursor else None
+    prev_url = url_for(endpoint, after=prev_cursor, **args) if prev_cursor else None
+    return next_url, prev_url
+
+
+def reservation_filters(args, nom_col="nom", voiture_col="voiture"):
+    """WHERE clauses for the client / voiture / date filters of the reservations screens."""
+    client_q = args.get("client", "").strip()
+    voiture_q = args.get("voiture", "").strip()
+    date_q = args.get("date", "").strip()
+
+    where_clauses = []
+    params = []
+
+    if client_q:
+        where_clauses.append(f"{nom_col} LIKE ?")
+        params.append(f"%{client_q}%")
+
+    if voiture_q:
+        where_clauses.append(f"{voiture_col} LIKE ?")
+        params.append(f"%{voiture_q}%")
+
+    if date_q:
+        where_clauses.append("(date_debut <= ? AND date_fin >= ?)")
+        params.append(date_q)
+        params.append(date_q)
+
+    return where_clauses, params
+
+
+# =========================
+# Streaming exports
+# =========================
+EXPORT_BATCH = 500
+
+RESERVATION_EXPORT_COLUMNS = (
+    "id", "nom", "tel", "email", "ville", "voiture", "voiture_id",
+    "date_debut", "date_fin", "statut", "created_at", "notes",
+)
+CONTRAT_EXPORT_COLUMNS = (
+    "id", "demande_id", "client_nom", "client_cin", "client_permis",
+    "voiture_nom", "voiture_id", "immatriculation", "categorie",
+    "date_debut", "date_fin", "jours", "prix_jour", "total", "statut", "created_at",
+)
+
+
+def iter_export_rows(table, columns, where_clauses, params):
+    """
+    Stream rows straight from a sqlite cursor, EXPORT_BATCH at a time.
+    Uses its own connection: the generator outlives the request's one.
+    """
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    if where_clauses:
+        sql += " WHERE " + " AND ".join(where_clauses)
+    sql += " ORDER BY id"
+
+    conn = get_conn()
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            for r in rows:
+                yield tuple(r)
+    finally:
+        conn.close()
+
+
+def iter_csv(columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")  # BOM باش Excel يقرا الأكسنت
+    writer.writerow(columns)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if i % EXPORT_BATCH == 0:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+class _ZipSink:
+    """Write-only, non-seekable file object: zipfile streams into it, we drain it."""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c t="n"><v>{value}</v></c>'
+    text = "".join(ch for ch in str(value) if ch in "\t\n\r" or ord(ch) >= 32)
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{xml_escape(text)}</t></is></c>'
+
+
+def iter_xlsx(columns, rows, sheet_name="Export"):
+    """Minimal streamed XLSX: the sheet XML is deflated into the zip row by row."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, content in XLSX_STATIC_PARTS.items():
+            zf.writestr(name, content)
+        zf.writestr("xl/workbook.xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{xml_escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'
+        ))
+        yield sink.take()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>'
+                "<row>" + "".join(_xlsx_cell(c) for c in columns) + "</row>"
+            ).encode("utf-8"))
+            for row in rows:
+                sheet.write(("<row>" + "".join(_xlsx_cell(v) for v in row) + "</row>").encode("utf-8"))
+                if sink.size >= 64 * 1024:
+                    yield sink.take()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.take()
+
+
+def export_response(name, table, columns, where_clauses, params):
+    fmt = request.args.get("format", "csv").lower()
+    rows = iter_export_rows(table, columns, where_clauses, params)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M")
+
+    if fmt == "xlsx":
+        body = iter_xlsx(columns, rows, sheet_name=name.capitalize())
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        fmt = "csv"
+        body = iter_csv(columns, rows)
+        mimetype = "text/csv; charset=utf-8"
+
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{name}_{stamp}.{fmt}"',
+    })
+
+
+def month_filter(args, where_clauses, params):
+    """Optional ?mois=YYYY-MM: rows whose date_debut falls in that month (monthly dumps)."""
+    mois = args.get("mois", "").strip()
+    try:
+        start = datetime.strptime(mois, "%Y-%m").date()
+    except ValueError:
+        return
+    end = date(start.year + (start.month == 12), start.month % 12 + 1, 1)
+    where_clauses.append("(date_debut >= ? AND date_debut < ?)")
+    params.extend([start.isoformat(), end.isoformat()])
+
+
 # =========================
 # Admin auth
 # =========================
@@ -506,117 +3959,197 @@ def admin_dashboard():
     if not require_admin():
         return redirect(url_for("login"))
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    # عدد الحجوزات
-    cur.execute("SELECT COUNT(*) FROM demandes")
-    total_reservations = cur.fetchone()[0] or 0
-
-    # عدد السيارات كاملة
-    cur.execute("SELECT COUNT(*) FROM voitures")
-    total_voits = cur.fetchone()[0] or 0  # إلا محتاجاه فشي بلاصة أخرى
+    # statuts ديال اليوم (set-based، ما كيكتبش إلا إلا تبدل شي حاجة)
+    refresh_car_statuses_inline()
 
-    # المتاحين
-    cur.execute("SELECT COUNT(*) FROM voitures WHERE statut='Disponible'")
-    total_disponibles = cur.fetchone()[0] or 0
+    # dashboard_stats كيتحدث بالـ triggers: سطر واحد
+    cur = get_db().cursor()
+    cur.execute("SELECT * FROM dashboard_stats WHERE id = 1")
+    stats = cur.fetchone()
+    if stats is None:
+        reconcile_dashboard_stats()
+        cur.execute("SELECT * FROM dashboard_stats WHERE id = 1")
+        stats = cur.fetchone()
 
-    # المكرايين
-    cur.execute("SELECT COUNT(*) FROM voitures WHERE statut='Louée'")
-    total_loues = cur.fetchone()[0] or 0
-
-    # عدد الزبناء
-    cur.execute("SELECT COUNT(*) FROM clients")
-    total_clients = cur.fetchone()[0] or 0
-
-    conn.close()
+    # panels ديال accidents / visites / assurances من fleet_alerts
+    accident_cars, visite_cars, assurance_cars = fleet_alert_panels(get_db())
 
     return render_template(
         "admin_dashboard.html",
-        total_reservations=total_reservations,
-        total_disponibles=total_disponibles,
-        total_loues=total_loues,
-        total_clients=total_clients,
-        total_voits=total_voits  # خليه احتياط
+        total_reservations=stats["total_reservations"],
+        total_disponibles=stats["total_disponibles"],
+        total_loues=stats["total_loues"],
+        total_clients=stats["total_clients"],
+        total_voits=stats["total_voitures"],  # خليه احتياط
+        accident_cars=accident_cars,
+        visite_cars=visite_cars,
+        assurance_cars=assurance_cars,
     )
 
+
+def analytics_args():
+    """from / to / period of the analytics screens (default: the last 12 months, by month)."""
+    today = date.today()
+    default_from = date(today.year - (today.month <= 11), (today.month - 12) % 12 + 1, 1)
+    date_from = request.args.get("from", "").strip()
+    date_to = request.args.get("to", "").strip()
+    if _parse_day(date_from) is None:
+        date_from = default_from.isoformat()
+    if _parse_day(date_to) is None:
+        date_to = today.isoformat()
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+    period = request.args.get("period", "month")
+    if period not in ANALYTICS_PERIODS:
+        period = "month"
+    return date_from, date_to, period
+
+
+@app.route("/admin/analytics")
+def admin_analytics():
     if not require_admin():
         return redirect(url_for("login"))
+    report = analytics_report(get_db(), *analytics_args())
+    return render_template("admin_analytics.html", r=report)
 
-    conn = get_conn()
-    cur = conn.cursor()
 
-    # مجموع الطلبات
-    cur.execute("SELECT COUNT(*) FROM demandes")
-    total_res = cur.fetchone()[0] or 0
+@app.route("/admin/api/analytics")
+def admin_api_analytics():
+    if not require_admin():
+        return jsonify({"error": "unauthorized"}), 401
+    return jsonify(analytics_report(get_db(), *analytics_args()))
+
 
-    # مجموع الزبناء
-    cur.execute("SELECT COUNT(*) FROM clients")
-    total_cli = cur.fetchone()[0] or 0
+@app.route("/admin/db-pool")
+def admin_db_pool():
+    if not require_admin():
+        return redirect(url_for("login"))
+    return jsonify(db_pool.stats())
 
-    # مجموع السيارات
-    cur.execute("SELECT COUNT(*) FROM voitures")
-    total_voits = cur.fetchone()[0] or 0
 
-    # السيارات المتاحة
-    cur.execute("SELECT COUNT(*) FROM voitures WHERE statut='Disponible'")
-    total_dispo = cur.fetchone()[0] or 0
+@app.route("/admin/cache-stats")
+def admin_cache_stats():
+    if not require_admin():
+        return redirect(url_for("login"))
+    return jsonify({
+        "catalog": catalog_cache.stats(),
+        "pages": page_cache.stats(),
+        "images": image_pipeline.stats(),
+        "factures": facture_pdfs.stats(),
+        "jobs": job_queue.stats(),
+        "submissions": submission_guard.stats(),
+    })
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint (per process: each worker exposes its own numbers)."""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+
+    gauges = []
+    for key, value in db_pool.stats().items():
+        if isinstance(value, (int, float)):
+            gauges.append(("db_pool", (("stat", key),), value))
+    gauges.append(("db_write_queue_depth", (), db_writer.depth()))
+    gauges.append(("db_write_jobs", (("result", "done"),), db_writer.done))
+    gauges.append(("db_write_jobs", (("result", "failed"),), db_writer.failed))
+    counts, lag = job_queue.depth(get_db())
+    for statut, n in counts.items():
+        gauges.append(("job_queue_depth", (("statut", statut),), n))
+    gauges.append(("job_queue_lag_seconds", (), round(lag, 3)))
+    for pool in (asgi_pool, async_db.pool):
+        gauges.append(("asgi_pool_inflight", (("pool", pool.name),), pool.inflight))
+    for cache, stats in (("catalog", catalog_cache.stats()), ("pages", page_cache.stats())):
+        for key in ("hits", "misses"):
+            gauges.append(("cache_lookups", (("cache", cache), ("result", key)), stats[key]))
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/jobs")
+def admin_jobs():
+    if not require_admin():
+        return redirect(url_for("login"))
 
-    # السيارات المكرايين
-    cur.execute("SELECT COUNT(*) FROM voitures WHERE statut='Louée'")
-    total_loues = cur.fetchone()[0] or 0
+    conn = get_db()
+    cur = conn.cursor()
 
-    conn.close()
+    where_clauses, params = [], []
+    statut = request.args.get("statut", "").strip()
+    if statut:
+        where_clauses.append("statut = ?")
+        params.append(statut)
+    kind = request.args.get("kind", "").strip()
+    if kind:
+        where_clauses.append("kind = ?")
+        params.append(kind)
+
+    jobs, next_cursor, prev_cursor = keyset_page(
+        cur, "jobs",
+        ("id", "kind", "payload", "statut", "attempts", "max_attempts",
+         "datetime(run_after, 'unixepoch', 'localtime') AS run_at", "last_error", "created_at", "finished_at"),
+        where_clauses, params,
+    )
+    next_url, prev_url = page_urls("admin_jobs", next_cursor, prev_cursor)
+    counts, lag = job_queue.depth(conn)
 
     return render_template(
-        "admin_dashboard.html",
-        total_res=total_res,
-        total_cli=total_cli,
-        total_voits=total_voits,
-        total_dispo=total_dispo,
-        total_loues=total_loues
+        "admin_jobs.html",
+        jobs=jobs,
+        counts=counts,
+        lag=lag,
+        kinds=sorted(JOB_HANDLERS),
+        statuts=(JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED),
+        next_url=next_url,
+        prev_url=prev_url,
     )
 
 
-@app.route("/admin/reservations")
-def admin_reservations():
+@app.route("/admin/jobs/<int:job_id>/relancer", methods=["POST"])
+def admin_job_retry(job_id):
     if not require_admin():
         return redirect(url_for("login"))
 
-    client_q = request.args.get("client", "").strip()
-    voiture_q = request.args.get("voiture", "").strip()
-    date_q = request.args.get("date", "").strip()
-
-    conn = get_conn()
-    cur = conn.cursor()
+    execute_write(
+        "UPDATE jobs SET statut=?, attempts=0, run_after=?, finished_at=NULL WHERE id=? AND statut=?",
+        (JOB_PENDING, time.time(), job_id, JOB_FAILED),
+    )
+    job_queue.wake()
+    return redirect(request.referrer or url_for("admin_jobs"))
 
-    base_sql = "SELECT * FROM demandes"
-    where_clauses = []
-    params = []
 
-    if client_q:
-        where_clauses.append("nom LIKE ?")
-        params.append(f"%{client_q}%")
+@app.route("/admin/reservations")
+def admin_reservations():
+    if not require_admin():
+        return redirect(url_for("login"))
 
-    if voiture_q:
-        where_clauses.append("voiture LIKE ?")
-        params.append(f"%{voiture_q}%")
+    conn = get_db()
+    cur = conn.cursor()
 
-    if date_q:
-        where_clauses.append("(date_debut <= ? AND date_fin >= ?)")
-        params.append(date_q)
-        params.append(date_q)
+    where_clauses, params = reservation_filters(request.args)
+    demandes, next_cursor, prev_cursor = keyset_page(
+        cur, "demandes",
+        ("id", "nom", "tel", "voiture", "date_debut", "date_fin", "statut"),
+        where_clauses, params,
+    )
+    next_url, prev_url = page_urls("admin_reservations", next_cursor, prev_cursor)
 
-    if where_clauses:
-        base_sql += " WHERE " + " AND ".join(where_clauses)
+    return render_template(
+        "admin_reservations.html",
+        demandes=demandes,
+        next_url=next_url,
+        prev_url=prev_url,
+    )
 
-    base_sql += " ORDER BY id DESC"
 
-    cur.execute(base_sql, params)
-    demandes = cur.fetchall()
-    conn.close()
+@app.route("/admin/reservations/export")
+def admin_reservations_export():
+    if not require_admin():
+        return redirect(url_for("login"))
 
-    return render_template("admin_reservations.html", demandes=demandes)
+    where_clauses, params = reservation_filters(request.args)
+    month_filter(request.args, where_clauses, params)
+    return export_response("reservations", "demandes", RESERVATION_EXPORT_COLUMNS, where_clauses, params)
 
 
 @app.route("/admin/reservations/<int:rid>")
@@ -624,13 +4157,12 @@ def admin_res_detail(rid):
     if not require_admin():
         return redirect(url_for("login"))
 
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("SELECT * FROM demandes WHERE id=?", (rid,))
     d = cur.fetchone()
     if not d:
-        conn.close()
         return "Réservation introuvable", 404
 
     jours = 1
@@ -645,8 +4177,8 @@ def admin_res_detail(rid):
         jours = 1
 
     cur.execute(
-        "SELECT categorie, prix_jour, image, statut, immatriculation FROM voitures WHERE nom=? LIMIT 1",
-        (d["voiture"],),
+        "SELECT categorie, prix_jour, image, statut, immatriculation FROM voitures WHERE id=?",
+        (d["voiture_id"],),
     )
     v = cur.fetchone()
 
@@ -656,8 +4188,6 @@ def admin_res_detail(rid):
         prix_jour = v["prix_jour"]
         total = prix_jour * jours
 
-    conn.close()
-
     return render_template(
         "admin_reservation_detail.html",
         d=d,
@@ -676,76 +4206,29 @@ def admin_change_statut(rid, st):
     if st not in ("En attente", "Confirmée", "Annulée"):
         return redirect(url_for("admin_reservations"))
 
-    conn = get_conn()
-    cur = conn.cursor()
-
-    cur.execute("SELECT * FROM demandes WHERE id=?", (rid,))
-    d = cur.fetchone()
+    # check + statut + voiture + contrat فـ transaction وحدة (BEGIN IMMEDIATE)
+    try:
+        d, contrat_id = run_booking(set_demande_statut, rid, st)
+    except BookingConflict:
+        return "هذه السيارة مكراية فهذ التواريخ. مايمكنش نأكد الطلب.", 400
     if not d:
-        conn.close()
         return redirect(url_for("admin_reservations"))
 
-    cur.execute("UPDATE demandes SET statut=? WHERE id=?", (st, rid))
+    catalog_cache.invalidate()
 
+    # تحديث index ديال availability
     if st == "Confirmée":
-        # قبل confirmation نتأكدو من availability (منع التداخل)
-        if not is_car_available_between(d["voiture"], d["date_debut"], d["date_fin"], ignore_demande_id=rid):
-            conn.close()
-            return "هذه السيارة مكراية فهذ التواريخ. مايمكنش نأكد الطلب.", 400
-
-        # السيارة تولّي Louée
-        cur.execute(
-            "UPDATE voitures SET statut=? WHERE nom=?",
-            ("Louée", d["voiture"]),
-        )
-
-        # نتأكدو واش كاين contrat لهاد demande
-        cur.execute("SELECT id FROM contrats WHERE demande_id=? LIMIT 1", (rid,))
-        c = cur.fetchone()
-
-        if not c:
-            cur.execute(
-                "SELECT categorie, prix_jour, immatriculation FROM voitures WHERE nom=? LIMIT 1",
-                (d["voiture"],)
-            )
-            v = cur.fetchone()
-
-            jours = 1
-            try:
-                dd = datetime.strptime(d["date_debut"], "%Y-%m-%d")
-                df = datetime.strptime(d["date_fin"], "%Y-%m-%d")
-                delta = (df - dd).days
-                if delta > 0:
-                    jours = delta
-            except Exception:
-                jours = 1
-
-            prix_jour = v["prix_jour"] if v and v["prix_jour"] else None
-            total = prix_jour * jours if prix_jour else None
-
-            # كنخلق contrat جديد
-            cur.execute("""
-                INSERT INTO contrats
-                (demande_id, client_nom, voiture_nom, categorie, immatriculation,
-                 date_debut, date_fin, jours, prix_jour, total)
-                VALUES (?,?,?,?,?,?,?,?,?,?)
-            """, (
-                rid,
-                d["nom"],
-                d["voiture"],
-                v["categorie"] if v else None,
-                v["immatriculation"] if v else None,
-                d["date_debut"],
-                d["date_fin"],
-                jours,
-                prix_jour,
-                total
-            ))
-
-    conn.commit()
-    conn.close()
+        availability_index.add(("demande", rid), d["voiture_id"], d["date_debut"], d["date_fin"])
+        if contrat_id:
+            availability_index.add(("contrat", contrat_id), d["voiture_id"], d["date_debut"], d["date_fin"])
+    else:
+        availability_index.remove(("demande", rid))
+        if contrat_id:
+            availability_index.remove(("contrat", contrat_id))
 
     if st == "Confirmée":
+        # PDF ديال الcontrat: job تزاد مع الcontrat
+        job_queue.wake()
         return redirect(url_for("admin_facture", rid=rid))
     return redirect(url_for("admin_reservations"))
 
@@ -755,51 +4238,47 @@ def admin_facture(rid):
     if not require_admin():
         return redirect(url_for("login"))
 
-    conn = get_conn()
-    cur = conn.cursor()
+    ctx = facture_context(get_db(), rid)
+    if ctx is None:
+        return "Réservation introuvable", 404
 
-    cur.execute("SELECT * FROM demandes WHERE id=?", (rid,))
-    d = cur.fetchone()
-    if not d:
-        conn.close()
+    return render_template("admin_facture.html", pdf_enabled=facture_pdfs.enabled, **ctx)
+
+
+@app.route("/admin/reservations/<int:rid>/facture.pdf")
+def admin_facture_pdf(rid):
+    if not require_admin():
+        return redirect(url_for("login"))
+    if not facture_pdfs.enabled:
+        return redirect(url_for("admin_facture", rid=rid))
+
+    path = facture_pdfs.get(get_db(), rid)
+    if not path:
         return "Réservation introuvable", 404
 
-    jours = 1
-    prix_jour = None
-    total = None
-    try:
-        if d["date_debut"] and d["date_fin"]:
-            dd = datetime.strptime(d["date_debut"], "%Y-%m-%d")
-            df = datetime.strptime(d["date_fin"], "%Y-%m-%d")
-            jours = (df - dd).days
-            if jours <= 0:
-                jours = 1
-    except Exception:
-        jours = 1
+    resp = send_file(path, mimetype="application/pdf", download_name=f"contrat_{rid}.pdf", conditional=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
-    # نجيب معلومات السيارة كاملة (1)
-    cur.execute(
-        "SELECT prix_jour, immatriculation, categorie FROM voitures WHERE nom=? LIMIT 1",
-        (d["voiture"],)
-    )
-    v = cur.fetchone()
 
-    if v and v["prix_jour"]:
-        prix_jour = v["prix_jour"]
-        total = prix_jour * jours
+@app.route("/admin/factures.zip")
+def admin_factures_zip():
+    """?mois=YYYY-MM: all the contracts (confirmed demandes) starting that month."""
+    if not require_admin():
+        return redirect(url_for("login"))
+    if not facture_pdfs.enabled:
+        return "PDF indisponible (WeasyPrint non installé)", 501
 
-    conn.close()
-    today = datetime.now().strftime("%d/%m/%Y")
+    where_clauses, params = ["statut='Confirmée'"], []
+    month_filter(request.args, where_clauses, params)
+    if not params:
+        return "Paramètre mois=YYYY-MM requis", 400
 
-    return render_template(
-        "admin_facture.html",
-        d=d,
-        v=v,
-        jours=jours,
-        prix_jour=prix_jour,
-        total=total,
-        today=today
-    )
+    ids = [r[0] for r in get_db().execute(
+        "SELECT id FROM demandes WHERE " + " AND ".join(where_clauses) + " ORDER BY date_debut, id", params)]
+    return Response(iter_factures_zip(ids), mimetype="application/zip", headers={
+        "Content-Disposition": f'attachment; filename="contrats_{request.args["mois"].strip()}.zip"',
+    })
 
 
 @app.route("/admin/voitures", methods=["GET", "POST"])
@@ -808,9 +4287,9 @@ def admin_voitures():
         return redirect(url_for("login"))
 
     # تحديث statuts حتى فالadmin (4)
-    refresh_car_statuses()
+    refresh_car_statuses_inline()
 
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
 
     if request.method == "POST":
@@ -834,25 +4313,103 @@ def admin_voitures():
             except ValueError:
                 p = None
 
-            cur.execute(
-                "INSERT INTO voitures(nom,categorie,prix_jour,immatriculation,statut,image) VALUES(?,?,?,?,?,?)",
-                (nom, categorie, p, immatriculation, "Disponible", filename),
-            )
-            conn.commit()
+            def add_voiture(conn):
+                conn.execute(
+                    "INSERT INTO voitures(nom,categorie,prix_jour,immatriculation,statut,image) VALUES(?,?,?,?,?,?)",
+                    (nom, categorie, p, immatriculation, "Disponible", filename),
+                )
+                # thumbnails + WebP: job فنفس transaction
+                if filename and Image is not None:
+                    enqueue_job(conn, "image_variants", {"filename": filename})
+
+            run_write(add_voiture)
+            catalog_cache.invalidate()
+            job_queue.wake()
 
     cur.execute("SELECT * FROM voitures ORDER BY id")
     voitures = cur.fetchall()
-    conn.close()
 
     return render_template("admin_voitures.html", voitures=voitures)
 
 
+@app.route("/admin/voitures/<int:voiture_id>", methods=["GET", "POST"])
+def admin_voitures_detail(voiture_id):
+    if not require_admin():
+        return redirect(url_for("login"))
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM voitures WHERE id=?", (voiture_id,))
+    v = cur.fetchone()
+    if not v:
+        return redirect(url_for("admin_voitures"))
+
+    errors = {}
+    if request.method == "POST":
+        action = request.form.get("action", "")
+        f = {k: request.form.get(k, "").strip() for k in request.form}
+
+        if action == "incident":
+            if _parse_day(f.get("date_incident", "")) is None:
+                errors["incident"] = "Date invalide"
+            else:
+                sql = "INSERT INTO voiture_incidents(voiture_id, date_incident, degat) VALUES(?,?,?)"
+                params = (voiture_id, f["date_incident"], f.get("degat") or None)
+        elif action == "reparer":
+            sql = "UPDATE voiture_incidents SET statut='Réparé' WHERE id=? AND voiture_id=?"
+            params = (request.form.get("incident_id", type=int), voiture_id)
+        elif action == "visite":
+            if _parse_day(f.get("date_visite", "")) is None or _parse_day(f.get("prochaine_visite", "")) is None:
+                errors["visite"] = "Dates invalides"
+            else:
+                sql = "INSERT INTO voiture_visites(voiture_id, date_visite, prochaine_visite, notes) VALUES(?,?,?,?)"
+                params = (voiture_id, f["date_visite"], f["prochaine_visite"], f.get("notes") or None)
+        elif action == "assurance":
+            if _parse_day(f.get("fin", "")) is None:
+                errors["assurance"] = "Date de fin invalide"
+            else:
+                sql = "INSERT INTO voiture_assurances(voiture_id, assureur, police, debut, fin) VALUES(?,?,?,?,?)"
+                params = (voiture_id, f.get("assureur") or None, f.get("police") or None,
+                          f.get("debut") or None, f["fin"])
+        else:
+            errors["action"] = "Action inconnue"
+
+        if not errors:
+            def write(wconn):
+                wconn.execute(sql, params)
+                # الـ queue كتتحدث فنفس transaction
+                refresh_fleet_alerts(wconn, voiture_id)
+
+            run_write(write)
+            return redirect(url_for("admin_voitures_detail", voiture_id=voiture_id))
+
+    cur.execute("SELECT * FROM voiture_incidents WHERE voiture_id=? ORDER BY date_incident DESC", (voiture_id,))
+    incidents = cur.fetchall()
+    cur.execute("SELECT * FROM voiture_visites WHERE voiture_id=? ORDER BY date_visite DESC", (voiture_id,))
+    visites = cur.fetchall()
+    cur.execute("SELECT * FROM voiture_assurances WHERE voiture_id=? ORDER BY fin DESC", (voiture_id,))
+    assurances = cur.fetchall()
+    cur.execute("SELECT kind, due, info FROM fleet_alerts WHERE voiture_id=?", (voiture_id,))
+    alerts = {r["kind"]: r for r in cur.fetchall()}
+
+    return render_template(
+        "admin_voiture_detail.html",
+        v=v,
+        incidents=incidents,
+        visites=visites,
+        assurances=assurances,
+        alerts=alerts,
+        errors=errors,
+        today=date.today().isoformat(),
+    )
+
+
 @app.route("/admin/clients", methods=["GET", "POST"])
 def admin_clients():
     if not require_admin():
         return redirect(url_for("login"))
 
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
 
     if request.method == "POST":
@@ -863,20 +4420,26 @@ def admin_clients():
         permis_num = request.form.get("permis_num", "").strip()
 
         if prenom or nom:
-            cur.execute("""
+            execute_write("""
                 INSERT INTO clients(prenom,nom,tel,cin_num,permis_num,created_at)
                 VALUES(?,?,?,?,?,?)
             """, (
                 prenom, nom, tel, cin_num, permis_num,
                 datetime.now().strftime("%Y-%m-%d %H:%M")
             ))
-            conn.commit()
 
-    cur.execute("SELECT * FROM clients ORDER BY id DESC")
-    clients = cur.fetchall()
-    conn.close()
+    clients, next_cursor, prev_cursor = keyset_page(
+        cur, "clients",
+        ("id", "prenom", "nom", "tel", "cin_num", "permis_num", "created_at"),
+    )
+    next_url, prev_url = page_urls("admin_clients", next_cursor, prev_cursor)
 
-    return render_template("admin_clients.html", clients=clients)
+    return render_template(
+        "admin_clients.html",
+        clients=clients,
+        next_url=next_url,
+        prev_url=prev_url,
+    )
 
 
 @app.route("/admin/contrats")
@@ -884,14 +4447,33 @@ def admin_contrats():
     if not require_admin():
         return redirect(url_for("login"))
 
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM contrats ORDER BY id DESC")
-    contrats = cur.fetchall()
-    conn.close()
+    contrats, next_cursor, prev_cursor = keyset_page(
+        cur, "contrats",
+        ("id", "demande_id", "client_nom", "voiture_nom", "date_debut", "date_fin", "total"),
+    )
+    next_url, prev_url = page_urls("admin_contrats", next_cursor, prev_cursor)
+
+    return render_template(
+        "admin_contrats.html",
+        contrats=contrats,
+        next_url=next_url,
+        prev_url=prev_url,
+        pdf_enabled=facture_pdfs.enabled,
+        mois=date.today().strftime("%Y-%m"),
+    )
+
+
+@app.route("/admin/contrats/export")
+def admin_contrats_export():
+    if not require_admin():
+        return redirect(url_for("login"))
 
-    return render_template("admin_contrats.html", contrats=contrats)
+    where_clauses, params = reservation_filters(request.args, nom_col="client_nom", voiture_col="voiture_nom")
+    month_filter(request.args, where_clauses, params)
+    return export_response("contrats", "contrats", CONTRAT_EXPORT_COLUMNS, where_clauses, params)
 
 
 @app.route("/admin/contrats/new", methods=["GET", "POST"])
@@ -899,10 +4481,10 @@ def admin_contrat_new():
     if not require_admin():
         return redirect(url_for("login"))
 
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
 
-    cur.execute("SELECT nom, categorie, prix_jour, immatriculation FROM voitures ORDER BY nom")
+    cur.execute("SELECT id, nom, categorie, prix_jour, immatriculation FROM voitures ORDER BY nom")
     voitures = cur.fetchall()
 
     if request.method == "POST":
@@ -916,15 +4498,18 @@ def admin_contrat_new():
         client2_permis = request.form.get("client2_permis")
         client2_annee_permis = request.form.get("client2_annee_permis")
 
-        voiture_nom = request.form.get("voiture_nom")
+        voiture_id = request.form.get("voiture_id", type=int)
         date_debut = request.form.get("date_debut")
         date_fin = request.form.get("date_fin")
 
         cur.execute(
-            "SELECT categorie, prix_jour, immatriculation FROM voitures WHERE nom=? LIMIT 1",
-            (voiture_nom,)
+            "SELECT nom, categorie, prix_jour, immatriculation FROM voitures WHERE id=?",
+            (voiture_id,)
         )
         v = cur.fetchone()
+        if not v:
+            return render_template("admin_contrat_new.html", voitures=voitures)
+        voiture_nom = v["nom"]
 
         jours = 1
         try:
@@ -939,30 +4524,404 @@ def admin_contrat_new():
         prix_jour = v["prix_jour"] if v else None
         total = prix_jour * jours if prix_jour else None
 
-        cur.execute("""
-            INSERT INTO contrats
-            (demande_id, client_nom, client_cin, client_permis, annee_permis,
-             client2_nom, client2_cin, client2_permis, client2_annee_permis,
-             voiture_nom, categorie, immatriculation,
-             date_debut, date_fin, jours, prix_jour, total)
-            VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-        """, (
-            client_nom, client_cin, client_permis, annee_permis,
-            client2_nom, client2_cin, client2_permis, client2_annee_permis,
-            voiture_nom,
-            v["categorie"] if v else None,
-            v["immatriculation"] if v else None,
-            date_debut, date_fin, jours, prix_jour, total
-        ))
+        def write(wconn):
+            wcur = wconn.execute("""
+                INSERT INTO contrats
+                (demande_id, client_nom, client_cin, client_permis, annee_permis,
+                 client2_nom, client2_cin, client2_permis, client2_annee_permis,
+                 voiture_id, voiture_nom, categorie, immatriculation,
+                 date_debut, date_fin, jours, prix_jour, total)
+                VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """, (
+                client_nom, client_cin, client_permis, annee_permis,
+                client2_nom, client2_cin, client2_permis, client2_annee_permis,
+                voiture_id, voiture_nom,
+                v["categorie"] if v else None,
+                v["immatriculation"] if v else None,
+                date_debut, date_fin, jours, prix_jour, total
+            ))
+            analytics_add_contrat(wconn, wcur.lastrowid)
+            return wcur.lastrowid
 
-        conn.commit()
-        conn.close()
+        contrat_id = run_write(write)
+
+        availability_index.add(("contrat", contrat_id), voiture_id, date_debut, date_fin)
+        catalog_cache.invalidate()
         return redirect(url_for("admin_contrats"))
 
-    conn.close()
     return render_template("admin_contrat_new.html", voitures=voitures)
 
 
+# =========================
+# Async public path (ASGI)
+# =========================
+# asgi.py كيخدم هاد asgi_app (uvicorn). الroutes العامة اللي كتجيها الضغط (promo):
+#   POST /demande, POST /contact : validation + rendu فـ event loop، lectures فـ DB_THREADS،
+#                                  والكتابة كتتسنى الwriter بلا ما تشد حتى thread
+#   GET / و /nos-voitures         : page cache ديريكت من event loop، إلا ماكانش → sync
+# كلشي آخر = Flask WSGI العادي فـ pool محدود (ASGI_THREADS).
+class _BoundedPool(ForkAwarePool):
+    """ForkAwarePool awaited from the event loop + an in-flight counter."""
+
+    def __init__(self, name, threads):
+        super().__init__(threads, name)
+        self.inflight = 0
+
+    async def run(self, fn, *args, copy_context=False):
+        """Await fn(*args) on the pool; copy_context=True keeps the caller's request stats."""
+        loop = asyncio.get_running_loop()
+        if copy_context:
+            fn, args = contextvars.copy_context().run, (fn, *args)
+        self.inflight += 1
+        try:
+            return await loop.run_in_executor(self.executor(), fn, *args)
+        finally:
+            self.inflight -= 1
+
+
+class AsyncDb:
+    """
+    SQLite for the async views: reads on a bounded pool (each call gets a
+    pooled connection inside its own app context), writes handed to the
+    single writer and awaited without holding a thread.
+    """
+
+    def __init__(self, threads):
+        self.pool = _BoundedPool("async-db", threads)
+
+    @staticmethod
+    def _read(fn, args):
+        with app.app_context():
+            return fn(get_db(), *args)
+
+    async def read(self, fn, *args):
+        """await fn(conn, *args) on the DB pool."""
+        return await self.pool.run(self._read, fn, args, copy_context=True)
+
+    async def write(self, job, *args):
+        """await job(conn, *args) as one committed write transaction (like run_write)."""
+        if not DB_WRITE_QUEUE:
+            # بلا writer: الكتابة (و lock wait ديالها) كتاخد thread من الpool
+            return await self.read(lambda conn: run_write(job, *args))
+        stats = getattr(_local, "request", None)
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(db_writer.submit(job, *args))
+        finally:
+            if stats is not None:
+                stats.write_s += time.perf_counter() - t0
+
+
+async_db = AsyncDb(DB_THREADS)
+asgi_pool = _BoundedPool("asgi", ASGI_THREADS)
+ASYNC_ROUTES = {}
+
+
+def async_route(rule, method="GET"):
+    """
+    Register an async twin of a Flask route for ASGI mode. It runs inside the
+    request context on the event loop; returning None hands the request to
+    the regular (sync) Flask view.
+    """
+    def deco(fn):
+        ASYNC_ROUTES[(method, rule)] = fn
+        return fn
+    return deco
+
+
+@async_route("/demande", "POST")
+async def demande_post_async():
+    form, errors = demande_form(request.form)
+    if errors:
+        return render_template("demande.html", car=form["voiture"], errors=errors, form=form)
+
+    outcome, info = submission_guard.begin("demande", form, client_ip())
+    if outcome == "limited":
+        return rate_limited("demande.html", info, car=form["voiture"], form=form)
+    if outcome != "new":
+        return render_template("demande_confirm.html", form=info)
+
+    try:
+        v, errors = await async_db.read(demande_check, form)
+        if not errors:
+            await async_db.write(_insert_demande, form, v["id"])
+    except Exception:
+        submission_guard.abort("demande", form)
+        raise
+    if errors:
+        submission_guard.abort("demande", form)
+        return render_template("demande.html", car=form["voiture"], errors=errors, form=form)
+
+    submission_guard.done("demande", form)
+    return render_template("demande_confirm.html", form=form)
+
+
+@async_route("/contact", "POST")
+async def contact_post_async():
+    form, errors = contact_form(request.form)
+    sent = False
+    if not errors:
+        outcome, info = submission_guard.begin("contact", form, client_ip())
+        if outcome == "limited":
+            return rate_limited("contact.html", info, form=form, sent=False)
+        if outcome == "new":
+            try:
+                await async_db.write(_insert_contact, form)
+            except Exception:
+                submission_guard.abort("contact", form)
+                raise
+            submission_guard.done("contact", form)
+        sent = True
+        form = {"nom": "", "email": "", "message": ""}
+    return render_template("contact.html", errors=errors, form=form, sent=sent)
+
+
+@async_route("/")
+@async_route("/nos-voitures")
+async def cached_page_async():
+    """Page cache hit straight from the loop; a miss is rendered by the sync view."""
+    if not PAGE_CACHE_MAX_BYTES:
+        return None
+    snapshot = catalog_cache.peek()
+    entry = page_cache.peek(_page_key(), snapshot) if snapshot is not None else None
+    return _page_response(entry, "HIT") if entry is not None else None
+
+
+def _asgi_environ(scope, body):
+    """WSGI environ of an ASGI http scope whose body has been read."""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", ()):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = "HTTP_" + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _asgi_headers(headers):
+    return [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+
+async def _run_async_view(view, environ):
+    """Flask response of an async route, or None to fall back to the sync app."""
+    with app.request_context(environ):
+        start_request_stats()
+        try:
+            if CACHE_EPOCH_CHECK:
+                await async_db.read(shared_epoch.sync)
+            rv = await view()
+            if rv is None:
+                _local.request = None  # the sync view records this request
+                return None
+            resp = app.make_response(rv)
+        except Exception as e:
+            try:
+                resp = app.make_response(app.handle_user_exception(e))
+            except Exception as e2:
+                resp = app.make_response(app.handle_exception(e2))
+        return app.process_response(resp)
+
+
+async def _run_wsgi(environ, send):
+    """The regular Flask app on asgi_pool: a slow view ties up one pool thread, not the loop."""
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+
+    result = await asgi_pool.run(app, environ, start_response)
+    chunks = iter(result)
+    try:
+        chunk = await asgi_pool.run(next, chunks, None)
+        status, headers = started
+        await send({"type": "http.response.start", "status": status, "headers": _asgi_headers(headers)})
+        while chunk is not None:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await asgi_pool.run(next, chunks, None)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            await asgi_pool.run(result.close)
+
+
+async def _read_body(scope, receive):
+    """
+    The whole request body (None on disconnect). Past MAX_CONTENT_LENGTH it
+    raises RequestEntityTooLarge, from Content-Length or while buffering.
+    """
+    limit = app.config["MAX_CONTENT_LENGTH"]
+    if limit is not None:
+        for name, value in scope.get("headers", ()):
+            if name.lower() == b"content-length" and value.isdigit() and int(value) > limit:
+                raise RequestEntityTooLarge()
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise RequestEntityTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _asgi_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point (see asgi.py)."""
+    if scope["type"] == "lifespan":
+        return await _asgi_lifespan(receive, send)
+    if scope["type"] != "http":
+        return None
+
+    try:
+        body = await _read_body(scope, receive)
+    except RequestEntityTooLarge as e:
+        resp = e.get_response()
+        await send({"type": "http.response.start", "status": resp.status_code,
+                    "headers": _asgi_headers(resp.headers.to_wsgi_list())})
+        await send({"type": "http.response.body", "body": resp.get_data()})
+        return None
+    if body is None:
+        return None  # client gone before the request was complete
+    environ = _asgi_environ(scope, body)
+
+    view = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+    resp = await _run_async_view(view, environ) if view is not None else None
+    if resp is None:
+        return await _run_wsgi(environ, send)
+
+    await send({"type": "http.response.start", "status": resp.status_code,
+                "headers": _asgi_headers(resp.headers.to_wsgi_list())})
+    await send({"type": "http.response.body", "body": resp.get_data()})
+
+
+# =========================
+# App factory / deployment
+# =========================
+class SharedEpoch:
+    """
+    Cross-worker invalidation of the per-process caches. Triggers bump one
+    epoch per cache (cache_epochs: bookings, voitures, images) on every write
+    it depends on; with CACHE_EPOCH_CHECK=1 each request compares them with
+    the last values this process saw and drops only the caches that moved.
+    The bumps of this process's own writes are skipped (own_write): the
+    write paths already updated or invalidated the local caches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seen = {}
+        self.syncs = 0
+
+    @staticmethod
+    def read(conn):
+        return dict(conn.execute("SELECT name, n FROM cache_epochs").fetchall())
+
+    def sync(self, conn):
+        epochs = self.read(conn)
+        with self._lock:
+            moved = [name for name, n in epochs.items() if name in self.seen and n > self.seen[name]]
+            for name, n in epochs.items():
+                self.seen[name] = max(n, self.seen.get(name, n))
+        for name in moved:
+            self.syncs += 1
+            self._invalidate(name)
+
+    def own_write(self, before, after):
+        """before/after: the epochs read at both ends of one committed write of this process."""
+        with self._lock:
+            for name, n in after.items():
+                # bump ديال worker آخر مازال ما تشافش: نخليوه لsync
+                if self.seen.get(name) == before.get(name):
+                    self.seen[name] = n
+
+    @staticmethod
+    def _invalidate(name):
+        if name == "bookings":
+            availability_index.invalidate()
+        elif name == "voitures":
+            catalog_cache.invalidate()
+        elif name == "images":
+            image_variants.invalidate()
+            catalog_cache.invalidate()
+
+
+shared_epoch = SharedEpoch()
+
+
+@app.before_request
+def sync_shared_caches():
+    if CACHE_EPOCH_CHECK and request.endpoint != "static":
+        shared_epoch.sync(get_db())
+
+
+def _after_fork_in_child():
+    db_pool.reset_after_fork()
+    shared_epoch.seen = {}
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+_initialized = False
+
+
+def create_app(background=False):
+    """
+    App factory for WSGI / ASGI servers (see wsgi.py / asgi.py / gunicorn.conf.py).
+
+    Schema migrations run once, in the process that calls it (the gunicorn
+    master with preload_app). Per-process state (connection pool, writer
+    thread) is rebuilt lazily in each forked worker. The background threads
+    only start with background=True, or from the gunicorn post_fork hook:
+    a plain import (CLI commands, scripts) never starts them.
+    """
+    global _initialized
+    if not _initialized:
+        init_db()
+        _initialized = True
+    if background:
+        start_background_jobs()
+    return app
+
+
+if APP_AUTOINIT:
+    # create tables once (no background threads: see create_app)
+    create_app()
+
+
 if __name__ == "__main__":
-    init_db()
-    app.run(debug=True)
+    create_app(background=True).run(debug=True)
@@ -0,0 +1,30 @@
+"""
+ASGI entry point (async serving mode for the public endpoints):
+
+    uvicorn asgi:app --workers N
+
+POST /demande, POST /contact and the cached catalog pages are served from
+the event loop (SQLite reads on a bounded pool of DB_THREADS threads, writes
+awaited on the single writer); every other route runs the regular Flask app
+on a bounded pool of ASGI_THREADS threads. See the "Async public path"
+section of app.py.
+
+Env: WEB_CONCURRENCY (worker processes, only used to turn on the shared
+cache epoch check), ASGI_THREADS, DB_THREADS. Behind a reverse proxy set
+PROXY_HOPS (see gunicorn.conf.py): the form rate limits are keyed on the
+client address and kept per worker.
+"""
+import os
+
+os.environ.setdefault("APP_AUTOINIT", "0")
+
+# several workers = several copies of the in-memory caches
+if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+    os.environ.setdefault("CACHE_EPOCH_CHECK", "1")
+
+from app import asgi_app, create_app  # noqa: E402
+
+# uvicorn imports this module in each worker: migrations are idempotent and
+# the background jobs are per process, like gunicorn's post_fork hook
+create_app(background=True)
+app = asgi_app
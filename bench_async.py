@@ -0,0 +1,275 @@
+"""
+Load test of the public endpoints: gunicorn (sync, gthread) vs uvicorn (asgi.py).
+
+    python bench_async.py [--users 200] [--duration 20] [--workers 2] [--threads 4]
+                          [--lock-ms 0] [--mode both|sync|async] [--template /tmp/fleet.db]
+
+Both servers run on a copy of the same synthetic fleet (seed_fleet.py) with
+the same number of worker processes. A raw HTTP/1.1 keep-alive client opens
+--users connections (a promo burst) and drives this mix for --duration
+seconds:
+
+    GET  /nos-voitures   40%
+    GET  /               20%
+    POST /demande        30%
+    POST /contact        10%
+
+--lock-ms N starts a process that holds the SQLite write lock for N ms every
+second (a long admin import, a backup), the case where the sync workers all
+end up parked in lock waits. Reports p50/p95/p99, errors (5xx, timeouts,
+resets) and throughput per mode.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+from bench_suite import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MIX = [
+    ("GET /nos-voitures", 40),
+    ("GET /", 20),
+    ("POST /demande", 30),
+    ("POST /contact", 10),
+]
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="AutoRent sync vs async load test")
+    p.add_argument("--users", type=int, default=200, help="concurrent keep-alive connections")
+    p.add_argument("--duration", type=float, default=20)
+    p.add_argument("--warmup", type=float, default=3)
+    p.add_argument("--workers", type=int, default=2, help="worker processes of each server")
+    p.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker (sync mode)")
+    p.add_argument("--lock-ms", type=int, default=0, help="hold the write lock N ms per second")
+    p.add_argument("--timeout", type=float, default=30, help="client timeout per request (s)")
+    p.add_argument("--mode", choices=("both", "sync", "async"), default="both")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--cars", type=int, default=300)
+    p.add_argument("--template", help="generated fleet to reuse (default: generated in the temp dir)")
+    return p.parse_args(argv)
+
+
+def ensure_template(args):
+    path = args.template or os.path.join(tempfile.gettempdir(), f"autorent_load_{args.cars}_{args.seed}.db")
+    if not os.path.exists(path):
+        print(f"generating {path} ...", flush=True)
+        subprocess.run(
+            [sys.executable, os.path.join(HERE, "seed_fleet.py"), path, "--cars", str(args.cars),
+             "--contrats", str(args.cars * 20), "--demandes", str(args.cars * 25),
+             "--clients", str(args.cars * 10), "--seed", str(args.seed)],
+            check=True,
+        )
+    return path
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, args, db, port):
+    env = dict(
+        os.environ,
+        DB_PATH=db,
+        WEB_CONCURRENCY=str(args.workers),
+        STATUS_REFRESH_INTERVAL="0",
+        STATS_RECONCILE_INTERVAL="0",
+        SLOW_REQUEST_MS=str(10**9),
+        # all the users share 127.0.0.1: measure the serving path, not the per-IP limit
+        RATE_IP_BURST=os.environ.get("RATE_IP_BURST", "0"),
+    )
+    if mode == "sync":
+        env.update(WEB_BIND=f"127.0.0.1:{port}", WEB_THREADS=str(args.threads), WEB_MAX_REQUESTS="0",
+                   WEB_TIMEOUT="120")
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--no-access-log", "--log-level", "warning"]
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, start_new_session=True)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"{mode} server exited with {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    stop(proc)
+    raise SystemExit(f"{mode} server did not start")
+
+
+def stop(proc):
+    if proc.poll() is None:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+
+
+def lock_holder(db, hold_ms):
+    """Child process: take the write lock for hold_ms every second until killed."""
+    conn = sqlite3.connect(db, timeout=60, isolation_level=None)
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        time.sleep(hold_ms / 1000)
+        conn.execute("COMMIT")
+        time.sleep(max(0.0, 1 - hold_ms / 1000))
+
+
+def request_bytes(kind, rnd, cars):
+    if kind.startswith("GET "):
+        path, body = kind[4:], b""
+    elif kind == "POST /demande":
+        vid, nom = rnd.choice(cars)
+        d1 = date.today() + timedelta(days=rnd.randint(1, 120))
+        path, body = "/demande", urlencode({
+            "nom": "Load Client", "tel": f"06{rnd.randint(0, 10**8 - 1):08d}", "ville": "Rabat",
+            "date_debut": d1.isoformat(), "date_fin": (d1 + timedelta(days=rnd.randint(1, 7))).isoformat(),
+            "voiture": nom, "voiture_id": str(vid),
+        }).encode()
+    else:
+        path, body = "/contact", urlencode({"nom": "Load", "email": "load@example.com", "message": "Promo ?"}).encode()
+    method = kind.split(" ", 1)[0]
+    head = f"{method} {path} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip\r\n"
+    if body:
+        head += f"Content-Type: application/x-www-form-urlencoded\r\nContent-Length: {len(body)}\r\n"
+    return (head + "\r\n").encode() + body
+
+
+async def read_response(reader):
+    """Status of one HTTP/1.1 response (Content-Length or chunked body consumed)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("closed")
+    status = int(status_line.split()[1])
+    length, chunked = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        if name == "content-length":
+            length = int(value)
+        elif name == "transfer-encoding" and "chunked" in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def user(port, cars, seed, until, warm_until, timeout, results):
+    rnd = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    reader = writer = None
+    while time.perf_counter() < until:
+        kind = rnd.choices(kinds, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+            writer.write(request_bytes(kind, rnd, cars))
+            status = await asyncio.wait_for(read_response(reader), timeout)
+            ok = status < 500
+        except (OSError, asyncio.TimeoutError, ConnectionError, ValueError, asyncio.IncompleteReadError):
+            ok = False
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+        if t0 >= warm_until:
+            entry = results.setdefault(kind, {"ms": [], "errors": 0})
+            entry["ms"].append((time.perf_counter() - t0) * 1000)
+            entry["errors"] += not ok
+    if writer is not None:
+        writer.close()
+
+
+async def drive(port, cars, args):
+    results = {}
+    start = time.perf_counter()
+    warm_until = start + args.warmup
+    until = warm_until + args.duration
+    await asyncio.gather(*(
+        user(port, cars, args.seed + i, until, warm_until, args.timeout, results) for i in range(args.users)
+    ))
+    return results
+
+
+def run_mode(mode, args, template):
+    work_dir = tempfile.mkdtemp()
+    db = os.path.join(work_dir, "load.db")
+    # backup API: the template may still have pages in its -wal file
+    src = sqlite3.connect(template)
+    conn = sqlite3.connect(db)
+    src.backup(conn)
+    src.close()
+    cars = conn.execute("SELECT id, nom FROM voitures").fetchall()
+    conn.close()
+
+    port = free_port()
+    proc = start_server(mode, args, db, port)
+    holder = None
+    if args.lock_ms:
+        holder = subprocess.Popen([sys.executable, __file__, "--hold-lock", db, str(args.lock_ms)], cwd=HERE)
+    try:
+        results = asyncio.run(drive(port, cars, args))
+    finally:
+        if holder is not None:
+            holder.kill()
+            holder.wait()
+        stop(proc)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def report(mode, results, duration):
+    total = sum(len(r["ms"]) for r in results.values())
+    errors = sum(r["errors"] for r in results.values())
+    print(f"\n{mode}: {total / duration:.1f} req/s, {errors} errors")
+    print(f"  {'endpoint':<20} {'n':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, _ in MIX:
+        r = results.get(kind)
+        if r:
+            print(f"  {kind:<20} {len(r['ms']):>7} {r['errors']:>5} {percentile(r['ms'], 50):9.1f} "
+                  f"{percentile(r['ms'], 95):9.1f} {percentile(r['ms'], 99):9.1f}")
+
+
+def main(argv=None):
+    argv = argv if argv is not None else sys.argv[1:]
+    if argv[:1] == ["--hold-lock"]:
+        return lock_holder(argv[1], int(argv[2]))
+
+    args = parse_args(argv)
+    template = ensure_template(args)
+    print(f"{args.users} users, {args.duration:.0f}s, {args.workers} workers"
+          f" (sync: {args.threads} threads each), lock {args.lock_ms} ms/s")
+    modes = ("sync", "async") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        report(mode, run_mode(mode, args, template), args.duration)
+
+
+if __name__ == "__main__":
+    main()
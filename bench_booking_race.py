@@ -0,0 +1,171 @@
+"""
+Stress test: many admins confirming overlapping demandes at the same time.
+
+    python bench_booking_race.py [processes] [threads] [demandes_per_car]
+
+Seeds a throwaway DB with a few cars and lots of pending demandes whose dates
+overlap, then lets every thread of every process hit
+/admin/reservations/<id>/statut/Confirmée in random order. Each mode runs
+with and without the single writer queue (DB_WRITE_QUEUE=1 / 0).
+
+A booking is safe when, per car, no two confirmed demandes (nor two active
+contrats) overlap and every confirmed demande has exactly one contrat. The
+script exits with status 1 if any invariant is broken.
+"""
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+N_CARS = 4
+
+MODES = {
+    "queue": {"DB_WRITE_QUEUE": "1"},
+    "direct": {"DB_WRITE_QUEUE": "0"},
+}
+
+OVERLAPS_SQL = """
+    SELECT COUNT(*)
+    FROM {table} a
+    JOIN {table} b
+      ON a.voiture_id = b.voiture_id
+     AND a.id < b.id
+     AND a.date_debut <= b.date_fin
+     AND b.date_debut <= a.date_fin
+    WHERE a.statut = '{statut}' AND b.statut = '{statut}'
+"""
+
+
+def seed(db_path, per_car):
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    rnd = random.Random(7)
+    start = date.today() + timedelta(days=30)
+    cur.executemany(
+        "INSERT INTO voitures(nom,categorie,prix_jour,immatriculation,statut) VALUES(?,?,?,?,?)",
+        [(f"race{i}", "Citadine", 300, f"{i}-R-1", "Disponible") for i in range(N_CARS)],
+    )
+    rows = []
+    for i in range(N_CARS):
+        for _ in range(per_car):
+            d1 = start + timedelta(days=rnd.randint(0, 40))
+            d2 = d1 + timedelta(days=rnd.randint(1, 6))
+            rows.append((f"client{len(rows)}", i + 1, f"race{i}", d1.isoformat(), d2.isoformat()))
+    cur.executemany(
+        "INSERT INTO demandes(nom,voiture_id,voiture,date_debut,date_fin,statut) VALUES(?,?,?,?,?,'En attente')",
+        rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_child(threads, seed_value):
+    """Child process: confirm every demande, in a random order, from `threads` threads."""
+    import app as app_module
+
+    conn = sqlite3.connect(app_module.DB_PATH)
+    ids = [r[0] for r in conn.execute("SELECT id FROM demandes")]
+    conn.close()
+    random.Random(seed_value).shuffle(ids)
+
+    codes, lock = Counter(), threading.Lock()
+
+    def worker(chunk):
+        client = app_module.app.test_client()
+        with client.session_transaction() as s:
+            s["admin_ok"] = True
+        local = Counter()
+        for rid in chunk:
+            r = client.get(f"/admin/reservations/{rid}/statut/Confirmée")
+            local[r.status_code] += 1
+        with lock:
+            codes.update(local)
+
+    pool = [threading.Thread(target=worker, args=(ids[i::threads],)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    print(json.dumps({str(k): v for k, v in codes.items()}))
+
+
+def check(db_path):
+    conn = sqlite3.connect(db_path)
+    report = {
+        "confirmées": conn.execute("SELECT COUNT(*) FROM demandes WHERE statut='Confirmée'").fetchone()[0],
+        "contrats": conn.execute("SELECT COUNT(*) FROM contrats").fetchone()[0],
+        "demandes qui se chevauchent": conn.execute(
+            OVERLAPS_SQL.format(table="demandes", statut="Confirmée")).fetchone()[0],
+        "contrats qui se chevauchent": conn.execute(
+            OVERLAPS_SQL.format(table="contrats", statut="Actif")).fetchone()[0],
+        "confirmées sans contrat unique": conn.execute("""
+            SELECT COUNT(*) FROM demandes d
+            WHERE d.statut='Confirmée'
+              AND (SELECT COUNT(*) FROM contrats c WHERE c.demande_id = d.id) != 1
+        """).fetchone()[0],
+    }
+    conn.close()
+    return report
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    per_car = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+
+    broken = False
+    for mode, settings in MODES.items():
+        env = dict(os.environ, **settings)
+        env["DB_PATH"] = os.path.join(tempfile.mkdtemp(), f"race_{mode}.db")
+        env["STATUS_REFRESH_INTERVAL"] = "0"
+
+        # init_db + seed une seule fois, avant de lancer les processus
+        subprocess.run([sys.executable, "-c", "import app"], env=env, check=True)
+        seed(env["DB_PATH"], per_car)
+
+        t0 = time.perf_counter()
+        children = [
+            subprocess.Popen(
+                [sys.executable, __file__, "--child", str(threads), str(i)],
+                env=env, stdout=subprocess.PIPE, text=True,
+            )
+            for i in range(processes)
+        ]
+        codes = Counter()
+        for p in children:
+            out, _ = p.communicate()
+            if p.returncode:
+                raise SystemExit(f"child exited with {p.returncode}")
+            codes.update(json.loads(out.strip().splitlines()[-1]))
+        elapsed = time.perf_counter() - t0
+
+        report = check(env["DB_PATH"])
+        bad = report["demandes qui se chevauchent"] or report["contrats qui se chevauchent"] \
+            or report["confirmées sans contrat unique"] or codes.get("500")
+        broken = broken or bool(bad)
+
+        print(f"[{mode}] {processes} processes x {threads} threads, "
+              f"{N_CARS * per_car} demandes, {elapsed:.1f}s")
+        print(f"  HTTP: {dict(sorted(codes.items()))}")
+        for k, v in report.items():
+            print(f"  {k:<32} {v}")
+        print("  OK" if not bad else "  BROKEN")
+
+    if broken:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        if "DB_PATH" not in os.environ:
+            raise SystemExit("--child runs on the temp DB_PATH set by main()")
+        run_child(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,104 @@
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+N_CARS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+BOOKINGS_PER_CAR = 5
+
+# قاعدة بيانات مؤقتة باش مانقيسوش data.db
+tmp_dir = tempfile.mkdtemp()
+os.environ["DB_PATH"] = os.path.join(tmp_dir, "bench.db")
+os.environ["STATUS_REFRESH_INTERVAL"] = "0"
+
+import app  # noqa: E402  (init_db كيتخلق فـ DB_PATH)
+
+
+def seed():
+    conn = sqlite3.connect(app.DB_PATH)
+    cur = conn.cursor()
+    rnd = random.Random(42)
+    today = date.today()
+
+    cur.executemany(
+        "INSERT INTO voitures(nom,categorie,prix_jour,immatriculation,statut) VALUES(?,?,?,?,?)",
+        [(f"car{i}", "Citadine", 300, f"{i}-A-1", "Disponible") for i in range(N_CARS)],
+    )
+
+    contrats, demandes = [], []
+    for i in range(N_CARS):
+        for _ in range(BOOKINGS_PER_CAR):
+            d1 = today + timedelta(days=rnd.randint(-400, 60))
+            d2 = d1 + timedelta(days=rnd.randint(1, 10))
+            row = (i + 1, f"car{i}", d1.isoformat(), d2.isoformat())
+            (contrats if rnd.random() < 0.5 else demandes).append(row)
+
+    cur.executemany(
+        "INSERT INTO contrats(client_nom,voiture_id,voiture_nom,date_debut,date_fin,statut) VALUES('bench',?,?,?,?,'Actif')",
+        contrats,
+    )
+    cur.executemany(
+        "INSERT INTO demandes(nom,voiture_id,voiture,date_debut,date_fin,statut) VALUES('bench',?,?,?,?,'Confirmée')",
+        demandes,
+    )
+    conn.commit()
+    conn.close()
+
+
+def legacy_refresh():
+    """The per-car loop refresh_car_statuses used to run (3 queries per car)."""
+    conn = app.get_conn()
+    cur = conn.cursor()
+    today = date.today().strftime("%Y-%m-%d")
+
+    cur.execute("SELECT id, nom FROM voitures")
+    for v in cur.fetchall():
+        cur.execute("""
+            SELECT 1 FROM contrats
+            WHERE voiture_nom=? AND statut='Actif' AND date_debut <= ? AND date_fin >= ?
+            LIMIT 1
+        """, (v["nom"], today, today))
+        rented = cur.fetchone() is not None
+        if not rented:
+            cur.execute("""
+                SELECT 1 FROM demandes
+                WHERE voiture=? AND statut='Confirmée' AND date_debut <= ? AND date_fin >= ?
+                LIMIT 1
+            """, (v["nom"], today, today))
+            rented = cur.fetchone() is not None
+        cur.execute("UPDATE voitures SET statut=? WHERE id=?",
+                    ("Louée" if rented else "Disponible", v["id"]))
+    conn.commit()
+    conn.close()
+
+
+def timed(label, fn):
+    t0 = time.perf_counter()
+    with app.app.app_context():
+        res = fn()
+    ms = (time.perf_counter() - t0) * 1000
+    extra = f" ({res} rows written)" if isinstance(res, int) else ""
+    print(f"{label:<38} {ms:10.1f} ms{extra}")
+
+
+def reset_statuses():
+    conn = sqlite3.connect(app.DB_PATH)
+    conn.execute("UPDATE voitures SET statut='Disponible'")
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    seed()
+    print(f"{N_CARS} voitures, {N_CARS * BOOKINGS_PER_CAR} bookings")
+
+    reset_statuses()
+    timed("legacy per-car loop", legacy_refresh)
+    timed("legacy per-car loop (no change)", legacy_refresh)
+
+    reset_statuses()
+    timed("set-based refresh", app.refresh_car_statuses)
+    timed("set-based refresh (no change)", app.refresh_car_statuses)
@@ -0,0 +1,272 @@
+"""
+Reproducible benchmark: the main public and admin paths on a synthetic fleet.
+
+    python bench_suite.py [--requests 2000] [--threads 8] [--save-baseline] [--check]
+
+The fleet comes from seed_fleet.py (generated once into --template, then
+copied for every run so each run starts from the same data). The mix is
+driven through the Flask test client with a fixed seed:
+
+    GET  /                          home (popular cars)
+    GET  /nos-voitures              catalog
+    POST /demande                   booking request
+    GET  /admin/reservations        admin listing (first page / keyset pages / filters)
+    GET  /admin/reservations/<id>/statut/<st>   confirm or cancel a pending demande
+
+It prints throughput and p50/p95/p99 per endpoint and compares them with
+bench_baseline.json. --save-baseline stores the run as the new baseline;
+--check exits with status 1 when a p95 or the throughput regressed by more
+than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+
+MIX = [
+    ("GET /", 25),
+    ("GET /nos-voitures", 25),
+    ("POST /demande", 20),
+    ("GET /admin/reservations", 20),
+    ("statut change", 10),
+]
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="AutoRent benchmark suite")
+    p.add_argument("--requests", type=int, default=2000, help="measured requests (all threads)")
+    p.add_argument("--warmup", type=int, default=200)
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--cars", type=int, default=3000)
+    p.add_argument("--contrats", type=int, default=150000)
+    p.add_argument("--demandes", type=int, default=200000)
+    p.add_argument("--clients", type=int, default=100000)
+    p.add_argument("--template", help="generated fleet to reuse (default: in the temp dir, keyed by volumes)")
+    p.add_argument("--out", help="write the results as JSON")
+    p.add_argument("--baseline", default=BASELINE)
+    p.add_argument("--save-baseline", action="store_true")
+    p.add_argument("--check", action="store_true", help="exit 1 on regression")
+    p.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression (0.25 = 25%%)")
+    return p.parse_args(argv)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def ensure_template(args):
+    path = args.template or os.path.join(
+        tempfile.gettempdir(),
+        f"autorent_bench_{args.cars}_{args.contrats}_{args.demandes}_{args.clients}_{args.seed}.db",
+    )
+    if not os.path.exists(path):
+        print(f"generating {path} ...", flush=True)
+        subprocess.run(
+            [sys.executable, os.path.join(HERE, "seed_fleet.py"), path,
+             "--cars", str(args.cars), "--contrats", str(args.contrats),
+             "--demandes", str(args.demandes), "--clients", str(args.clients),
+             "--seed", str(args.seed)],
+            check=True,
+        )
+    return path
+
+
+class Workload:
+    """Shared state of the run: pending demandes to confirm, car names, admin cursors."""
+
+    def __init__(self, app_module, seed):
+        conn = app_module.get_conn()
+        self.cars = [(r["id"], r["nom"]) for r in conn.execute("SELECT id, nom FROM voitures")]
+        pending = [r[0] for r in conn.execute("SELECT id FROM demandes WHERE statut='En attente'")]
+        self.max_id = conn.execute("SELECT MAX(id) FROM demandes").fetchone()[0]
+        conn.close()
+        random.Random(seed).shuffle(pending)
+        self.pending = pending
+        self.lock = threading.Lock()
+
+    def next_pending(self):
+        with self.lock:
+            return self.pending.pop() if self.pending else None
+
+
+def one_request(client, work, rnd, kind):
+    """Run one request of `kind`; return its HTTP status."""
+    if kind == "GET /":
+        return client.get("/").status_code
+    if kind == "GET /nos-voitures":
+        return client.get("/nos-voitures").status_code
+    if kind == "POST /demande":
+        vid, nom = rnd.choice(work.cars)
+        d1 = date.today() + timedelta(days=rnd.randint(1, 120))
+        return client.post("/demande", data={
+            "nom": "Bench Client", "tel": f"06{rnd.randint(0, 10**8 - 1):08d}", "ville": "Rabat",
+            "date_debut": d1.isoformat(), "date_fin": (d1 + timedelta(days=rnd.randint(1, 7))).isoformat(),
+            "voiture": nom, "voiture_id": str(vid),
+        }).status_code
+    if kind == "GET /admin/reservations":
+        r = rnd.random()
+        if r < 0.5:
+            return client.get("/admin/reservations").status_code
+        if r < 0.8:
+            return client.get(f"/admin/reservations?before={rnd.randint(1, work.max_id)}").status_code
+        return client.get("/admin/reservations?statut=En+attente").status_code
+    if kind == "statut change":
+        rid = work.next_pending()
+        if rid is None:
+            return client.get("/admin/reservations").status_code
+        st = "Confirmée" if rnd.random() < 0.7 else "Annulée"
+        # 400 = car already taken on these dates: a normal answer
+        return client.get(f"/admin/reservations/{rid}/statut/{st}").status_code
+    raise ValueError(kind)
+
+
+def worker(app_module, work, n, seed, results, lock):
+    client = app_module.app.test_client()
+    with client.session_transaction() as s:
+        s["admin_ok"] = True
+    rnd = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    local = {}
+    for _ in range(n):
+        kind = rnd.choices(kinds, weights)[0]
+        t0 = time.perf_counter()
+        status = one_request(client, work, rnd, kind)
+        ms = (time.perf_counter() - t0) * 1000
+        entry = local.setdefault(kind, {"ms": [], "errors": 0})
+        entry["ms"].append(ms)
+        if status >= 500:
+            entry["errors"] += 1
+    with lock:
+        for kind, entry in local.items():
+            agg = results.setdefault(kind, {"ms": [], "errors": 0})
+            agg["ms"].extend(entry["ms"])
+            agg["errors"] += entry["errors"]
+
+
+def run(app_module, args):
+    work = Workload(app_module, args.seed)
+
+    # warmup (caches, index, pool) on a single thread
+    worker(app_module, work, args.warmup, args.seed + 1000, {}, threading.Lock())
+
+    results, lock = {}, threading.Lock()
+    per_thread = max(1, args.requests // args.threads)
+    threads = [
+        threading.Thread(target=worker, args=(app_module, work, per_thread, args.seed + i, results, lock))
+        for i in range(args.threads)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    report = {"endpoints": {}, "throughput": sum(len(r["ms"]) for r in results.values()) / elapsed}
+    for kind, _ in MIX:
+        r = results.get(kind)
+        if not r:
+            continue
+        report["endpoints"][kind] = {
+            "n": len(r["ms"]),
+            "errors": r["errors"],
+            "p50": round(percentile(r["ms"], 50), 3),
+            "p95": round(percentile(r["ms"], 95), 3),
+            "p99": round(percentile(r["ms"], 99), 3),
+        }
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Print the deltas against the baseline; return the list of regressions."""
+    regressions = []
+    base_eps = baseline.get("endpoints", {})
+    print(f"\nvs baseline ({baseline.get('created', '?')}, {baseline.get('machine', '?')})")
+    for kind, r in report["endpoints"].items():
+        b = base_eps.get(kind)
+        if not b:
+            continue
+        delta = (r["p95"] - b["p95"]) / b["p95"] if b["p95"] else 0.0
+        flag = "  REGRESSION" if delta > tolerance else ""
+        print(f"  {kind:<26} p95 {b['p95']:8.2f} -> {r['p95']:8.2f} ms ({delta:+.0%}){flag}")
+        if flag:
+            regressions.append(f"{kind} p95 {delta:+.0%}")
+    b_tp = baseline.get("throughput")
+    if b_tp:
+        delta = (report["throughput"] - b_tp) / b_tp
+        flag = "  REGRESSION" if delta < -tolerance else ""
+        print(f"  {'throughput':<26} {b_tp:8.1f} -> {report['throughput']:8.1f} req/s ({delta:+.0%}){flag}")
+        if flag:
+            regressions.append(f"throughput {delta:+.0%}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    template = ensure_template(args)
+
+    work_dir = tempfile.mkdtemp()
+    db = os.path.join(work_dir, "bench.db")
+    shutil.copy(template, db)
+
+    os.environ["DB_PATH"] = db
+    os.environ.setdefault("STATUS_REFRESH_INTERVAL", "0")
+    os.environ.setdefault("STATS_RECONCILE_INTERVAL", "0")
+    os.environ.setdefault("SLOW_REQUEST_MS", str(10**9))  # the report already has the latencies
+    # every request comes from one client: the per-IP limit would turn the mix into 429s
+    os.environ.setdefault("RATE_IP_BURST", "0")
+    import app as app_module  # noqa: E402
+    # the in-process "server": job workers like a gunicorn worker gets from post_fork
+    app_module.start_background_jobs()
+
+    report = run(app_module, args)
+    report.update({
+        "created": date.today().isoformat(),
+        "machine": f"{platform.machine()} {platform.system()} py{platform.python_version()}",
+        "params": {k: getattr(args, k) for k in ("requests", "threads", "seed", "cars", "contrats", "demandes", "clients")},
+    })
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{args.threads} threads, {args.requests} requests, "
+          f"{args.cars} voitures / {args.demandes} demandes / {args.contrats} contrats")
+    print(f"{'endpoint':<26} {'n':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, r in report["endpoints"].items():
+        print(f"{kind:<26} {r['n']:>6} {r['errors']:>4} {r['p50']:9.2f} {r['p95']:9.2f} {r['p99']:9.2f}")
+    print(f"throughput {report['throughput']:.1f} req/s")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+
+    if args.check and regressions:
+        raise SystemExit("regressions: " + ", ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
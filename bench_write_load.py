@@ -0,0 +1,165 @@
+"""
+Load test: concurrent /demande + /contact inserts against catalog GETs.
+
+    python bench_write_load.py [threads] [requests_per_thread]
+
+Runs the same workload twice on a throwaway DB, once with the old storage
+settings (rollback journal, synchronous=FULL, writes on the request
+connection) and once with WAL + tuned pragmas + the single writer queue,
+then prints p50/p95/p99 latency per endpoint.
+"""
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+MODES = {
+    "before": {
+        "DB_JOURNAL_MODE": "DELETE",
+        "DB_SYNCHRONOUS": "FULL",
+        "DB_MMAP_SIZE": "0",
+        "DB_CACHE_SIZE": "-2000",
+        "DB_WRITE_QUEUE": "0",
+    },
+    "after": {
+        "DB_JOURNAL_MODE": "WAL",
+        "DB_SYNCHRONOUS": "NORMAL",
+        "DB_WRITE_QUEUE": "1",
+    },
+}
+
+N_CARS = 300
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def seed(db_path):
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    today = date.today()
+    rnd = random.Random(1)
+    cur.executemany(
+        "INSERT INTO voitures(nom,categorie,prix_jour,immatriculation,statut) VALUES(?,?,?,?,?)",
+        [(f"car{i}", "Citadine", 300, f"{i}-A-1", "Disponible") for i in range(N_CARS)],
+    )
+    rows = []
+    for i in range(N_CARS):
+        for _ in range(5):
+            d1 = today + timedelta(days=rnd.randint(-300, 30))
+            rows.append((i + 1, f"car{i}", d1.isoformat(), (d1 + timedelta(days=3)).isoformat()))
+    cur.executemany(
+        "INSERT INTO contrats(client_nom,voiture_id,voiture_nom,date_debut,date_fin,statut) VALUES('bench',?,?,?,?,'Actif')",
+        rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def worker(app_module, n, seed_value, latencies, lock):
+    client = app_module.app.test_client()
+    rnd = random.Random(seed_value)
+    local = {}
+    for i in range(n):
+        kind = rnd.random()
+        if kind < 0.4:
+            name = "GET /nos-voitures"
+            t0 = time.perf_counter()
+            client.get("/nos-voitures")
+        elif kind < 0.8:
+            name = "POST /demande"
+            d1 = date.today() + timedelta(days=rnd.randint(400, 4000))
+            t0 = time.perf_counter()
+            client.post("/demande", data={
+                "nom": "Load", "tel": f"06{rnd.randint(0, 10**8):08d}", "ville": "Rabat",
+                "date_debut": d1.isoformat(), "date_fin": (d1 + timedelta(days=2)).isoformat(),
+                "voiture": f"car{rnd.randrange(N_CARS)}",
+            })
+        else:
+            name = "POST /contact"
+            t0 = time.perf_counter()
+            client.post("/contact", data={"nom": "Load", "email": "a@b.c", "message": "x" * 200})
+        local.setdefault(name, []).append((time.perf_counter() - t0) * 1000)
+
+    with lock:
+        for k, v in local.items():
+            latencies.setdefault(k, []).extend(v)
+
+
+def run_mode(threads, per_thread):
+    """Child process: env already holds the storage settings for this mode."""
+    import app as app_module
+
+    seed(app_module.DB_PATH)
+    app_module.availability_index.invalidate()
+
+    latencies, lock = {}, threading.Lock()
+    t0 = time.perf_counter()
+    pool = [
+        threading.Thread(target=worker, args=(app_module, per_thread, i, latencies, lock))
+        for i in range(threads)
+    ]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies["ALL"] = [x for k, v in list(latencies.items()) for x in v]
+    report = {
+        name: {
+            "n": len(v),
+            "p50": percentile(v, 50),
+            "p95": percentile(v, 95),
+            "p99": percentile(v, 99),
+        }
+        for name, v in latencies.items()
+    }
+    report["_throughput"] = len(latencies["ALL"]) / elapsed
+    print(json.dumps(report))
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    results = {}
+    for mode, settings in MODES.items():
+        env = dict(os.environ, **settings)
+        env["DB_PATH"] = os.path.join(tempfile.mkdtemp(), f"load_{mode}.db")
+        env["STATUS_REFRESH_INTERVAL"] = "0"
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", str(threads), str(per_thread)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+
+    print(f"{threads} threads x {per_thread} requests")
+    print(f"{'endpoint':<20} {'mode':<7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    names = sorted(k for k in results["before"] if not k.startswith("_"))
+    for name in names:
+        for mode in MODES:
+            r = results[mode][name]
+            print(f"{name:<20} {mode:<7} {r['p50']:9.1f} {r['p95']:9.1f} {r['p99']:9.1f}")
+    for mode in MODES:
+        print(f"throughput {mode:<7} {results[mode]['_throughput']:9.1f} req/s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        if "DB_PATH" not in os.environ:
+            raise SystemExit("--child runs on the temp DB_PATH set by main()")
+        run_mode(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
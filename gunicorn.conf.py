@@ -0,0 +1,52 @@
+"""
+Gunicorn settings for production.
+
+    gunicorn -c gunicorn.conf.py
+
+Env:
+    WEB_BIND            address to listen on            (default 0.0.0.0:8000)
+    WEB_CONCURRENCY     worker processes                (default 2 x CPUs + 1)
+    WEB_THREADS         threads per worker (gthread)    (default 4)
+    WEB_TIMEOUT         seconds before a stuck worker is killed (default 30)
+    WEB_MAX_REQUESTS    recycle a worker after N requests (default 2000, 0 = never)
+    PROXY_HOPS          reverse proxies in front of gunicorn (nginx = 1). Set it
+                        behind a proxy: with the default 0 every visitor has the
+                        proxy's address and shares one rate-limit bucket
+    RATE_IP_* / RATE_TEL_*  form rate limits; the buckets live in each worker,
+                        so the site-wide limit is WEB_CONCURRENCY times these
+
+Reload:
+    kill -HUP <master>    graceful restart of the workers (new settings, same code)
+    kill -USR2 <master>   start a new master with the new code, then
+    kill -QUIT <old>      drain and stop the old one (zero downtime deploy)
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", "4"))
+worker_class = "gthread"
+timeout = int(os.environ.get("WEB_TIMEOUT", "30"))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", "2000"))
+max_requests_jitter = max_requests // 10
+
+# import + migrations once in the master, then fork
+wsgi_app = "wsgi:app"
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+
+# several workers = several copies of the in-memory caches
+if workers > 1:
+    os.environ.setdefault("CACHE_EPOCH_CHECK", "1")
+
+
+def post_fork(server, worker):
+    import app
+
+    # the master's threads (refresher, reconciler) do not exist in the worker
+    app.start_background_jobs()
@@ -1,15 +1,38 @@
+"""
+Adds a contrat Actif (today -> +2 days) on the last 3 cars of a database.
+
+    python seed_contrats.py /path/to/dev.db
+
+The target is migrated by app.init_db on import. The databases tracked at
+the repo root (data.db, ...) are refused, so seeding never rewrites them.
+"""
+import os
 import sqlite3
-from datetime import date, timedelta, datetime
+import sys
+from datetime import date, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
 
-DB_PATH = "data.db"
+def main(argv=None):
+    argv = argv if argv is not None else sys.argv[1:]
+    if len(argv) != 1:
+        raise SystemExit("usage: python seed_contrats.py /path/to/dev.db")
+    db = os.path.abspath(argv[0])
+    if os.path.dirname(db) == HERE and db.endswith(".db"):
+        raise SystemExit(f"refusing to write to the tracked {os.path.basename(db)}")
 
-def main():
-    conn = sqlite3.connect(DB_PATH)
+    os.environ["DB_PATH"] = db
+    os.environ.setdefault("STATUS_REFRESH_INTERVAL", "0")
+    os.environ.setdefault("STATS_RECONCILE_INTERVAL", "0")
+    import app  # noqa: E402  (init_db migrates DB_PATH)
+
+    conn = sqlite3.connect(db)
     conn.row_factory = sqlite3.Row
     cur = conn.cursor()
 
     # جيب شوية سيارات
-    cur.execute("SELECT id, nom FROM voitures ORDER BY id DESC LIMIT 3")
+    cur.execute("SELECT id, nom, categorie, prix_jour, immatriculation FROM voitures ORDER BY id DESC LIMIT 3")
     cars = cur.fetchall()
 
     if not cars:
@@ -19,20 +42,27 @@ def main():
     today = date.today()
     d1 = today.strftime("%Y-%m-%d")
     d2 = (today + timedelta(days=2)).strftime("%Y-%m-%d")
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    jours = 2
 
     for c in cars:
+        total = c["prix_jour"] * jours if c["prix_jour"] else None
         cur.execute("""
-            INSERT INTO contrats(voiture_id, client_nom, client_tel, date_debut, date_fin, statut, created_at)
-            VALUES(?,?,?,?,?,?,?)
+            INSERT INTO contrats(client_nom, voiture_id, voiture_nom, categorie, immatriculation,
+                                 date_debut, date_fin, jours, prix_jour, total, statut)
+            VALUES(?,?,?,?,?,?,?,?,?,?,?)
         """, (
-            c["id"],
             "Client Test",
-            "0600000000",
+            c["id"],
+            c["nom"],
+            c["categorie"],
+            c["immatriculation"],
             d1, d2,
-            "Actif",
-            now
+            jours,
+            c["prix_jour"],
+            total,
+            "Actif"
         ))
+        app.analytics_add_contrat(conn, cur.lastrowid)
 
         print("✅ Contrat Actif ajouté pour:", c["nom"])
 
@@ -40,5 +70,6 @@ def main():
     conn.close()
     print("🎉 Seed contrats terminé.")
 
+
 if __name__ == "__main__":
     main()
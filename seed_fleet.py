@@ -0,0 +1,194 @@
+"""
+Synthetic fleet generator: fills a throwaway database with realistic volumes.
+
+    python seed_fleet.py /tmp/fleet.db [--cars 3000] [--contrats 150000]
+                         [--demandes 200000] [--clients 100000] [--seed 1]
+
+Never point it at data.db: the target file is created from scratch (schema via
+app.init_db, so migrations, triggers and rollups match production).
+
+Per car the bookings follow a timeline over the last --days-back days and the
+next 60 days with no overlaps, like real rentals: most contrats come from a
+confirmed demande, the rest are walk-ins. The remaining demandes are pending or
+cancelled requests spread over the same period.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+BRANDS = {
+    "Citadine": (["Dacia Sandero", "Renault Clio", "Peugeot 208", "Kia Picanto", "Hyundai i10",
+                  "Fiat 500", "Toyota Yaris", "Citroën C3"], (200, 350)),
+    "Berline": (["Dacia Logan", "Peugeot 301", "Skoda Octavia", "Volkswagen Passat", "Toyota Corolla",
+                 "Hyundai Elantra"], (300, 550)),
+    "SUV": (["Dacia Duster", "Peugeot 3008", "Hyundai Tucson", "Kia Sportage", "Toyota RAV4",
+             "Volkswagen Tiguan", "Nissan Qashqai"], (450, 900)),
+    "Utilitaire": (["Renault Kangoo", "Ford Transit", "Citroën Berlingo", "Peugeot Partner"], (350, 600)),
+    "Luxe": (["Mercedes Classe C", "BMW Série 3", "Audi A4", "Range Rover Evoque", "Mercedes Classe E"],
+             (900, 2000)),
+}
+CATEGORY_WEIGHTS = {"Citadine": 40, "Berline": 20, "SUV": 25, "Utilitaire": 10, "Luxe": 5}
+FIRST_NAMES = ["Youssef", "Fatima", "Mohamed", "Khadija", "Omar", "Salma", "Amine", "Imane", "Hamza",
+               "Sara", "Mehdi", "Nadia", "Karim", "Hajar", "Anas", "Zineb", "Reda", "Meryem"]
+LAST_NAMES = ["El Amrani", "Benali", "Alaoui", "Tazi", "Idrissi", "Bennani", "Chraibi", "Fassi",
+              "Ouazzani", "Berrada", "Lahlou", "Kettani", "Sqalli", "Naciri", "Zahraoui"]
+CITIES = ["Casablanca", "Rabat", "Marrakech", "Tanger", "Fès", "Agadir", "Oujda", "Kénitra", "Tétouan"]
+PLATE_LETTERS = "ABDEHW"
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    p.add_argument("db", help="target database file (created from scratch)")
+    p.add_argument("--cars", type=int, default=3000)
+    p.add_argument("--contrats", type=int, default=150000)
+    p.add_argument("--demandes", type=int, default=200000)
+    p.add_argument("--clients", type=int, default=100000)
+    p.add_argument("--days-back", type=int, default=730)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--force", action="store_true", help="overwrite the target file if it exists")
+    return p.parse_args(argv)
+
+
+def person(rnd):
+    return f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+
+
+def phone(rnd):
+    return f"06{rnd.randint(0, 10**8 - 1):08d}"
+
+
+def gen_voitures(rnd, n):
+    cats = list(CATEGORY_WEIGHTS)
+    weights = [CATEGORY_WEIGHTS[c] for c in cats]
+    rows = []
+    for i in range(n):
+        cat = rnd.choices(cats, weights)[0]
+        models, (lo, hi) = BRANDS[cat]
+        rows.append((
+            f"{rnd.choice(models)} #{i + 1}",
+            cat,
+            float(rnd.randrange(lo, hi + 1, 10)),
+            f"{rnd.randint(1, 99999)}-{rnd.choice(PLATE_LETTERS)}-{rnd.randint(1, 89)}",
+            "Disponible",
+            None,
+        ))
+    return rows
+
+
+def gen_bookings(rnd, voitures, n_contrats, n_demandes, days_back):
+    """
+    Non-overlapping contrats per car (a share of them backed by a confirmed
+    demande), then extra pending / cancelled demandes until n_demandes.
+    """
+    today = date.today()
+    start = (today - timedelta(days=days_back)).toordinal()
+    end = (today + timedelta(days=60)).toordinal()
+    per_car = max(1, n_contrats // len(voitures))
+    mean_len = 5
+    # a slot = the rental (≈ mean_len + 1 days) + 1 day between two rentals + the gap
+    mean_gap = max(1, (end - start) / per_car - (mean_len + 2))
+
+    demandes, contrats = [], []
+    linked_share = min(0.8, n_demandes / max(n_contrats, 1) * 0.6)
+    for vid, (nom, cat, prix, immat, _, _) in enumerate(voitures, start=1):
+        day = start + rnd.randint(0, int(mean_gap))
+        for _ in range(per_car):
+            jours = max(1, min(30, int(rnd.expovariate(1 / mean_len)) + 1))
+            if day + jours > end:
+                break
+            d1 = date.fromordinal(day).isoformat()
+            d2 = date.fromordinal(day + jours).isoformat()
+            client = person(rnd)
+            demande_ref = None
+            if rnd.random() < linked_share:
+                created = date.fromordinal(day - rnd.randint(1, 20)).isoformat() + " 10:00:00"
+                demandes.append((client, phone(rnd), None, rnd.choice(CITIES), d1, d2, vid, nom,
+                                 None, "Confirmée", created))
+                demande_ref = len(demandes)  # id once inserted in order
+            contrats.append((demande_ref, client, f"AB{rnd.randint(100000, 999999)}",
+                             f"{rnd.randint(1, 99)}/{rnd.randint(100000, 999999)}",
+                             str(rnd.randint(1990, 2022)), vid, nom, immat, cat, d1, d2, jours, prix,
+                             prix * jours, d1 + " 09:00:00", "Actif"))
+            day += jours + 1 + int(rnd.expovariate(1 / mean_gap))
+
+    while len(demandes) < n_demandes:
+        vid = rnd.randrange(len(voitures)) + 1
+        day = rnd.randint(start, end)
+        jours = rnd.randint(1, 10)
+        statut = rnd.choices(["En attente", "Annulée"], [3, 2])[0]
+        demandes.append((person(rnd), phone(rnd), None, rnd.choice(CITIES),
+                         date.fromordinal(day).isoformat(), date.fromordinal(day + jours).isoformat(),
+                         vid, voitures[vid - 1][0], None, statut,
+                         date.fromordinal(day - rnd.randint(0, 30)).isoformat() + " 12:00:00"))
+    return demandes, contrats
+
+
+def gen_clients(rnd, n):
+    now = datetime.now()
+    return [
+        (rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES), phone(rnd),
+         f"{rnd.choice('ABCDEFGHJK')}{rnd.randint(100000, 999999)}", f"{rnd.randint(1, 99)}/{rnd.randint(100000, 999999)}",
+         (now - timedelta(minutes=rnd.randint(0, 3 * 365 * 24 * 60))).strftime("%Y-%m-%d %H:%M:%S"))
+        for _ in range(n)
+    ]
+
+
+def main(argv=None):
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    db = os.path.abspath(args.db)
+    if os.path.basename(db) == "data.db" and os.path.dirname(db) == os.path.dirname(os.path.abspath(__file__)):
+        raise SystemExit("refusing to overwrite the real data.db")
+    if os.path.exists(db):
+        if not args.force:
+            raise SystemExit(f"{db} exists (use --force)")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db + suffix):
+                os.remove(db + suffix)
+
+    os.environ["DB_PATH"] = db
+    os.environ.setdefault("STATUS_REFRESH_INTERVAL", "0")
+    os.environ.setdefault("STATS_RECONCILE_INTERVAL", "0")
+    import app  # noqa: E402  (init_db creates the schema in DB_PATH)
+
+    rnd = random.Random(args.seed)
+    t0 = time.perf_counter()
+    voitures = gen_voitures(rnd, args.cars)
+    demandes, contrats = gen_bookings(rnd, voitures, args.contrats, args.demandes, args.days_back)
+    clients = gen_clients(rnd, args.clients)
+
+    conn = app.get_conn()
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany(
+        "INSERT INTO voitures(nom,categorie,prix_jour,immatriculation,statut,image) VALUES(?,?,?,?,?,?)",
+        voitures,
+    )
+    conn.executemany("""
+        INSERT INTO demandes(nom,tel,email,ville,date_debut,date_fin,voiture_id,voiture,notes,statut,created_at)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?)
+    """, demandes)
+    conn.executemany("""
+        INSERT INTO contrats(demande_id,client_nom,client_cin,client_permis,annee_permis,voiture_id,voiture_nom,
+                             immatriculation,categorie,date_debut,date_fin,jours,prix_jour,total,created_at,statut)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """, contrats)
+    conn.executemany(
+        "INSERT INTO clients(prenom,nom,tel,cin_num,permis_num,created_at) VALUES(?,?,?,?,?,?)", clients
+    )
+    app._rebuild_analytics(conn)
+    conn.commit()
+    conn.execute("ANALYZE")
+
+    with app.app.app_context():
+        updated = app.refresh_car_statuses()
+        app.reconcile_dashboard_stats()
+    conn.close()
+
+    print(f"{db}: {len(voitures)} voitures, {len(demandes)} demandes, {len(contrats)} contrats, "
+          f"{len(clients)} clients ({updated} louées aujourd'hui) in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
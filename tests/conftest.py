@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app reads its config at import: throwaway database, no background threads
+_tmp = tempfile.mkdtemp()
+os.environ["DB_PATH"] = os.path.join(_tmp, "test.db")
+os.environ.setdefault("JOB_WORKERS", "0")
+os.environ.setdefault("STATUS_REFRESH_INTERVAL", "0")
+os.environ.setdefault("STATS_RECONCILE_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def m():
+    return app_module
+
+
+@pytest.fixture
+def ctx(m):
+    with m.app.app_context():
+        yield
@@ -0,0 +1,82 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+
+def _rollups(m):
+    conn = m.get_conn()
+    daily = {r[0]: tuple(r[1:]) for r in conn.execute("SELECT * FROM analytics_daily")}
+    car_month = {tuple(r[:2]): tuple(r[2:]) for r in conn.execute("SELECT * FROM analytics_car_month")}
+    conn.close()
+    return daily, car_month
+
+
+def _assert_same(got, want):
+    assert got.keys() == want.keys()
+    for key, row in want.items():
+        assert got[key] == pytest.approx(row), key
+
+
+@pytest.mark.parametrize("engine", ["numpy", "python"])
+def test_incremental_rollups_match_a_rebuild(m, ctx, monkeypatch, engine):
+    if engine == "python":
+        monkeypatch.setattr(m, "np", None)
+    elif m.np is None:
+        pytest.skip("numpy not installed")
+    m.rebuild_analytics()
+
+    rnd = random.Random(12)
+    conn = m.get_conn()
+    cars = [
+        conn.execute("INSERT INTO voitures(nom, statut, prix_jour) VALUES('Test', 'Disponible', ?)",
+                     (rnd.choice([None, 250, 400]),)).lastrowid
+        for _ in range(3)
+    ]
+    rids = []
+    for _ in range(40):
+        d1 = date(2035, 1, 1) + timedelta(days=rnd.randint(0, 120))
+        rids.append(conn.execute(
+            "INSERT INTO demandes(nom, tel, date_debut, date_fin, voiture, voiture_id, statut) "
+            "VALUES('X', '0600000000', ?, ?, 'Test', ?, 'En attente')",
+            (d1.isoformat(), (d1 + timedelta(days=rnd.randint(1, 40))).isoformat(), rnd.choice(cars)),
+        ).lastrowid)
+    conn.commit()
+    conn.close()
+
+    # confirm, cancel, confirm again: contrats in and out of the rollups
+    for st in ("Confirmée", "Annulée", "Confirmée", "En attente"):
+        for rid in rnd.sample(rids, 25):
+            try:
+                m.run_booking(m.set_demande_statut, rid, st)
+            except m.BookingConflict:
+                pass
+
+    incremental = _rollups(m)
+    m.rebuild_analytics()
+    rebuilt = _rollups(m)
+    _assert_same(incremental[0], rebuilt[0])
+    _assert_same(incremental[1], rebuilt[1])
+
+
+def test_cancelling_a_demande_cancels_its_contrat(m, ctx):
+    conn = m.get_conn()
+    vid = conn.execute("INSERT INTO voitures(nom, statut, prix_jour) VALUES('Test', 'Disponible', 300)").lastrowid
+    rid = conn.execute(
+        "INSERT INTO demandes(nom, tel, date_debut, date_fin, voiture, voiture_id, statut) "
+        "VALUES('X', '0600000000', '2036-05-01', '2036-05-04', 'Test', ?, 'En attente')",
+        (vid,),
+    ).lastrowid
+    conn.commit()
+    conn.close()
+
+    _, contrat_id = m.run_booking(m.set_demande_statut, rid, "Confirmée")
+    assert m.run_booking(m.set_demande_statut, rid, "Annulée")[1] == contrat_id
+    m.availability_index.invalidate()
+    assert m.is_car_available_between(vid, "2036-05-02", "2036-05-02")
+    assert m.run_booking(m.set_demande_statut, rid, "Confirmée")[1] == contrat_id
+
+    conn = m.get_conn()
+    assert conn.execute("SELECT COUNT(*) FROM contrats WHERE demande_id=?", (rid,)).fetchone()[0] == 1
+    assert conn.execute("SELECT statut FROM contrats WHERE id=?", (contrat_id,)).fetchone()[0] == "Actif"
+    conn.close()
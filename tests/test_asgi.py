@@ -0,0 +1,74 @@
+import asyncio
+from urllib.parse import urlencode
+
+
+def call(m, method, path, chunks=(b"",), headers=(), disconnect=False):
+    """Run one request through asgi_app; returns (status, headers, body) or None when nothing was sent."""
+    messages = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1} for i, c in enumerate(chunks)]
+    if disconnect:
+        messages = messages[:1] + [{"type": "http.disconnect"}]
+        messages[0]["more_body"] = True
+    path, _, qs = path.partition("?")
+    scope = {"type": "http", "method": method, "path": path, "query_string": qs.encode(),
+             "headers": [(b"host", b"testserver"), *headers], "http_version": "1.1", "scheme": "http",
+             "server": ("testserver", 80), "client": ("127.0.0.1", 1234)}
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(m.asgi_app(scope, receive, send))
+    if not sent:
+        return None
+    head = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return sent[0]["status"], head, b"".join(x.get("body", b"") for x in sent[1:])
+
+
+FORM = [(b"content-type", b"application/x-www-form-urlencoded")]
+
+
+def _count(m, table):
+    conn = m.get_conn()
+    n = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.close()
+    return n
+
+
+def test_chunked_body_async_view(m):
+    body = urlencode({"nom": "Chunk", "email": "c@x.ma", "message": "é" * 50, "submit_token": "asgi-chunks"}).encode()
+    n = _count(m, "contacts")
+    status, _, page = call(m, "POST", "/contact", [body[:7], body[7:40], body[40:]], FORM)
+    assert status == 200 and "envoyé" in page.decode()
+    assert _count(m, "contacts") == n + 1
+
+
+def test_chunked_body_wsgi_fallback(m):
+    body = urlencode({"username": "admin", "password": "1234"}).encode()
+    status, headers, _ = call(m, "POST", "/login", [body[:5], body[5:]], FORM)
+    assert status == 302 and "set-cookie" in headers
+
+
+def test_head_has_length_no_body(m):
+    status, get_headers, page = call(m, "GET", "/qui-sommes-nous")
+    assert status == 200 and page
+    status, headers, body = call(m, "HEAD", "/qui-sommes-nous")
+    assert status == 200 and body == b""
+    assert headers["content-length"] == get_headers["content-length"] == str(len(page))
+
+
+def test_content_length_over_limit(m, monkeypatch):
+    monkeypatch.setitem(m.app.config, "MAX_CONTENT_LENGTH", 100)
+    status, _, _ = call(m, "POST", "/contact", [b"x" * 10], FORM + [(b"content-length", b"5000")])
+    assert status == 413
+    # no Content-Length (chunked upload): checked while buffering
+    status, _, _ = call(m, "POST", "/demande", [b"x" * 60, b"x" * 60], FORM)
+    assert status == 413
+
+
+def test_client_disconnect(m):
+    n = _count(m, "contacts")
+    assert call(m, "POST", "/contact", [b"nom=a&email=b&message=c"], FORM, disconnect=True) is None
+    assert _count(m, "contacts") == n
@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+import pytest
+
+
+def _add_car(m, bookings):
+    """A car with contrats Actif on the given (date_debut, date_fin) pairs; returns its id."""
+    conn = m.get_conn()
+    vid = conn.execute("INSERT INTO voitures(nom, statut) VALUES('Test', 'Disponible')").lastrowid
+    for d1, d2 in bookings:
+        conn.execute(
+            "INSERT INTO contrats(client_nom, voiture_id, voiture_nom, date_debut, date_fin, statut) "
+            "VALUES('X', ?, 'Test', ?, ?, 'Actif')",
+            (vid, d1, d2),
+        )
+    conn.commit()
+    conn.close()
+    m.availability_index.invalidate()
+    return vid
+
+
+@pytest.mark.parametrize("bookings", [
+    [("2030-03-10", "2030-01-01")],                            # reversed
+    [("2030-02-07", "2030-02-07")],                            # same day
+    [("2030-03-10", "2030-01-01"), ("2030-01-05", "2030-01-06"), ("2030-04-01", "2030-04-01")],
+])
+def test_index_matches_sql(m, ctx, bookings):
+    vid = _add_car(m, bookings)
+    start = date(2029, 12, 25)
+    for i in range(120):
+        for span in (0, 3):
+            dd = start + timedelta(days=i)
+            df = dd + timedelta(days=span)
+            indexed = m.availability_index.count_overlaps(vid, dd.toordinal(), df.toordinal()) == 0
+            assert indexed == m._sql_car_available_between(vid, dd, df), (dd, df)
+
+
+def test_reversed_booking_blocks_inside_days(m, ctx):
+    vid = _add_car(m, [("2030-03-10", "2030-01-01")])
+    assert not m.is_car_available_between(vid, "2030-02-07", "2030-02-07")
+    m.availability_index.add(("contrat", -1), vid, "2030-06-10", "2030-06-01")
+    assert m.availability_index.count_overlaps(vid, date(2030, 6, 5).toordinal(), date(2030, 6, 5).toordinal()) == 1
+
+
+def test_demande_form_rejects_reversed_dates(m):
+    base = dict(nom="A", tel="0600000000", ville="R", voiture="Test")
+    _, errors = m.demande_form(dict(base, date_debut="2030-03-10", date_fin="2030-01-01"))
+    assert "date_fin" in errors
+    _, errors = m.demande_form(dict(base, date_debut="2030-03-10", date_fin="2030-03-10"))
+    assert errors == {}
+
+
+def test_fleet_masks_keep_reversed_bookings(m, ctx):
+    vid = _add_car(m, [("2030-03-10", "2030-03-05")])
+    conn = m.get_conn()
+    masks = m.fleet_busy_masks(conn, "2030-03-01", "2030-03-14")
+    free = [v["id"] for v in m.free_voitures(conn, [{"id": vid}], "2030-03-07", "2030-03-07")]
+    conn.close()
+    assert m.mask_days(masks[vid], 14) == "0000111111" + "0000"
+    assert free == []
+
+
+def test_reversed_booking_rents_the_car_today(m, ctx):
+    today = date.today()
+    vid = _add_car(m, [((today + timedelta(days=2)).isoformat(), (today - timedelta(days=2)).isoformat())])
+    m.refresh_car_statuses()
+    conn = m.get_conn()
+    assert conn.execute("SELECT statut FROM voitures WHERE id=?", (vid,)).fetchone()[0] == "Louée"
+    conn.close()
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+
+def _car(conn):
+    return conn.execute("INSERT INTO voitures(nom, statut) VALUES('Test', 'Disponible')").lastrowid
+
+
+def _demande(conn, vid, d1, d2):
+    return conn.execute(
+        "INSERT INTO demandes(nom, tel, date_debut, date_fin, voiture, voiture_id, statut) "
+        "VALUES('X', '0600000000', ?, ?, 'Test', ?, 'En attente')",
+        (d1, d2, vid),
+    ).lastrowid
+
+
+def test_reversed_contrat_blocks_confirmation(m, ctx):
+    conn = m.get_conn()
+    vid = _car(conn)
+    conn.execute(
+        "INSERT INTO contrats(client_nom, voiture_id, voiture_nom, date_debut, date_fin, statut) "
+        "VALUES('X', ?, 'Test', '2031-03-10', '2031-01-01', 'Actif')",
+        (vid,),
+    )
+    rid = _demande(conn, vid, "2031-02-07", "2031-02-08")
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(m.BookingConflict):
+        m.run_booking(m.set_demande_statut, rid, "Confirmée")
+
+
+@pytest.mark.parametrize("write_queue", [True, False])
+def test_concurrent_confirmations_keep_one_booking(m, monkeypatch, write_queue):
+    monkeypatch.setattr(m, "DB_WRITE_QUEUE", write_queue)
+    conn = m.get_conn()
+    vid = _car(conn)
+    # كل demande كتداخل مع اللي حداها
+    rids = [_demande(conn, vid, f"2032-01-{1 + i:02d}", f"2032-01-{3 + i:02d}") for i in range(12)]
+    conn.commit()
+    conn.close()
+
+    barrier = threading.Barrier(len(rids))
+    statuses = {}
+
+    def confirm(rid):
+        client = m.app.test_client()
+        with client.session_transaction() as s:
+            s["admin_ok"] = True
+        barrier.wait()
+        statuses[rid] = client.post(f"/admin/reservations/{rid}/statut/Confirmée").status_code
+
+    threads = [threading.Thread(target=confirm, args=(rid,)) for rid in rids]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(set(statuses.values())) <= [302, 400] and 302 in statuses.values()
+    conn = m.get_conn()
+    confirmed = conn.execute(
+        "SELECT id, date_debut, date_fin FROM demandes WHERE voiture_id=? AND statut='Confirmée'", (vid,)
+    ).fetchall()
+    assert {r["id"] for r in confirmed} == {rid for rid, code in statuses.items() if code == 302}
+    for i, a in enumerate(confirmed):
+        for b in confirmed[i + 1:]:
+            assert a["date_fin"] < b["date_debut"] or b["date_fin"] < a["date_debut"], (dict(a), dict(b))
+
+    contrats = conn.execute(
+        "SELECT demande_id, COUNT(*) FROM contrats WHERE voiture_id=? AND statut='Actif' GROUP BY demande_id",
+        (vid,),
+    ).fetchall()
+    conn.close()
+    assert {r[0]: r[1] for r in contrats} == {r["id"]: 1 for r in confirmed}
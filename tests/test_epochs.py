@@ -0,0 +1,55 @@
+import pytest
+
+
+@pytest.fixture
+def dropped(m, monkeypatch):
+    """Names of the caches SharedEpoch invalidates during the test."""
+    monkeypatch.setattr(m, "CACHE_EPOCH_CHECK", True)
+    monkeypatch.setattr(m, "shared_epoch", m.SharedEpoch())
+    names = []
+    monkeypatch.setattr(m.availability_index, "invalidate", lambda: names.append("availability"))
+    monkeypatch.setattr(m.catalog_cache, "invalidate", lambda: names.append("catalog"))
+    monkeypatch.setattr(m.image_variants, "invalidate", lambda: names.append("images"))
+    return names
+
+
+def _sync(m):
+    conn = m.get_conn()
+    m.shared_epoch.sync(conn)
+    conn.close()
+
+
+@pytest.mark.parametrize("write_queue", [True, False])
+def test_own_writes_do_not_invalidate(m, ctx, dropped, monkeypatch, write_queue):
+    monkeypatch.setattr(m, "DB_WRITE_QUEUE", write_queue)
+    _sync(m)
+    vid = m.execute_write("INSERT INTO voitures(nom, statut) VALUES('Test', 'Disponible')")
+    m.execute_write(
+        "INSERT INTO contrats(client_nom, voiture_id, voiture_nom, date_debut, date_fin, statut) "
+        "VALUES('X', ?, 'Test', '2033-01-01', '2033-01-05', 'Actif')",
+        (vid,),
+    )
+    _sync(m)
+    assert dropped == []
+
+
+def test_foreign_writes_invalidate_their_cache_only(m, ctx, dropped):
+    _sync(m)
+    other = m.get_conn()  # another worker
+    vid = other.execute("INSERT INTO voitures(nom, statut) VALUES('Test', 'Disponible')").lastrowid
+    other.commit()
+    _sync(m)
+    assert dropped == ["catalog"]
+
+    dropped.clear()
+    other.execute(
+        "INSERT INTO contrats(client_nom, voiture_id, voiture_nom, date_debut, date_fin, statut) "
+        "VALUES('X', ?, 'Test', '2033-02-01', '2033-02-05', 'Actif')",
+        (vid,),
+    )
+    other.commit()
+    other.close()
+    # own write after the foreign one: the foreign bump is still seen
+    m.execute_write("UPDATE contrats SET statut='Actif' WHERE voiture_id=?", (vid,))
+    _sync(m)
+    assert dropped == ["availability"]
@@ -0,0 +1,35 @@
+class _FakeWeasy:
+    """Records what FacturePdfs hands to WeasyPrint (not installed here)."""
+
+    def __init__(self):
+        self.calls = []
+
+    def HTML(self, string, base_url, url_fetcher):
+        self.calls.append((string, base_url))
+        return self
+
+    def write_pdf(self):
+        return b"%PDF-1.7 test"
+
+
+def test_build_outside_a_request(m, monkeypatch, tmp_path):
+    weasy = _FakeWeasy()
+    monkeypatch.setattr(m, "weasyprint", weasy)
+    monkeypatch.setattr(m.facture_pdfs, "folder", str(tmp_path))
+    conn = m.get_conn()
+    vid = conn.execute("INSERT INTO voitures(nom, statut, prix_jour) VALUES('Test', 'Disponible', 300)").lastrowid
+    rid = conn.execute(
+        "INSERT INTO demandes(nom, tel, date_debut, date_fin, voiture, voiture_id, statut) "
+        "VALUES('X', '0600000000', '2034-01-01', '2034-01-04', 'Test', ?, 'Confirmée')",
+        (vid,),
+    ).lastrowid
+    conn.commit()
+    conn.close()
+
+    # pool thread: no request context, as in the job workers
+    path = m.facture_pdfs.pool.submit(m.facture_pdfs.build, rid).result()
+
+    assert open(path, "rb").read() == b"%PDF-1.7 test"
+    html, base_url = weasy.calls[0]
+    assert base_url == m.FACTURE_BASE_URL
+    assert f"{m.FACTURE_BASE_URL.rstrip('/')}/static/" in html
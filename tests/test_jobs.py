@@ -0,0 +1,53 @@
+import time
+
+
+def _runs(m, kind):
+    conn = m.get_conn()
+    rows = conn.execute("SELECT statut, run_after FROM jobs WHERE kind=? ORDER BY id", (kind,)).fetchall()
+    conn.close()
+    return [tuple(r) for r in rows]
+
+
+def test_scheduled_job_runs_once_per_interval(m):
+    assert m.JOB_SCHEDULE["fleet_alerts"] == 24 * 3600
+    m.run_write(lambda conn: conn.execute("DELETE FROM jobs"))
+
+    # two processes starting at the same time: a single run is queued
+    m.maintain_jobs()
+    m.maintain_jobs()
+    runs = _runs(m, "fleet_alerts")
+    assert [r[0] for r in runs] == [m.JOB_PENDING]
+
+    m.job_queue.run_pending()
+    assert _runs(m, "fleet_alerts")[-1][0] == m.JOB_DONE
+
+    # a worker recycled right after: the next run is tomorrow, not now
+    m.maintain_jobs()
+    m.maintain_jobs()
+    runs = _runs(m, "fleet_alerts")
+    assert [r[0] for r in runs] == [m.JOB_DONE, m.JOB_PENDING]
+    assert runs[1][1] - runs[0][1] >= 24 * 3600 - 1
+    assert runs[1][1] > time.time() + 3600
+    m.job_queue.run_pending()
+    assert _runs(m, "fleet_alerts")[1][0] == m.JOB_PENDING
+
+
+def test_reconcile_is_a_job(m):
+    # STATS_RECONCILE_INTERVAL=0 (conftest): handler registered, never scheduled
+    assert "reconcile_stats" in m.JOB_HANDLERS
+    assert "reconcile_stats" not in m.JOB_SCHEDULE
+
+
+def test_statuses_refresh_inline_without_job_workers(m, ctx):
+    # JOB_WORKERS=0 (conftest): nothing would ever run a queued car_statuses job
+    assert not m.job_queue.running()
+    m.run_write(lambda conn: conn.execute("DELETE FROM jobs"))
+    vid = m.execute_write("INSERT INTO voitures(nom, statut) VALUES('Test', 'Louée')")
+    m.catalog_cache.invalidate()
+
+    m.refresh_car_statuses_inline()
+
+    conn = m.get_conn()
+    assert conn.execute("SELECT statut FROM voitures WHERE id=?", (vid,)).fetchone()[0] == "Disponible"
+    assert conn.execute("SELECT COUNT(*) FROM jobs WHERE kind='car_statuses'").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,26 @@
+import pytest
+
+
+@pytest.fixture
+def conn(m):
+    c = m.get_conn()
+    yield c
+    c.close()
+
+
+def test_hot_queries_use_an_index(m, conn):
+    assert m.HOT_QUERIES
+    scans = {name: m.full_scans(conn, sql, params) for name, (sql, params) in m.HOT_QUERIES.items()}
+    assert {name: steps for name, steps in scans.items() if steps} == {}
+
+
+def test_migrations_are_idempotent(m, conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    assert version == max(v for v, _ in m.MIGRATIONS)
+    schema = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall()
+
+    m.init_db()
+    m.init_db()
+
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == version
+    assert conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY name").fetchall() == schema
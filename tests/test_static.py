@@ -0,0 +1,35 @@
+import os
+
+
+def test_rewrite_css_urls(m):
+    manifest = {"hero_car.png": "dist/hero_car.1234567890.png", "img/bg.svg": "dist/img/bg.abcdefabcd.svg"}
+    css = ('a{background:url("hero_car.png")} b{background:url(img/bg.svg#x)} '
+           "c{background:url('/static/hero_car.png?v=2')} d{background:url(data:image/png;base64,AA==)} "
+           "e{background:url(https://cdn.example.com/x.png)} f{background:url(missing.png)}")
+    out = m.rewrite_css_urls(css, "style.css", manifest)
+    assert 'url("hero_car.1234567890.png")' in out
+    assert "url(img/bg.abcdefabcd.svg#x)" in out
+    assert "url('/static/dist/hero_car.1234567890.png?v=2')" in out
+    assert "url(data:image/png;base64,AA==)" in out and "url(https://cdn.example.com/x.png)" in out
+    assert "url(missing.png)" in out
+    # from a subfolder stylesheet
+    out = m.rewrite_css_urls("x{background:url(../hero_car.png)}", "css/site.css", manifest)
+    assert "url(../hero_car.1234567890.png)" in out
+
+
+def test_build_static_points_css_at_hashed_files(m, tmp_path, monkeypatch):
+    (tmp_path / "css").mkdir()
+    (tmp_path / "hero.png").write_bytes(b"\x89PNG-v1")
+    (tmp_path / "css" / "site.css").write_text("x{background:url('../hero.png')}")
+    monkeypatch.setattr(m.app, "static_folder", str(tmp_path))
+    monkeypatch.setattr(m, "STATIC_MANIFEST_PATH", str(tmp_path / "dist" / "manifest.json"))
+
+    manifest = m.build_static()
+    css = (tmp_path / manifest["css/site.css"]).read_text()
+    ref = css.split("url('")[1].split("'")[0]
+    assert os.path.normpath(os.path.join(tmp_path, os.path.dirname(manifest["css/site.css"]), ref)) == \
+        os.path.normpath(os.path.join(tmp_path, manifest["hero.png"]))
+
+    # a new image gives the stylesheet a new name too
+    (tmp_path / "hero.png").write_bytes(b"\x89PNG-v2")
+    assert m.build_static()["css/site.css"] != manifest["css/site.css"]
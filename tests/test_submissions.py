@@ -0,0 +1,26 @@
+def test_tel_bucket_refunded_when_car_unavailable(m, monkeypatch):
+    guard = m.SubmissionGuard(100)
+    monkeypatch.setattr(guard, "by_ip", m.TokenBuckets(0, 0, 100))
+    monkeypatch.setattr(guard, "by_tel", m.TokenBuckets(3, 0.2, 100))
+    form = dict(tel="0611111111", voiture="Clio", voiture_id="", date_debut="2030-01-01", date_fin="2030-01-02")
+
+    # a customer trying ten dates that are all taken
+    for i in range(10):
+        f = dict(form, submit_token=f"t{i}", date_debut=f"2030-01-{i + 10}")
+        assert guard.begin("demande", f, "1.2.3.4")[0] == "new"
+        guard.abort("demande", f)
+
+    # real spam still runs out
+    outcomes = [guard.begin("demande", dict(form, submit_token=f"s{i}", date_fin=f"2030-02-0{i + 1}"), "1.2.3.4")[0]
+                for i in range(5)]
+    assert outcomes == ["new", "new", "new", "limited", "limited"]
+
+
+def test_client_ip_behind_proxy(m, monkeypatch):
+    headers = {"X-Forwarded-For": "41.0.0.7, 10.0.0.2"}
+    with m.app.test_request_context("/", headers=headers, environ_base={"REMOTE_ADDR": "127.0.0.1"}):
+        assert m.client_ip() == "127.0.0.1"
+        monkeypatch.setattr(m, "PROXY_HOPS", 1)
+        assert m.client_ip() == "10.0.0.2"
+        monkeypatch.setattr(m, "PROXY_HOPS", 2)
+        assert m.client_ip() == "41.0.0.7"
@@ -0,0 +1,16 @@
+"""
+Production entry point:
+
+    gunicorn -c gunicorn.conf.py
+
+The config preloads this module in the gunicorn master, so create_app()
+(and the schema migrations) run once before the workers are forked.
+"""
+import os
+
+os.environ.setdefault("APP_AUTOINIT", "0")
+
+from app import create_app  # noqa: E402
+
+# background jobs are started per worker by the post_fork hook
+app = create_app(background=False)